@@ -0,0 +1,347 @@
+# analytics.py
+
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+
+from market_data import METALS, BASE_CURRENCY, price_columns, sell_price_columns
+
+# Liczba sesji LBMA w roku (annualizacja)
+TRADING_DAYS = 252
+
+# Okna dla stóp zwrotu kroczących (w sesjach)
+ROLLING_WINDOWS = {"1Y": 252, "3Y": 3 * 252, "5Y": 5 * 252}
+
+PORTFOLIO = "Portfolio"
+
+# Okna korelacji i kowariancji kroczących (w sesjach)
+CORRELATION_WINDOWS = {"3M": 63, "6M": 126, "1Y": 252, "3Y": 3 * 252, "5Y": 5 * 252}
+
+# Co tyle przesunięć okna momenty liczone są od nowa (ogranicza dryf zaokrągleń przy odejmowaniu)
+RESYNC_STEPS = 4096
+
+# ====== WYCENA DZIENNA ======
+def daily_valuation(result, prices, plan, days=None):
+    """Dzienna wycena (po cenie odkupu) pozycji w metalach i całego portfela, zainwestowany kapitał i suma wypłat.
+
+    days - dni wyceny (domyślnie od pierwszego do ostatniego zdarzenia wyniku)
+    """
+    currency = plan.get("currency", BASE_CURRENCY)
+    # Wycena po cenach sprzedaży, gdy cena wykonania ma je osobno (market_data.SELL_FIXES)
+    cols = sell_price_columns(currency)
+    if not set(cols).issubset(prices.columns):
+        cols = price_columns(currency)
+    events = result[~result.index.duplicated(keep="last")].sort_index()
+    if days is None:
+        days = prices.loc[events.index.min():events.index.max()].index
+
+    holdings = events[METALS].reindex(days, method="ffill").to_numpy()
+    buyback = np.array([1 + plan["buyback"][m] / 100 for m in METALS])
+    values = holdings * prices.loc[days, cols].to_numpy() * buyback
+
+    valuation = pd.DataFrame(values, index=days, columns=METALS)
+    valuation[PORTFOLIO] = values.sum(axis=1)
+    valuation["Invested"] = events["Invested"].reindex(days, method="ffill").to_numpy()
+    withdrawn = events["Withdrawn"] if "Withdrawn" in events else pd.Series(0.0, index=events.index)
+    valuation["Withdrawn"] = withdrawn.reindex(days, method="ffill").fillna(0.0).to_numpy()
+    return valuation
+
+
+def time_weighted_returns(values, invested, withdrawn=None):
+    """Dzienne stopy zwrotu portfela z wyłączeniem przepływów: dopłaty minus wypłacona gotówka.
+
+    Dopłaty to przyrost kapitału zainwestowanego. W dniu wypłaty kapitał maleje w proporcji sprzedanej
+    części portfela (wypłata / (wartość + wypłata)) - to nie jest przepływ, więc dopłaty z tego dnia
+    odtwarzane są z kapitału sprzed tej redukcji.
+    """
+    cash = np.diff(withdrawn) if withdrawn is not None else np.zeros(len(values) - 1)
+    contributions = np.diff(invested)
+    if cash.any():
+        kept = np.zeros(len(cash))
+        np.divide(values[1:], values[1:] + cash, out=kept, where=cash > 0)
+        restored = np.zeros(len(cash))
+        np.divide(invested[1:], kept, out=restored, where=kept > 0)
+        contributions = np.where(cash > 0, np.maximum(restored - invested[:-1], 0.0), contributions)
+    flows = contributions - cash
+    previous = values[:-1]
+    returns = np.zeros(len(values) - 1)
+    np.divide(values[1:] - flows, previous, out=returns, where=previous > 0)
+    returns[previous > 0] -= 1
+    return returns
+
+
+# ====== STATYSTYKI JEDNOPRZEBIEGOWE ======
+def drawdown_stats(index, dates):
+    """Maksymalne obsunięcie (bieżące maksimum) i najdłuższy okres pod kreską w dniach kalendarzowych"""
+    peak = np.maximum.accumulate(index)
+    drawdown = index / peak - 1
+
+    # Okresy pod kreską: od ostatniego szczytu do powrotu na szczyt (lub końca danych)
+    underwater = drawdown < 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], underwater.view(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    longest = 0
+    for start, end in zip(starts, ends):
+        last = min(end, len(dates) - 1)
+        longest = max(longest, (dates[last] - dates[max(start - 1, 0)]).days)
+
+    return {
+        "max_drawdown": float(drawdown.min()) if len(drawdown) else 0.0,
+        "current_drawdown": float(drawdown[-1]) if len(drawdown) else 0.0,
+        "time_under_water_days": int(longest),
+        "drawdown": drawdown,
+    }
+
+
+def rolling_max(values, window):
+    """Maksimum kroczące w O(n) - kolejka monotoniczna indeksów"""
+    out = np.empty(len(values))
+    queue = deque()
+    for i, value in enumerate(values):
+        while queue and values[queue[-1]] <= value:
+            queue.pop()
+        queue.append(i)
+        if queue[0] <= i - window:
+            queue.popleft()
+        out[i] = values[queue[0]]
+    return out
+
+
+def rolling_returns(returns, window):
+    """Annualizowane stopy zwrotu we wszystkich oknach o długości window (sumy skumulowane logarytmów)"""
+    if len(returns) < window:
+        return np.array([])
+    cumulative = np.concatenate(([0.0], np.cumsum(np.log1p(returns))))
+    growth = cumulative[window:] - cumulative[:-window]
+    return np.expm1(growth * TRADING_DAYS / window)
+
+
+def rolling_volatility(returns, window):
+    """Annualizowana zmienność krocząca z sum skumulowanych r i r^2"""
+    if len(returns) < window:
+        return np.array([])
+    s1 = np.concatenate(([0.0], np.cumsum(returns)))
+    s2 = np.concatenate(([0.0], np.cumsum(returns * returns)))
+    w1 = s1[window:] - s1[:-window]
+    w2 = s2[window:] - s2[:-window]
+    variance = np.maximum((w2 - w1 * w1 / window) / (window - 1), 0.0)
+    return np.sqrt(variance * TRADING_DAYS)
+
+
+def return_stats(returns, dates, risk_free=0.0):
+    """Statystyki stóp zwrotu: CAGR, zmienność, Sharpe, Sortino, stopy kroczące"""
+    n = len(returns)
+    years = (dates[-1] - dates[0]).days / 365.25 if n else 0.0
+    total_growth = float(np.exp(np.log1p(returns).sum())) if n else 1.0
+    daily_rf = risk_free / TRADING_DAYS
+
+    mean = returns.mean() if n else 0.0
+    std = returns.std(ddof=1) if n > 1 else 0.0
+    downside = np.minimum(returns - daily_rf, 0.0)
+    downside_dev = np.sqrt((downside * downside).mean()) if n else 0.0
+
+    stats = {
+        "cagr": total_growth ** (1 / years) - 1 if years > 0 else 0.0,
+        "volatility": float(std * np.sqrt(TRADING_DAYS)),
+        "sharpe": float((mean - daily_rf) / std * np.sqrt(TRADING_DAYS)) if std > 0 else 0.0,
+        "sortino": float((mean - daily_rf) / downside_dev * np.sqrt(TRADING_DAYS)) if downside_dev > 0 else 0.0,
+        "rolling": {},
+    }
+    for label, window in ROLLING_WINDOWS.items():
+        rolled = rolling_returns(returns, window)
+        if len(rolled):
+            stats["rolling"][label] = {
+                "min": float(rolled.min()),
+                "median": float(np.median(rolled)),
+                "max": float(rolled.max()),
+                "share_negative": float((rolled < 0).mean()),
+                "max_volatility": float(rolling_volatility(returns, window).max()),
+            }
+    return stats
+
+
+def series_stats(index, dates, risk_free=0.0):
+    """Komplet statystyk dla szeregu indeksowego (wartość jednostki / cena)"""
+    returns = np.zeros(len(index) - 1)
+    np.divide(index[1:], index[:-1], out=returns, where=index[:-1] > 0)
+    returns[index[:-1] > 0] -= 1
+    stats = return_stats(returns, dates, risk_free)
+    stats.update(drawdown_stats(index, dates))
+    trailing_high = rolling_max(index, TRADING_DAYS)
+    stats["max_drawdown_from_52w_high"] = float((index / trailing_high - 1).min())
+    return stats
+
+
+# ====== KORELACJE KROCZĄCE ======
+class SlidingCovariance:
+    """Średnia i współmomenty obserwacji w oknie przesuwnym (Welford: dodanie i usunięcie w O(k^2))"""
+
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.comoment = np.zeros((size, size))
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.comoment += np.outer(delta, x - self.mean)
+
+    def remove(self, x):
+        self.count -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        self.comoment -= np.outer(delta, x - self.mean)
+
+    def reset(self, rows):
+        """Momenty liczone wprost z obserwacji okna (rows: n x k)"""
+        self.count = len(rows)
+        self.mean = rows.mean(axis=0)
+        centered = rows - self.mean
+        self.comoment = centered.T @ centered
+
+    def covariance(self):
+        return self.comoment / (self.count - 1) if self.count > 1 else np.zeros_like(self.comoment)
+
+
+def rolling_covariance(returns, window, step=1):
+    """Annualizowane macierze kowariancji dziennych stóp zwrotu (T x k) we wszystkich oknach o długości window.
+
+    Jeden przebieg: każda sesja jest raz dodawana i raz usuwana z okna. Zwraca (pozycje ostatnich sesji
+    okien co step, tablica K x k x k).
+    """
+    size = returns.shape[1]
+    ends = np.arange(window - 1, len(returns), step)
+    covariances = np.empty((len(ends), size, size))
+    moments = SlidingCovariance(size)
+    k = 0
+    for t in range(len(returns)):
+        if t >= window and (t - window) % RESYNC_STEPS == RESYNC_STEPS - 1:
+            moments.reset(returns[t - window + 1:t + 1])
+        else:
+            moments.add(returns[t])
+            if t >= window:
+                moments.remove(returns[t - window])
+        if k < len(ends) and t == ends[k]:
+            covariances[k] = moments.covariance() * TRADING_DAYS
+            k += 1
+    return ends, covariances
+
+
+def correlation_matrices(covariances):
+    """Korelacje z macierzy kowariancji (K x k x k); metal bez zmian cen w oknie ma korelacje 0"""
+    std = np.sqrt(np.maximum(np.diagonal(covariances, axis1=1, axis2=2), 0.0))
+    scale = std[:, :, None] * std[:, None, :]
+    correlations = np.zeros_like(covariances)
+    np.divide(covariances, scale, out=correlations, where=scale > 0)
+    correlations[:, np.arange(covariances.shape[1]), np.arange(covariances.shape[1])] = 1.0
+    return correlations
+
+
+def min_variance_weights(covariances):
+    """Wagi portfela o minimalnej wariancji bez krótkiej sprzedaży dla każdej macierzy (K x k x k).
+
+    Rozwiązanie z ograniczeniem w >= 0 jest rozwiązaniem bez ograniczeń na swoim nośniku, więc
+    wystarczy przejrzeć wszystkie niepuste podzbiory metali (15 dla czterech) i wybrać najlepszy
+    dopuszczalny. Zwraca (wagi K x k, wariancja K).
+    """
+    count, size = covariances.shape[:2]
+    best_weights = np.zeros((count, size))
+    best_variance = np.full(count, np.inf)
+    for subset_size in range(1, size + 1):
+        for subset in itertools.combinations(range(size), subset_size):
+            columns = list(subset)
+            block = covariances[:, columns][:, :, columns]
+            # Okna z macierzą (prawie) osobliwą pomijamy dla tego podzbioru; det <= iloczyn wariancji (Hadamard)
+            scale = np.prod(np.diagonal(block, axis1=1, axis2=2), axis=1)
+            regular = (scale > 0) & (np.linalg.det(block) > 1e-12 * scale)
+            x = np.zeros((count, subset_size))
+            if regular.any():
+                x[regular] = np.linalg.solve(block[regular], np.ones((regular.sum(), subset_size, 1)))[:, :, 0]
+            total = x.sum(axis=1)
+            feasible = regular & (total > 0) & (x >= -1e-12 * np.abs(x).max(axis=1, initial=0.0)[:, None]).all(axis=1)
+            variance = np.full(count, np.inf)
+            variance[feasible] = 1 / total[feasible]
+            better = variance < best_variance
+            best_variance[better] = variance[better]
+            weights = np.zeros((better.sum(), size))
+            weights[:, columns] = np.maximum(x[better], 0.0) / total[better][:, None]
+            best_weights[better] = weights
+    return best_weights, best_variance
+
+
+def rolling_correlations(prices, window, step=1):
+    """Kroczące kowariancje, korelacje i portfel minimalnej wariancji dla metali (kolumny prices).
+
+    Zwraca słownik: dates (ostatnia sesja okna), covariance, correlation, min_variance (wagi),
+    min_volatility (annualizowana zmienność tego portfela).
+    """
+    values = prices.to_numpy(dtype=float)
+    returns = values[1:] / values[:-1] - 1
+    ends, covariances = rolling_covariance(returns, window, step)
+    weights, variance = min_variance_weights(covariances)
+    return {
+        "dates": prices.index[1:][ends],
+        "covariance": covariances,
+        "correlation": correlation_matrices(covariances),
+        "min_variance": weights,
+        "min_volatility": np.sqrt(np.maximum(variance, 0.0)),
+    }
+
+
+# ====== BŁĄD PODGLĄDU ======
+def preview_error(preview, exact, prices, plan):
+    """Względny błąd podglądu (engine.simulate_preview) wobec wyniku dokładnego na dniach podglądu.
+
+    final - różnica wartości w ostatnim dniu podglądu, max - największa różnica bezwzględna na krzywej.
+    """
+    events = preview[~preview.index.duplicated(keep="last")]
+    exact_values = daily_valuation(exact, prices, plan, days=events.index)[PORTFOLIO].to_numpy()
+    preview_values = events["Portfolio Value"].to_numpy()
+    relative = (preview_values - exact_values) / np.maximum(np.abs(exact_values), 1.0)
+    return {"final": float(relative[-1]), "max": float(np.nanmax(np.abs(relative)))}
+
+
+# ====== PAMIĘĆ PODRĘCZNA ======
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 32
+
+
+def result_hash(result):
+    """Skrót zawartości wyniku symulacji"""
+    hashed = pd.util.hash_pandas_object(result, index=True).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+
+def analyze(result, prices, plan, key=None, risk_free=0.0):
+    """Statystyki ryzyka dla portfela (stopy ważone czasem) i każdego metalu (ceny), z pamięcią per wynik"""
+    cache_key = (key or result_hash(result), plan.get("currency", BASE_CURRENCY), risk_free)
+    with _cache_lock:
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            return _cache[cache_key]
+
+    valuation = daily_valuation(result, prices, plan)
+    dates = valuation.index
+    values = valuation[PORTFOLIO].to_numpy()
+
+    # Indeks portfela odporny na dopłaty i wypłaty: jednostka startuje z wartością 1
+    twr = time_weighted_returns(values, valuation["Invested"].to_numpy(), valuation["Withdrawn"].to_numpy())
+    portfolio_index = np.concatenate(([1.0], np.cumprod(1 + twr)))
+
+    analysis = {PORTFOLIO: series_stats(portfolio_index, dates, risk_free)}
+    metal_prices = prices.loc[dates, price_columns(plan.get("currency", BASE_CURRENCY))].to_numpy()
+    for i, metal in enumerate(METALS):
+        analysis[metal] = series_stats(metal_prices[:, i], dates, risk_free)
+    analysis["dates"] = dates
+
+    with _cache_lock:
+        _cache[cache_key] = analysis
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return analysis
@@ -0,0 +1,292 @@
+# api.py
+"""Lokalne API HTTP/JSON silnika symulacji (bez Streamlit).
+
+    python api.py --port 8765
+
+POST /simulate        preset w formacie plików z presets/ (+ opcjonalnie "currency", "ledger": true)
+POST /simulate/batch  {"presets": [...], "ledger": false}
+GET  /health, GET /stats
+
+Identyczne równoczesne zapytania są łączone w jedno obliczenie, zgodne zapytania (wspólna waluta
+i cena wykonania, engine.PRICE_KEYS - zakresy dat mogą się różnić) napływające w oknie BATCH_WINDOW liczone są jednym wywołaniem engine.simulate_batch,
+a powtórki obsługuje ograniczona pamięć podręczna LRU.
+"""
+
+import sys
+import json
+import argparse
+import threading
+from collections import OrderedDict, Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import engine
+import market_data
+from market_data import METALS, TROY_OUNCE_TO_GRAM
+
+# Okno zbierania zapytań do jednej paczki (sekundy) i jej maksymalny rozmiar
+BATCH_WINDOW = 0.02
+MAX_BATCH = 32
+CACHE_SIZE = 256
+REQUEST_TIMEOUT = 300
+
+
+def plan_key(plan, version):
+    return json.dumps(plan, sort_keys=True, default=str) + "@" + version
+
+
+def plan_from_payload(payload):
+    """Plan z presetu; błędy danych wejściowych jako ValueError (odpowiedź 400)"""
+    if not isinstance(payload, dict):
+        raise ValueError("Oczekiwano obiektu JSON z presetem")
+    # Kody sprawdzane przed normalizacją - nieznana wartość nie może zmienić się w domyślną
+    engine.check_preset_codes(payload)
+    try:
+        plan = engine.plan_from_preset(payload, payload.get("currency"))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Niepełny preset: {e}")
+    if abs(sum(plan["allocation"].values()) - 1.0) > 1e-9:
+        raise ValueError("Suma alokacji musi wynosić 100%")
+    try:
+        return engine.check_plan(plan)
+    except TypeError as e:
+        raise ValueError(f"Niepoprawny preset: {e}")
+
+
+def metrics(result, plan, cpi=None):
+    """Najważniejsze liczby wyniku (jak w podsumowaniu aplikacji); cpi - waluta CPI wartości realnej"""
+    cpi = cpi or plan["currency"]
+    invested = float(result["Invested"].max())
+    value = float(result["Portfolio Value"].iloc[-1])
+    years = (result.index.max() - result.index.min()).days / 365.25
+    storage = result[result["Akcja"] == "storage_fee"]
+    storage_cost = float((storage["Invested"] * (plan["storage_fee"] / 100) * (1 + plan["vat"] / 100)).sum())
+    return {
+        "currency": plan["currency"],
+        "start_date": result.index.min().date().isoformat(),
+        "end_date": result.index.max().date().isoformat(),
+        "invested": invested,
+        "portfolio_value": value,
+        "portfolio_value_real": float(result["Portfolio Value Real"].iloc[-1]),
+        "real_value_cpi": cpi,
+        **({"real_value_note": f"Brak CPI dla {plan['currency']} - wartość realna według inflacji {cpi}"}
+           if cpi != plan["currency"] else {}),
+        "profit": value - invested,
+        "annual_return": (value / invested) ** (1 / years) - 1 if invested > 0 and years > 0 else 0.0,
+        "holdings_g": {m: float(result[m].iloc[-1]) * TROY_OUNCE_TO_GRAM for m in METALS},
+        "storage_cost_total": storage_cost,
+        "rebalances": int(result["Akcja"].str.contains(r"(?:^|, )rebalance_\d", regex=True).sum()),
+    }
+
+
+def ledger(result):
+    return [{
+        "date": date.date().isoformat(),
+        "invested": float(row["Invested"]),
+        **{f"{m}_g": float(row[m]) * TROY_OUNCE_TO_GRAM for m in METALS},
+        "portfolio_value": float(row["Portfolio Value"]),
+        "portfolio_value_real": float(row["Portfolio Value Real"]),
+        "action": row["Akcja"],
+    } for date, row in result.iterrows()]
+
+
+class SimulationService:
+    """Łączenie równoczesnych zapytań, paczkowanie zgodnych planów i pamięć LRU wyników"""
+
+    def __init__(self, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, cache_size=CACHE_SIZE, max_workers=2):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.stats = Counter()
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api-batch")
+
+    def submit(self, plan):
+        """Future z wynikiem symulacji (DataFrame jak simulate() + Portfolio Value Real)"""
+        market = market_data.shared_market_data()
+        if plan["currency"] not in market.currencies:
+            raise ValueError(f"Nieobsługiwana waluta: {plan['currency']}")
+        if plan["execution_fix"] not in market.fixes:
+            raise ValueError(f"Niedostępna cena wykonania: {plan['execution_fix']}")
+        key = plan_key(plan, market.version)
+        group = (market.version,) + tuple(str(plan[k]) for k in engine.PRICE_KEYS) + tuple(plan["allocation"])
+
+        with self._lock:
+            self.stats["requests"] += 1
+            if key in self._cache:
+                self.stats["cache_hits"] += 1
+                self._cache.move_to_end(key)
+                future = Future()
+                future.set_result(self._cache[key])
+                return future
+            if key in self._inflight:
+                self.stats["coalesced"] += 1
+                return self._inflight[key]
+
+            future = Future()
+            self._inflight[key] = future
+            items = self._pending.setdefault(group, [])
+            items.append((key, plan, future))
+            if len(items) == 1:
+                timer = threading.Timer(self.batch_window, self._flush, args=(group, market))
+                timer.daemon = True
+                timer.start()
+            elif len(items) >= self.max_batch:
+                self._flush_locked(group, market)
+        return future
+
+    def _flush(self, group, market):
+        with self._lock:
+            self._flush_locked(group, market)
+
+    def _flush_locked(self, group, market):
+        items = self._pending.pop(group, None)
+        if items:
+            self._executor.submit(self._run_batch, items, market)
+
+    def _simulate(self, items, market):
+        """Wyniki paczki (z wartością realną) - jedno wywołanie simulate_batch"""
+        inflation = market.inflation(items[0][1]["currency"])
+        results = engine.simulate_batch(market.plan_prices(items[0][1]), [plan for _, plan, _ in items],
+                                        inflation=inflation)
+        return [engine.apply_inflation(result, inflation) for result in results]
+
+    def _run_batch(self, items, market):
+        try:
+            outcomes = [(result, None) for result in self._simulate(items, market)]
+            retried = False
+        except Exception:
+            # Błąd jednego planu nie może psuć wyników pozostałych - paczka liczona ponownie plan po planie
+            outcomes = []
+            for item in items:
+                try:
+                    outcomes.append((self._simulate([item], market)[0], None))
+                except Exception as e:
+                    outcomes.append((None, e))
+            retried = True
+
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["batch_retries"] += retried
+            self.stats["simulated"] += sum(1 for _, error in outcomes if error is None)
+            self.stats["failed"] += sum(1 for _, error in outcomes if error is not None)
+            for (key, _, _), (result, error) in zip(items, outcomes):
+                self._inflight.pop(key, None)
+                if error is None:
+                    self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for (_, _, future), (result, error) in zip(items, outcomes):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "cache_entries": len(self._cache), "inflight": len(self._inflight)}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "RebalanceAPI/1.0"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            raise ValueError("Niepoprawny JSON")
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "data_version": market_data.data_version()})
+        elif self.path == "/stats":
+            self.send_json(200, self.service.snapshot())
+        else:
+            self.send_json(404, {"error": "Nie znaleziono"})
+
+    def do_POST(self):
+        try:
+            payload = self.read_json()
+            if self.path == "/simulate":
+                presets, with_ledger = [payload], bool(payload.get("ledger", False)) if isinstance(payload, dict) else False
+            elif self.path == "/simulate/batch":
+                if not isinstance(payload, dict) or not isinstance(payload.get("presets"), list):
+                    raise ValueError("Oczekiwano {\"presets\": [...]}")
+                presets, with_ledger = payload["presets"], bool(payload.get("ledger", False))
+            else:
+                self.send_json(404, {"error": "Nie znaleziono"})
+                return
+            plans = [plan_from_payload(preset) for preset in presets]
+            futures = [self.service.submit(plan) for plan in plans]
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        try:
+            market = market_data.shared_market_data()
+            responses = []
+            for plan, future in zip(plans, futures):
+                result = future.result(timeout=REQUEST_TIMEOUT)
+                response = {"metrics": metrics(result, plan, market.cpi_currency(plan["currency"]))}
+                if with_ledger:
+                    response["ledger"] = ledger(result)
+                responses.append(response)
+        except Exception as e:
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self.send_json(200, responses[0] if self.path == "/simulate" else {"results": responses})
+
+
+def serve(host="127.0.0.1", port=8765, service=None, verbose=False):
+    """Serwer HTTP (nieuruchomiony - wywołaj serve_forever() lub uruchom w wątku)"""
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.service = service or SimulationService()
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lokalne API symulacji metali szlachetnych")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = serve(args.host, args.port, verbose=args.verbose)
+    print(f"API: http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
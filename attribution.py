@@ -0,0 +1,58 @@
+# attribution.py
+
+import copy
+
+import engine
+from market_data import METALS
+
+# Składniki kosztów w kolejności raportu
+COST_COMPONENTS = ["margins", "buyback", "rebalance_markup", "storage"]
+
+
+def zero_cost(plan, component):
+    """Kopia planu z wyzerowanym jednym składnikiem kosztów"""
+    plan = copy.deepcopy(plan)
+    if component == "storage":
+        plan["storage_fee"] = 0.0
+    else:
+        plan[component] = {m: 0.0 for m in METALS}
+    return plan
+
+
+def counterfactual_plans(plan):
+    """Plan bazowy, warianty bez każdego kosztu z osobna i wariant bez żadnych kosztów"""
+    plans = {"base": plan}
+    for component in COST_COMPONENTS:
+        plans[f"no_{component}"] = zero_cost(plan, component)
+    no_costs = plan
+    for component in COST_COMPONENTS:
+        no_costs = zero_cost(no_costs, component)
+    plans["no_costs"] = no_costs
+    return plans
+
+
+def fee_attribution(data, plan, progress=None, inflation=None):
+    """Rozkład wartości końcowej na zwrot z cen i ubytek z każdego kosztu (jeden przebieg wsadowy).
+
+    Ubytek kosztu = wartość bez tego kosztu - wartość bazowa; interakcja to różnica między
+    łącznym ubytkiem (bez żadnych kosztów) a sumą ubytków liczonych pojedynczo.
+    inflation - tabela inflacji waluty planu (indeksacja wypłat, engine.simulate_batch).
+    """
+    plans = counterfactual_plans(plan)
+    results = dict(zip(plans, engine.simulate_batch(data, list(plans.values()), progress=progress, inflation=inflation)))
+    final = {name: float(result["Portfolio Value"].iloc[-1]) for name, result in results.items()}
+
+    invested = float(results["base"]["Invested"].iloc[-1])
+    drag = {component: final[f"no_{component}"] - final["base"] for component in COST_COMPONENTS}
+    total_drag = final["no_costs"] - final["base"]
+    return {
+        "invested": invested,
+        "final_value": final["base"],
+        "final_value_no_costs": final["no_costs"],
+        "price_return": final["no_costs"] - invested,
+        "drag": drag,
+        "interaction": total_drag - sum(drag.values()),
+        "total_drag": total_drag,
+        "final": final,
+        "results": results,
+    }
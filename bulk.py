@@ -0,0 +1,290 @@
+# bulk.py
+"""Projekcja wielu planów klientów z pliku CSV/Parquet.
+
+    python bulk.py plany.csv --preset SSW-250609 -o wyniki.csv --workers 4
+
+Kolumny pliku (wiersz = plan): id, initial_date, initial_allocation, purchase_amount, purchase_freq,
+purchase_day, Gold, Silver, Platinum, Palladium (udziały w %). Opcjonalnie: end_purchase_date
+(domyślnie ostatni dzień danych), currency, preset (model kosztów z presets/ zamiast --preset),
+rebalance (0/1), storage_fee, vat, storage_metal, storage_fee_mode.
+
+Daty rebalancingu i wypłat z presetu przesuwane są o tyle lat, o ile start wiersza różni się od startu
+presetu. Plany bez rebalancingu z tym samym harmonogramem i modelem kosztów liczone są jednym modelem
+liniowym (engine.simulate_linear_batch); pozostałe - paczkami simulate_batch(final_only=True) wspólnymi
+dla waluty i ceny wykonania (daty startu i harmonogramy mogą się różnić).
+--float32 liczy grupy simulate_batch w pojedynczej precyzji (szybciej przy bardzo dużych plikach;
+błąd względny wyceny - engine.float32_error_bound).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import engine
+import market_data
+from market_data import METALS, TROY_OUNCE_TO_GRAM
+
+# Największa paczka planów z rebalancingiem w jednym wywołaniu simulate_batch
+MAX_BATCH = 256
+
+REQUIRED_COLUMNS = ["id", "initial_date", "initial_allocation", "purchase_amount", "purchase_freq", "purchase_day"] + METALS
+
+
+def read_table(path):
+    """CSV lub Parquet (Parquet wymaga pyarrow)"""
+    if path.lower().endswith((".parquet", ".pq")):
+        try:
+            return pd.read_parquet(path)
+        except ImportError as e:
+            raise SystemExit(f"Odczyt Parquet wymaga pyarrow: {e}")
+    return pd.read_csv(path)
+
+
+def write_table(frame, path):
+    if path.lower().endswith((".parquet", ".pq")):
+        try:
+            frame.to_parquet(path, index=False)
+        except ImportError as e:
+            raise SystemExit(f"Zapis Parquet wymaga pyarrow: {e}")
+    else:
+        frame.to_csv(path, index=False)
+
+
+def load_template(name, folder="presets"):
+    """Plan presetu jako model kosztów, magazynowania i rebalancingu"""
+    with open(os.path.join(folder, f"{name}.json"), "r", encoding="utf-8") as f:
+        return engine.plan_from_preset(json.load(f))
+
+
+def _present(row, column):
+    return column in row and not pd.isna(row[column]) and row[column] != ""
+
+
+def plans_from_frame(frame, template, last_date, currencies=(market_data.BASE_CURRENCY,), folder="presets"):
+    """(id, plan) dla poprawnych wierszy oraz {id: błąd} dla pozostałych"""
+    missing = [c for c in REQUIRED_COLUMNS if c not in frame.columns]
+    if missing:
+        raise ValueError(f"Brak kolumn: {', '.join(missing)}")
+
+    frame = frame.copy()
+    frame["initial_date"] = pd.to_datetime(frame["initial_date"], errors="coerce")
+    if "end_purchase_date" in frame.columns:
+        frame["end_purchase_date"] = pd.to_datetime(frame["end_purchase_date"], errors="coerce")
+
+    templates = {None: template}
+    plans, errors = [], {}
+    for row in frame.to_dict("records"):
+        plan_id = row["id"]
+        try:
+            name = row["preset"] if _present(row, "preset") else None
+            if name not in templates:
+                templates[name] = load_template(name, folder)
+            plan = dict(templates[name])
+
+            if pd.isna(row["initial_date"]):
+                raise ValueError("niepoprawna data initial_date")
+            end = row["end_purchase_date"] if _present(row, "end_purchase_date") else last_date
+            allocation = {m: float(row[m]) / 100 for m in METALS}
+            if abs(sum(allocation.values()) - 1.0) > 1e-9:
+                raise ValueError("suma alokacji musi wynosić 100%")
+            frequency = row["purchase_freq"] if _present(row, "purchase_freq") else None
+            if frequency not in engine.FREQUENCY_CODES:
+                raise ValueError(f"nieznana częstotliwość {frequency}")
+
+            plan = engine.shift_plan_dates(plan, row["initial_date"].year - pd.Timestamp(plan["initial_date"]).year)
+            plan.update({
+                "initial_date": row["initial_date"].date(),
+                "end_purchase_date": min(pd.Timestamp(end), last_date).date(),
+                "initial_allocation": float(row["initial_allocation"]),
+                "allocation": allocation,
+                "purchase_freq": engine.normalize_frequency(frequency),
+                "purchase_day": int(row["purchase_day"]) if _present(row, "purchase_day") else 1,
+                "purchase_amount": float(row["purchase_amount"]),
+            })
+            if plan["initial_date"] > plan["end_purchase_date"]:
+                raise ValueError("initial_date po końcu okresu")
+            if _present(row, "currency"):
+                if row["currency"] not in currencies:
+                    raise ValueError(f"nieobsługiwana waluta {row['currency']}")
+                plan["currency"] = row["currency"]
+            if _present(row, "rebalance"):
+                plan["rebalance_1"] = plan["rebalance_2"] = bool(int(row["rebalance"]))
+            for column in ("storage_fee", "vat"):
+                if _present(row, column):
+                    plan[column] = float(row[column])
+            if _present(row, "storage_metal"):
+                plan["storage_metal"] = engine.normalize_storage_metal(row["storage_metal"])
+            if _present(row, "storage_fee_mode"):
+                plan["storage_fee_mode"] = engine.normalize_fee_mode(row["storage_fee_mode"])
+            engine.check_plan(plan)
+        except (ValueError, TypeError, KeyError, OSError) as e:
+            errors[plan_id] = str(e)
+            continue
+        plans.append((plan_id, plan))
+    return plans, errors
+
+
+def _batch_key(plan):
+    return ("batch", tuple(str(plan[k]) for k in engine.PRICE_KEYS) + tuple(plan["allocation"]))
+
+
+def group_plans(plans):
+    """Grupy: ("linear", klucz modelu) lub ("batch", wspólne PRICE_KEYS) -> lista (id, plan).
+
+    Model liniowy opłaca się tylko dla kilku planów - plan z niepowtarzalnym kluczem modelu trafia do paczki.
+    """
+    keys = [("linear", engine.linear_model_key(plan)) if engine.linear_eligible(plan) else None for _, plan in plans]
+    sizes = Counter(keys)
+    groups = {}
+    for key, (plan_id, plan) in zip(keys, plans):
+        if key is None or sizes[key] == 1:
+            key = _batch_key(plan)
+        groups.setdefault(key, []).append((plan_id, plan))
+
+    # Duże grupy z rebalancingiem dzielone na paczki (równomierne obciążenie procesów)
+    tasks = []
+    for (kind, _), items in groups.items():
+        size = MAX_BATCH if kind == "batch" else len(items)
+        tasks += [(kind, items[i:i + size]) for i in range(0, len(items), size)]
+    return tasks
+
+
+def run_group(task, version=None, dtype=np.float64):
+    """Wyniki jednej grupy planów (kolumny tabeli wynikowej); dtype - precyzja simulate_batch.
+
+    Błąd obliczenia grupy powtarza ją plan po planie - plan, który się nie liczy, dostaje wiersz z kolumną
+    "error", pozostałe normalne wyniki.
+    """
+    kind, items = task
+    try:
+        return _group_results(kind, items, version, dtype)
+    except Exception as e:
+        if len(items) == 1:
+            return _failed_rows(kind, items, e)
+        parts = [run_group((kind, [item]), version, dtype) for item in items]
+        return {name: np.concatenate([np.asarray(part[name]) for part in parts]) for name in parts[0]}
+
+
+def _failed_rows(kind, items, error):
+    """Kolumny wyniku dla planów, których nie udało się policzyć"""
+    blank = [np.nan] * len(items)
+    return {
+        "id": [plan_id for plan_id, _ in items],
+        "currency": [plan["currency"] for _, plan in items],
+        "start_date": [plan["initial_date"].isoformat() for _, plan in items],
+        "valuation_date": [None] * len(items),
+        "invested": blank,
+        **{f"{m}_g": blank for m in METALS},
+        "portfolio_value": blank,
+        "profit": blank,
+        "storage_cost": blank,
+        "margin_cost": blank,
+        "method": [kind] * len(items),
+        "error": [f"{type(error).__name__}: {error}"] * len(items),
+    }
+
+
+def _group_results(kind, items, version, dtype):
+    """Kolumny tabeli wynikowej dla grupy liczonej jednym wywołaniem silnika"""
+    market = market_data.shared_market_data(version)
+    plans = [plan for _, plan in items]
+    currency = plans[0]["currency"]
+    data = market.plan_prices(plans[0])
+
+    if kind == "linear":
+        summary = engine.simulate_linear_batch(engine.linear_model(data, plans[0]), plans)
+    else:
+        summary = engine.simulate_batch(data, plans, final_only=True, dtype=dtype, inflation=market.inflation(currency))
+
+    # Wycena bieżąca: ostatnia sesja do końca okresu planu, nie ostatnie zdarzenie
+    positions = data.index.searchsorted(pd.to_datetime([engine.plan_end(plan) for plan in plans]), side="right") - 1
+    day_prices = market.sell_price_array(currency, plans[0]["execution_fix"])[positions]
+
+    def factors(key):
+        return np.array([[1 + plan[key][m] / 100 for m in METALS] for plan in plans])
+
+    margin, buyback = factors("margins"), factors("buyback")
+    weights = np.array([[plan["allocation"][m] for m in METALS] for plan in plans])
+    holdings = summary["holdings"]
+    invested = summary["invested"]
+    values = day_prices * buyback * holdings
+    value = values.sum(axis=1)
+    return {
+        "id": [plan_id for plan_id, _ in items],
+        "currency": [currency] * len(items),
+        "start_date": [plan["initial_date"].isoformat() for plan in plans],
+        "valuation_date": [day.date().isoformat() for day in data.index[positions]],
+        "invested": invested,
+        **{f"{m}_g": holdings[:, j] * TROY_OUNCE_TO_GRAM for j, m in enumerate(METALS)},
+        "portfolio_value": value,
+        "profit": value - invested,
+        "storage_cost": summary["storage_cost"],
+        # Marża przy zakupach (bez transakcji rebalancingu)
+        "margin_cost": (invested[:, np.newaxis] * weights * (1 - 1 / margin)).sum(axis=1),
+        "method": [kind] * len(items),
+        "error": [None] * len(items),
+    }
+
+
+def _run_group_task(args):
+    return run_group(*args)
+
+
+def project(plans, workers=1, version=None, dtype=np.float64):
+    """Tabela wyników dla listy (id, plan) oraz liczba grup"""
+    version = version or market_data.data_version()
+    tasks = group_plans(plans)
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_run_group_task, [(task, version, dtype) for task in tasks],
+                                  chunksize=max(1, len(tasks) // (workers * 4))))
+    else:
+        parts = [run_group(task, version, dtype) for task in tasks]
+    if not parts:
+        return pd.DataFrame(), 0
+    columns = {name: np.concatenate([np.asarray(part[name]) for part in parts]) for name in parts[0]}
+    frame = pd.DataFrame(columns)
+    if frame["error"].isna().all():
+        frame = frame.drop(columns="error")
+    return frame, len(tasks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Projekcja wielu planów oszczędnościowych z pliku")
+    parser.add_argument("plans", help="plik CSV lub Parquet z planami")
+    parser.add_argument("--preset", required=True, help="preset z modelem kosztów (nazwa pliku w presets/ bez .json)")
+    parser.add_argument("-o", "--output", default="wyniki.csv", help="plik wynikowy CSV lub Parquet")
+    parser.add_argument("--workers", type=int, default=1, help="procesy równoległe")
+    parser.add_argument("--float32", action="store_true", help="simulate_batch w pojedynczej precyzji (szybciej, mniej pamięci)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    market = market_data.shared_market_data()
+    plans, errors = plans_from_frame(read_table(args.plans), load_template(args.preset), market.index.max(), market.currencies)
+    parsed = time.perf_counter()
+    results, n_groups = project(plans, workers=args.workers, version=market.version,
+                                 dtype=np.float32 if args.float32 else np.float64)
+    computed = time.perf_counter()
+
+    if errors:
+        results = pd.concat([results, pd.DataFrame({"id": list(errors), "error": list(errors.values())})], ignore_index=True)
+    write_table(results, args.output)
+
+    elapsed = computed - parsed
+    print(f"Planów: {len(plans)} w {n_groups} grupach, błędnych: {len(errors)}")
+    print(f"Wczytanie {parsed - started:.2f} s, obliczenia {elapsed:.2f} s "
+          f"({len(plans) / elapsed if elapsed > 0 else float('inf'):,.0f} planów/s) -> {args.output}")
+    for plan_id, error in list(errors.items())[:10]:
+        print(f"  {plan_id}: {error}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# comparison.py
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+import engine
+import analytics
+from market_data import METALS
+
+# Porównania względem planu bazowego
+LUMP_SUM = "lump_sum"
+NO_REBALANCE = "no_rebalance"
+SINGLE_METAL = "single_metal_"  # + nazwa metalu
+BASELINES = [LUMP_SUM, NO_REBALANCE] + [SINGLE_METAL + m for m in METALS]
+
+# Względna różnica wyceny uznawana za rozbieżność portfeli
+DIVERGENCE_TOLERANCE = 1e-9
+
+
+def total_contributions(index, plan):
+    """Kapitał, który plan wpłaci łącznie (wpłata początkowa + zakupy cykliczne w zakresie dat)"""
+    _, _, calendar = engine.event_calendar(index, plan)
+    return plan["initial_allocation"] + plan["purchase_amount"] * int(calendar["purchase"].sum())
+
+
+def baseline_plan(index, plan, baseline):
+    """Wariant porównawczy planu"""
+    plan = copy.deepcopy(plan)
+    if baseline == LUMP_SUM:
+        # Cały kapitał planu zainwestowany od razu, bez zakupów cyklicznych
+        plan["initial_allocation"] = float(total_contributions(index, plan))
+        plan["purchase_freq"] = None
+    elif baseline == NO_REBALANCE:
+        plan["rebalance_1"] = False
+        plan["rebalance_2"] = False
+    elif baseline.startswith(SINGLE_METAL):
+        metal = baseline[len(SINGLE_METAL):]
+        plan["allocation"] = {m: 1.0 if m == metal else 0.0 for m in plan["allocation"]}
+        if plan["storage_metal"] not in ("best_of_year", "all"):
+            plan["storage_metal"] = metal
+    else:
+        raise ValueError(f"Nieznany wariant porównawczy: {baseline}")
+    return plan
+
+
+def rebase_plan(plan, reference):
+    """Plan (np. z innego presetu) przeniesiony na zakres dat i walutę planu odniesienia"""
+    plan = copy.deepcopy(plan)
+    for key in engine.SHARED_KEYS:
+        plan[key] = reference[key]
+    return plan
+
+
+def first_divergence(values, reference, dates):
+    """Pierwszy dzień, w którym wycena różni się od odniesienia (None - identyczne)"""
+    scale = np.maximum(np.abs(reference), 1.0)
+    diverged = np.flatnonzero(np.abs(values - reference) > DIVERGENCE_TOLERANCE * scale)
+    return dates[diverged[0]] if len(diverged) else None
+
+
+def compare(data, plans, inflation=None):
+    """Symulacja wszystkich planów (słownik nazwa -> plan, pierwszy = odniesienie) w jednym przebiegu.
+
+    inflation - tabela inflacji waluty planów (indeksacja wypłat, engine.simulate_batch).
+    Zwraca dzienne wyceny (kolumna na plan), tabelę różnic i daty pierwszej rozbieżności.
+    """
+    names = list(plans)
+    results = engine.simulate_batch(data, list(plans.values()), inflation=inflation)
+
+    # Wspólne dni wyceny: od pierwszego zakupu do końca okresu planu (lub ostatniego zdarzenia)
+    first = min(result.index.min() for result in results)
+    last = max(max(result.index.max() for result in results), pd.to_datetime(engine.plan_end(plans[names[0]])))
+    days = data.loc[first:last].index
+
+    curves = {}
+    invested = {}
+    for name, result in zip(names, results):
+        valuation = analytics.daily_valuation(result, data, plans[name], days=days)
+        curves[name] = valuation[analytics.PORTFOLIO]
+        invested[name] = valuation["Invested"]
+    curves = pd.DataFrame(curves)
+    invested = pd.DataFrame(invested)
+
+    reference = names[0]
+    dates = curves.index
+    divergence = {name: first_divergence(curves[name].to_numpy(), curves[reference].to_numpy(), dates) for name in names[1:]}
+
+    final_value = curves.iloc[-1]
+    final_invested = invested.iloc[-1]
+    table = pd.DataFrame({
+        "invested": final_invested,
+        "final_value": final_value,
+        "gain_pct": (final_value / final_invested - 1) * 100,
+        "diff": final_value - final_value[reference],
+        "diff_pct": (final_value / final_value[reference] - 1) * 100,
+        "first_divergence": pd.Series({reference: None, **divergence}),
+    })
+    return {"curves": curves, "table": table, "divergence": divergence, "results": dict(zip(names, results))}
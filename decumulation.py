@@ -0,0 +1,143 @@
+# decumulation.py
+"""Faza wypłat: największa stopa wypłat, którą portfel wytrzymuje przy każdym historycznym starcie.
+
+Plan startuje z kapitałem początkowym (bez zakupów cyklicznych) i przez years lat wypłaca co okres
+rate % kapitału początkowego rocznie - kwotę stałą albo indeksowaną inflacją waluty planu. Stopa
+jest bezpieczna dla startu, gdy na końcu okresu portfel ma jeszcze wartość (żadna wypłata nie została
+obcięta). Wartość końcowa maleje ze stopą, więc dla wszystkich startów naraz prowadzona jest bisekcja:
+przebieg to jedno engine.simulate_batch(final_only=True) dla CANDIDATES stóp każdego ze startów paczki
+(plany o różnych zakresach dat liczone są razem).
+"""
+
+import numpy as np
+import pandas as pd
+
+import engine
+import market_data
+import reducers
+
+# Tryby wypłat, dla których szukana jest stopa (tryb "percent" nigdy nie wyczerpuje portfela)
+SWR_MODES = ("fixed", "indexed")
+
+# Stopy liczone w jednym przebiegu dla każdego startu - przedział zawężany CANDIDATES + 1 razy
+CANDIDATES = 7
+# Dokładność wyniku (punkty procentowe rocznie)
+RATE_STEP = 0.01
+# Górna granica szukanej stopy (% kapitału początkowego rocznie)
+MAX_RATE = 100.0
+# Starty liczone razem (plany w przebiegu: CHUNK_STARTS x CANDIDATES)
+CHUNK_STARTS = 32
+
+
+def withdrawal_plans(plan, index, years, step="MS", mode=None):
+    """(start, plan fazy wypłat) dla startów co step od początku danych - stopa ustawiana w withdrawal_amount.
+
+    Starty generuje reducers.rolling_starts dla planu przesuniętego (z datami rebalancingu) na pierwszą sesję;
+    okres wypłat planu bazowego nie ogranicza startów - wypłaty ustawiane są od nowa dla każdego startu.
+    """
+    mode = mode or (plan.get("withdrawal_mode") if plan.get("withdrawal_mode") in SWR_MODES else "fixed")
+    freq = plan.get("withdrawal_freq") or "month"
+    first = index.min()
+    base = {**engine.shift_plan_dates(plan, first.year - pd.to_datetime(plan["initial_date"]).year),
+            "initial_date": first.date(), "withdrawal_mode": "none"}
+    for start, shifted in reducers.rolling_starts(base, index, years, step):
+        yield start, {
+            **shifted,
+            "end_purchase_date": shifted["initial_date"],
+            "purchase_freq": None,
+            "withdrawal_mode": mode,
+            "withdrawal_freq": freq,
+            "withdrawal_day": plan.get("withdrawal_day", 1),
+            "withdrawal_start": shifted["initial_date"],
+            "withdrawal_end": shifted["end_purchase_date"],
+        }
+
+
+def start_count(plan, index, years, step="MS"):
+    """Liczba startów withdrawal_plans (do opisu analizy)"""
+    return sum(1 for _ in withdrawal_plans(plan, index, years, step))
+
+
+def _with_rate(plan, rate):
+    """Plan z wypłatą rate % kapitału początkowego rocznie"""
+    periods = engine.PERIODS_PER_YEAR[plan["withdrawal_freq"]]
+    return {**plan, "withdrawal_amount": float(plan["initial_allocation"]) * rate / 100 / periods}
+
+
+def _bisect_chunk(data, plans, max_rate, inflation=None):
+    """Bisekcja stóp dla paczki startów: (największa bezpieczna stopa, czy osiągnięto max_rate, przebiegi)"""
+    n = len(plans)
+    low = np.zeros(n)
+    high = np.full(n, max_rate)
+    capped = np.zeros(n, dtype=bool)
+    passes = 0
+    first = True
+    while True:
+        open_starts = np.flatnonzero(~capped & (high - low > RATE_STEP))
+        if not len(open_starts):
+            break
+        # Pierwszy przebieg sprawdza też max_rate; później stopy wewnątrz przedziału (low, high)
+        grid = np.linspace(0.0, 1.0, CANDIDATES + 1)[1:] if first else np.linspace(0.0, 1.0, CANDIDATES + 2)[1:-1]
+        rates = low[open_starts, np.newaxis] + (high - low)[open_starts, np.newaxis] * grid
+        batch = [_with_rate(plans[k], rate) for k, row in zip(open_starts, rates) for rate in row]
+        summary = engine.simulate_batch(data, batch, final_only=True, inflation=inflation)
+        passes += 1
+        safe = (summary["value"] > 0).reshape(len(open_starts), len(grid))
+        for row, k in enumerate(open_starts):
+            survived = np.flatnonzero(safe[row])
+            failed = np.flatnonzero(~safe[row])
+            if len(survived):
+                low[k] = max(low[k], rates[row, survived].max())
+            if len(failed):
+                high[k] = min(high[k], rates[row, failed].min())
+            elif first:
+                capped[k] = True
+        first = False
+    return np.where(capped, max_rate, np.round(np.floor(low / RATE_STEP + 1e-9) * RATE_STEP, 2)), capped, passes
+
+
+def safe_withdrawal_rates(data, plan, years, step="MS", mode=None, max_rate=MAX_RATE, progress=None, inflation=None):
+    """Największa bezpieczna stopa wypłat (% kapitału początkowego rocznie) dla każdego startu.
+
+    Zwraca słownik: rates (DataFrame: start -> rate, capped - stopa max_rate nie wyczerpała portfela),
+    safe_rate (minimum po startach), worst_start, median_rate, count, passes (przebiegi silnika).
+    inflation - tabela inflacji waluty planu, według której rosną wypłaty trybu "indexed".
+    """
+    items = list(withdrawal_plans(plan, data.index, years, step, mode))
+    starts = [start for start, _ in items]
+    rates, capped, passes = [], [], 0
+    for offset in range(0, len(items), CHUNK_STARTS):
+        chunk_rates, chunk_capped, chunk_passes = _bisect_chunk(
+            data, [p for _, p in items[offset:offset + CHUNK_STARTS]], max_rate, inflation
+        )
+        rates.append(chunk_rates)
+        capped.append(chunk_capped)
+        passes += chunk_passes
+        if progress is not None:
+            progress(min(offset + CHUNK_STARTS, len(items)) / len(items))
+    frame = pd.DataFrame({
+        "rate": np.concatenate(rates) if rates else np.array([]),
+        "capped": np.concatenate(capped) if capped else np.array([], dtype=bool),
+    }, index=pd.to_datetime(starts))
+    frame.index.name = "start"
+    worst = frame["rate"].idxmin() if len(frame) else None
+    return {
+        "rates": frame,
+        "safe_rate": float(frame["rate"].min()) if len(frame) else None,
+        "worst_start": worst.date().isoformat() if worst is not None else None,
+        "median_rate": float(frame["rate"].median()) if len(frame) else None,
+        "count": len(frame),
+        "passes": passes,
+        "mode": items[0][1]["withdrawal_mode"] if items else None,
+        "years": years,
+        "step": step,
+    }
+
+
+def safe_withdrawal_study(plan, data_version, years, step="MS", progress=None):
+    """safe_withdrawal_rates jako zadanie dla jobs.Scheduler (dane wczytywane w procesie roboczym)"""
+    market = market_data.shared_market_data(data_version)
+    data = market.plan_prices(plan)
+    if progress is not None:
+        progress(0.0)
+    return safe_withdrawal_rates(data, plan, years, step, progress=progress, inflation=market.inflation(plan["currency"]))
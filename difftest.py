@@ -0,0 +1,331 @@
+# difftest.py
+"""Test różnicowy: silnik referencyjny (engine.simulate) kontra szybkie silniki na losowych planach.
+
+Każdy przypadek to rodzina planów o wspólnym okresie zakupów i walucie (różne alokacje, harmonogramy,
+strategie zakupów, progi, tryby opłat, koszty i wypłaty po okresie zakupów). Porównywane są daty, kapitał, ilości metali, wartość i log akcji;
+niezgodny przypadek jest upraszczany do minimalnej konfiguracji, która nadal się nie zgadza.
+
+    python difftest.py --configs 1000 --workers 4 --json raport.json
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import engine
+import market_data
+import strategies
+from market_data import METALS
+
+# Szybkie silniki: funkcja (ceny, lista planów, tabela inflacji) -> lista wyników w formacie simulate()
+def _linear(data, plans, inflation=None):
+    """Ścieżka liniowa dla planów bez rebalancingu, pozostałe przez simulate_batch"""
+    return [engine.simulate_linear(engine.linear_model(data, plan), plan) if engine.linear_eligible(plan)
+            else engine.simulate_batch(data, [plan], inflation=inflation)[0] for plan in plans]
+
+
+FAST_ENGINES = {
+    "batch": lambda data, plans, inflation=None: engine.simulate_batch(data, plans, inflation=inflation),
+    "linear": _linear,
+}
+
+RTOL = 1e-9
+ATOL = 1e-9
+VALUE_COLUMNS = ["Invested"] + METALS + ["Portfolio Value"]
+
+
+# ====== LOSOWE PLANY ======
+def random_allocation(rng):
+    """Alokacja w pełnych procentach, czasem z zerami"""
+    active = rng.sample(METALS, rng.randint(1, len(METALS)))
+    cuts = sorted(rng.sample(range(1, 100), len(active) - 1))
+    shares = [b - a for a, b in zip([0] + cuts, cuts + [100])]
+    return {m: (shares[active.index(m)] if m in active else 0) / 100 for m in METALS}
+
+
+def random_date_between(rng, start, end):
+    return start + timedelta(days=rng.randint(0, max((end - start).days, 0)))
+
+
+def random_costs(rng):
+    return {
+        "margins": {m: round(rng.uniform(0, 25), 2) for m in METALS},
+        "buyback": {m: round(rng.uniform(-6, 1), 2) for m in METALS},
+        "rebalance_markup": {m: round(rng.uniform(0, 10), 2) for m in METALS},
+    }
+
+
+def random_strategy(rng, strategy_share=0.4):
+    """Strategia zakupów z losowymi parametrami (pozostałe plany - stała kwota)"""
+    if rng.random() >= strategy_share:
+        return {"purchase_strategy": "fixed", "strategy_params": {}}
+    name = rng.choice([name for name in strategies.STRATEGIES if name != "fixed"])
+    params = {
+        "value_averaging": {"growth": rng.choice([0.0, 3.0, 8.0]), "max_multiple": rng.choice([1.0, 3.0, 10.0])},
+        "buy_the_dip": {"drop": rng.choice([3.0, 10.0, 25.0]), "boost": rng.choice([1.5, 2.0, 4.0]),
+                        "lookback": rng.choice([20, 250, 1000])},
+    }.get(name, {})
+    return {"purchase_strategy": name, "strategy_params": params}
+
+
+def random_schedule(rng, initial_date, rebalance_share=0.7):
+    """Parametry planu poza zakresem dat i walutą"""
+    freq = rng.choice([None, "week", "month", "quarter"])
+    mode = rng.choice(["yearly", "monthly"])
+    plan = {
+        "initial_allocation": float(rng.choice([1000, 10000, 100000, 250000])),
+        "allocation": random_allocation(rng),
+        "purchase_freq": freq,
+        "purchase_day": rng.randint(0, 4) if freq == "week" else rng.randint(1, 28),
+        "purchase_amount": float(rng.choice([50, 250, 1000, 2500])),
+        **random_strategy(rng),
+        "storage_fee": round(rng.uniform(0, 0.2) if mode == "monthly" else rng.uniform(0, 2.5), 3),
+        "vat": rng.choice([0.0, 8.0, 19.0, 23.0]),
+        "storage_metal": rng.choice(METALS + ["best_of_year", "all"]),
+        "storage_fee_mode": mode,
+        **random_costs(rng),
+    }
+    for label in ("rebalance_1", "rebalance_2"):
+        month = rng.randint(1, 12)
+        day = rng.choice([1, 15, 28, 30, 31]) if month not in (2,) else rng.randint(1, 28)
+        while True:
+            try:
+                start = date(initial_date.year + rng.randint(0, 2), month, day)
+                break
+            except ValueError:
+                day -= 1
+        plan[label] = rng.random() < rebalance_share
+        plan[f"{label}_condition"] = rng.random() < 0.5
+        plan[f"{label}_threshold"] = float(rng.choice([0.0, 1.0, 5.0, 12.0, 25.0]))
+        plan[f"{label}_start"] = start
+    return plan
+
+
+def random_withdrawal(rng, end_date, last, withdrawal_share=0.4):
+    """Wypłaty od okolic końca zakupów (plany w rodzinie kończą się w różnych dniach)"""
+    mode = rng.choice(["fixed", "indexed", "percent"]) if rng.random() < withdrawal_share else "none"
+    freq = rng.choice(["week", "month", "quarter"])
+    start = min(end_date + timedelta(days=rng.randint(-180, 90)), last)
+    return {
+        "withdrawal_mode": mode,
+        "withdrawal_amount": float(rng.choice([2.0, 4.0, 10.0])) if mode == "percent" else float(rng.choice([100, 500, 2500])),
+        "withdrawal_indexation": float(rng.choice([0.0, 2.0, 5.0])),
+        "withdrawal_freq": freq,
+        "withdrawal_day": rng.randint(0, 4) if freq == "week" else rng.randint(1, 28),
+        "withdrawal_start": start,
+        "withdrawal_end": random_date_between(rng, start, min(start + timedelta(days=365 * 8), last)),
+    }
+
+
+def random_family(rng, index, size, rebalance_share=0.7):
+    """Rodzina planów o wspólnym okresie zakupów i walucie"""
+    first, last = index.min().date(), index.max().date()
+    years = rng.choice([1, 2, 3, 5, 8, 12, 20])
+    initial_date = random_date_between(rng, first, last - timedelta(days=int(365 * years)))
+    end_date = min(initial_date + timedelta(days=int(365.25 * years) + rng.randint(-60, 60)), last)
+    shared = {"currency": market_data.BASE_CURRENCY, "execution_fix": market_data.DAILY_FIX,
+              "initial_date": initial_date, "end_purchase_date": end_date}
+    return [canonical({**shared, **random_schedule(rng, initial_date, rebalance_share), **random_withdrawal(rng, end_date, last)})
+            for _ in range(size)]
+
+
+def canonical(plan):
+    """Kolejność kluczy jak w engine.plan_from_preset"""
+    order = ["currency", "execution_fix", "initial_allocation", "initial_date", "end_purchase_date", "allocation", "purchase_freq",
+             "purchase_day", "purchase_amount", "purchase_strategy", "strategy_params", "rebalance_1", "rebalance_1_condition", "rebalance_1_threshold",
+             "rebalance_1_start", "rebalance_2", "rebalance_2_condition", "rebalance_2_threshold", "rebalance_2_start",
+             "storage_fee", "vat", "storage_metal", "storage_fee_mode", "margins", "buyback", "rebalance_markup",
+             "withdrawal_mode", "withdrawal_amount", "withdrawal_indexation", "withdrawal_freq", "withdrawal_day",
+             "withdrawal_start", "withdrawal_end"]
+    return {key: plan[key] for key in order}
+
+
+# ====== PORÓWNANIE ======
+def compare_results(reference, result):
+    """Lista niezgodności (pusta - wyniki zgodne w granicach tolerancji)"""
+    if len(reference) != len(result) or not reference.index.equals(result.index):
+        return [f"daty: {len(reference)} wierszy referencji, {len(result)} wyniku"]
+    problems = []
+    if ("Withdrawn" in reference) != ("Withdrawn" in result):
+        return ["kolumna Withdrawn tylko w jednym z wyników"]
+    for column in VALUE_COLUMNS + (["Withdrawn"] if "Withdrawn" in reference else []):
+        expected, actual = reference[column].to_numpy(dtype=float), result[column].to_numpy(dtype=float)
+        if not np.allclose(actual, expected, rtol=RTOL, atol=ATOL):
+            worst = int(np.argmax(np.abs(actual - expected)))
+            problems.append(f"{column}: {reference.index[worst].date()} {expected[worst]!r} != {actual[worst]!r}")
+    actions = reference["Akcja"].to_numpy() != result["Akcja"].to_numpy()
+    if actions.any():
+        worst = int(np.argmax(actions))
+        problems.append(f"Akcja: {reference.index[worst].date()} {reference['Akcja'].iloc[worst]!r} != {result['Akcja'].iloc[worst]!r}")
+    return problems
+
+
+def check_family(data, plans, fast_engine, inflation=None):
+    """Niezgodności rodziny planów dla silnika (None - zgodne) oraz czasy"""
+    started = time.perf_counter()
+    references = [engine.simulate(data, plan, inflation=inflation) for plan in plans]
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    try:
+        results = fast_engine(data, plans, inflation)
+    except Exception as e:
+        return [f"wyjątek: {type(e).__name__}: {e}"], legacy_time, time.perf_counter() - started
+    fast_time = time.perf_counter() - started
+
+    problems = []
+    for k, (reference, result) in enumerate(zip(references, results)):
+        problems += [f"plan {k}: {problem}" for problem in compare_results(reference, result)]
+    return problems or None, legacy_time, fast_time
+
+
+# ====== UPRASZCZANIE ======
+def _shorten(plans):
+    plan = plans[0]
+    days = (plan["end_purchase_date"] - plan["initial_date"]).days
+    if days < 60:
+        return None
+    end = plan["initial_date"] + timedelta(days=days // 2)
+    return [dict(p, end_purchase_date=end) for p in plans]
+
+
+def _start_later(plans):
+    plan = plans[0]
+    days = (plan["end_purchase_date"] - plan["initial_date"]).days
+    if days < 60:
+        return None
+    start = plan["initial_date"] + timedelta(days=days // 2)
+    return [dict(p, initial_date=start) for p in plans]
+
+
+def _each(change):
+    def simplify(plans):
+        changed = [canonical({**p, **change(p)}) for p in plans]
+        return changed if changed != plans else None
+    return simplify
+
+
+SIMPLIFICATIONS = [
+    lambda plans: plans[:1] if len(plans) > 1 else None,
+    lambda plans: plans[1:] if len(plans) > 1 else None,
+    _shorten,
+    _start_later,
+    _each(lambda p: {"rebalance_2": False}),
+    _each(lambda p: {"rebalance_1": False}),
+    _each(lambda p: {"rebalance_1_condition": False, "rebalance_2_condition": False}),
+    _each(lambda p: {"withdrawal_mode": "none"}),
+    _each(lambda p: {"purchase_strategy": "fixed", "strategy_params": {}}),
+    _each(lambda p: {"purchase_freq": None}),
+    _each(lambda p: {"storage_fee": 0.0, "vat": 0.0}),
+    _each(lambda p: {"storage_fee_mode": "yearly"}),
+    _each(lambda p: {"storage_metal": "Gold"}),
+    _each(lambda p: {"margins": {m: 0.0 for m in METALS}}),
+    _each(lambda p: {"buyback": {m: 0.0 for m in METALS}}),
+    _each(lambda p: {"rebalance_markup": {m: 0.0 for m in METALS}}),
+    _each(lambda p: {"allocation": {m: 0.25 for m in METALS}}),
+]
+
+
+def shrink(data, plans, fast_engine, max_steps=200, inflation=None):
+    """Najprostsza znaleziona rodzina planów, dla której silnik nadal daje niezgodny wynik"""
+    problems = check_family(data, plans, fast_engine, inflation)[0]
+    steps = 0
+    improved = True
+    while improved and steps < max_steps:
+        improved = False
+        for simplify in SIMPLIFICATIONS:
+            candidate = simplify(plans)
+            if candidate is None:
+                continue
+            steps += 1
+            candidate_problems = check_family(data, candidate, fast_engine, inflation)[0]
+            if candidate_problems:
+                plans, problems, improved = candidate, candidate_problems, True
+                break
+    return plans, problems
+
+
+# ====== PRZEBIEG ======
+def run_case(args):
+    seed, family_size, rebalance_share, engines = args
+    market = market_data.shared_market_data()
+    data = market.prices(market_data.BASE_CURRENCY)
+    inflation = market.inflation(market_data.BASE_CURRENCY)
+    plans = random_family(random.Random(seed), data.index, family_size, rebalance_share)
+
+    record = {"seed": seed, "days": (plans[0]["end_purchase_date"] - plans[0]["initial_date"]).days, "engines": {}}
+    for name in engines:
+        problems, legacy_time, fast_time = check_family(data, plans, FAST_ENGINES[name], inflation)
+        entry = {"legacy_s": round(legacy_time, 4), "fast_s": round(fast_time, 4),
+                 "speedup": round(legacy_time / fast_time, 1) if fast_time > 0 else None}
+        if problems:
+            minimal, minimal_problems = shrink(data, plans, FAST_ENGINES[name], inflation=inflation)
+            entry["problems"] = problems
+            entry["minimal"] = json.loads(json.dumps(minimal, default=str))
+            entry["minimal_problems"] = minimal_problems
+        record["engines"][name] = entry
+    return record
+
+
+def summarize(records, engines):
+    summary = {}
+    for name in engines:
+        entries = [r["engines"][name] for r in records]
+        speedups = np.array([e["speedup"] for e in entries if e["speedup"]])
+        summary[name] = {
+            "configs": len(entries),
+            "failures": sum(1 for e in entries if "problems" in e),
+            "speedup_p10": round(float(np.percentile(speedups, 10)), 1) if len(speedups) else None,
+            "speedup_median": round(float(np.median(speedups)), 1) if len(speedups) else None,
+            "speedup_p90": round(float(np.percentile(speedups, 90)), 1) if len(speedups) else None,
+            "legacy_s": round(sum(e["legacy_s"] for e in entries), 2),
+            "fast_s": round(sum(e["fast_s"] for e in entries), 2),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test różnicowy silników symulacji")
+    parser.add_argument("--configs", type=int, default=200, help="liczba losowych przypadków")
+    parser.add_argument("--family", type=int, default=3, help="liczba planów w rodzinie (wspólny okres zakupów)")
+    parser.add_argument("--rebalance-share", type=float, default=0.7,
+                        help="prawdopodobieństwo włączenia każdego rebalancingu (0 - same plany liniowe)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="procesy równoległe")
+    parser.add_argument("--engine", action="append", choices=sorted(FAST_ENGINES), help="domyślnie wszystkie")
+    parser.add_argument("--json", help="zapisz pełny raport do pliku JSON")
+    args = parser.parse_args(argv)
+
+    engines = args.engine or sorted(FAST_ENGINES)
+    cases = [(args.seed + i, args.family, args.rebalance_share, engines) for i in range(args.configs)]
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            records = list(pool.map(run_case, cases, chunksize=4))
+    else:
+        records = [run_case(case) for case in cases]
+
+    summary = summarize(records, engines)
+    for name, stats in summary.items():
+        print(f"{name}: {stats['configs']} przypadków, niezgodnych: {stats['failures']}, "
+              f"przyspieszenie p10/mediana/p90: {stats['speedup_p10']}x / {stats['speedup_median']}x / {stats['speedup_p90']}x "
+              f"(referencja {stats['legacy_s']} s, silnik {stats['fast_s']} s)")
+    for record in records:
+        for name, entry in record["engines"].items():
+            if "problems" in entry:
+                print(f"\n[{name}] seed {record['seed']}: {entry['minimal_problems'][0] if entry['minimal_problems'] else entry['problems'][0]}")
+                print(json.dumps(entry["minimal"], indent=1, ensure_ascii=False))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "cases": records}, f, indent=1, ensure_ascii=False)
+    return 1 if any(stats["failures"] for stats in summary.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
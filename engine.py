@@ -0,0 +1,1469 @@
+# engine.py
+
+import json
+import time
+import pandas as pd
+import numpy as np
+from datetime import timedelta
+
+import profiling
+import strategies
+from market_data import METALS, BASE_CURRENCY, DAILY_FIX, SELL_SUFFIX
+
+# ====== NORMALIZACJA PARAMETRÓW ======
+# Presety i widżety przechowują przetłumaczone etykiety - silnik pracuje na kodach
+FREQUENCY_CODES = {
+    "Brak": None, "Keine": None, "none": None, None: None,
+    "Tydzień": "week", "Woche": "week", "week": "week",
+    "Miesiąc": "month", "Monat": "month", "month": "month",
+    "Kwartał": "quarter", "Quartal": "quarter", "quarter": "quarter",
+}
+
+STORAGE_METAL_CODES = {
+    "Best of year": "best_of_year", "Bestes des Jahres": "best_of_year", "best_of_year": "best_of_year",
+    "ALL": "all", "ALLE": "all", "all": "all",
+    **{metal: metal for metal in METALS},
+}
+
+FEE_MODE_CODES = {
+    "Rocznie": "yearly", "Jährlich": "yearly", "yearly": "yearly",
+    "Miesięcznie": "monthly", "Monatlich": "monthly", "monthly": "monthly",
+}
+
+WITHDRAWAL_MODE_CODES = {
+    "Brak": "none", "Keine": "none", "none": "none", None: "none",
+    "Stała kwota": "fixed", "Fester Betrag": "fixed", "fixed": "fixed",
+    "Kwota indeksowana": "indexed", "Indexierter Betrag": "indexed", "indexed": "indexed",
+    "Kwota indeksowana inflacją": "indexed", "Inflationsindexierter Betrag": "indexed",
+    "Procent wartości": "percent", "Prozent des Werts": "percent", "percent": "percent",
+}
+
+
+def normalize_frequency(value):
+    return FREQUENCY_CODES.get(value)
+
+
+def normalize_storage_metal(value):
+    return STORAGE_METAL_CODES.get(value, "Gold")
+
+
+def normalize_fee_mode(value):
+    return FEE_MODE_CODES.get(value, "yearly")
+
+
+def normalize_withdrawal_mode(value):
+    return WITHDRAWAL_MODE_CODES.get(value, "none")
+
+
+# Dopuszczalne dni terminu (zakupu, wypłaty) dla częstotliwości: dzień tygodnia 0-6 albo dzień miesiąca 1-28
+DAY_RANGES = {"week": range(0, 7), "month": range(1, 29), "quarter": range(1, 29)}
+
+
+def check_schedule_day(freq, day, label="purchase_day"):
+    """ValueError, gdy dzień terminu nie pasuje do częstotliwości"""
+    allowed = DAY_RANGES[freq]
+    if isinstance(day, bool) or not isinstance(day, (int, np.integer)) or day not in allowed:
+        raise ValueError(f"{label}: {day!r} poza zakresem {allowed.start}-{allowed.stop - 1} dla częstotliwości {freq}")
+
+
+def _check_code(codes, value, label):
+    try:
+        known = value in codes
+    except TypeError:
+        known = False
+    if not known:
+        allowed = ", ".join(str(code) for code in codes if code is not None)
+        raise ValueError(f"{label}: nieznana wartość {value!r} (dozwolone: {allowed})")
+
+
+def check_preset_codes(preset):
+    """Sprawdza kody presetu przed normalizacją (normalize_* zamienia nieznane wartości na domyślne)"""
+    purchase = preset.get("purchase")
+    if isinstance(purchase, dict) and "frequency" in purchase:
+        _check_code(FREQUENCY_CODES, purchase["frequency"], "purchase.frequency")
+    storage = preset.get("storage", {})
+    if isinstance(storage, dict):
+        if "metal" in storage:
+            _check_code(STORAGE_METAL_CODES, storage["metal"], "storage.metal")
+        if "fee_mode" in storage:
+            _check_code(FEE_MODE_CODES, storage["fee_mode"], "storage.fee_mode")
+    withdrawal = preset.get("withdrawal", {})
+    if isinstance(withdrawal, dict):
+        _check_code(WITHDRAWAL_MODE_CODES, withdrawal.get("mode"), "withdrawal.mode")
+        if normalize_withdrawal_mode(withdrawal.get("mode")) != "none":
+            _check_code({code: freq for code, freq in FREQUENCY_CODES.items() if freq is not None},
+                        withdrawal.get("frequency", "month"), "withdrawal.frequency")
+    return preset
+
+
+def check_plan(plan):
+    """Sprawdza dane planu spoza presetów aplikacji (API, pliki bulk) - ValueError z opisem pierwszego błędu"""
+    for key in ("initial_date", "end_purchase_date"):
+        if pd.isna(plan[key]):
+            raise ValueError(f"{key}: brak lub niepoprawna data")
+    if plan["initial_date"] > plan["end_purchase_date"]:
+        raise ValueError("initial_date po end_purchase_date")
+    for key in ("initial_allocation", "purchase_amount"):
+        if not np.isfinite(plan[key]) or plan[key] < 0:
+            raise ValueError(f"{key}: kwota musi być nieujemna")
+    if any(not np.isfinite(weight) or weight < 0 for weight in plan["allocation"].values()):
+        raise ValueError("allocation: udziały metali muszą być nieujemne")
+    if plan["purchase_freq"] is not None:
+        check_schedule_day(plan["purchase_freq"], plan["purchase_day"])
+    if has_withdrawals(plan):
+        if not np.isfinite(plan["withdrawal_amount"]) or plan["withdrawal_amount"] < 0:
+            raise ValueError("withdrawal_amount: kwota musi być nieujemna")
+        if plan["withdrawal_start"] > plan["withdrawal_end"]:
+            raise ValueError("withdrawal_start po withdrawal_end")
+        check_schedule_day(plan["withdrawal_freq"], plan["withdrawal_day"], "withdrawal_day")
+    return plan
+
+
+def plan_from_preset(preset, currency=None):
+    """Zamienia preset (format plików z presets/) na plan symulacji"""
+    if currency is None:
+        currency = preset.get("currency", BASE_CURRENCY)
+    rebalance = preset.get("rebalance", {})
+    storage = preset.get("storage", {})
+    withdrawal = preset.get("withdrawal", {})
+    purchase = preset["purchase"]
+    initial_date = pd.to_datetime(preset.get("initial_date")).date()
+    end_purchase_date = pd.to_datetime(preset.get("end_purchase_date")).date()
+    rebalance_base_year = initial_date.year + 1
+    return {
+        "currency": currency,
+        "execution_fix": preset.get("execution_fix", DAILY_FIX),
+        "initial_allocation": float(preset.get("initial_allocation", 100000.0)),
+        "initial_date": initial_date,
+        "end_purchase_date": end_purchase_date,
+        "allocation": {m: preset["allocation"][m] / 100 for m in METALS},
+        "purchase_freq": normalize_frequency(purchase["frequency"]),
+        "purchase_day": purchase["day"],
+        "purchase_amount": float(purchase["amount"]),
+        "purchase_strategy": purchase.get("strategy", "fixed"),
+        "strategy_params": dict(purchase.get("strategy_params", {})),
+        "rebalance_1": rebalance.get("rebalance_1", True),
+        "rebalance_1_condition": rebalance.get("rebalance_1_condition", False),
+        "rebalance_1_threshold": rebalance.get("rebalance_1_threshold", 12.0),
+        "rebalance_1_start": pd.to_datetime(rebalance.get("rebalance_1_start", f"{rebalance_base_year}-04-01")).date(),
+        "rebalance_2": rebalance.get("rebalance_2", False),
+        "rebalance_2_condition": rebalance.get("rebalance_2_condition", False),
+        "rebalance_2_threshold": rebalance.get("rebalance_2_threshold", 12.0),
+        "rebalance_2_start": pd.to_datetime(rebalance.get("rebalance_2_start", f"{rebalance_base_year}-10-01")).date(),
+        "storage_fee": storage.get("fee", 1.5),
+        "vat": storage.get("vat", 0.0),
+        "storage_metal": normalize_storage_metal(storage.get("metal", "Gold")),
+        "storage_fee_mode": normalize_fee_mode(storage.get("fee_mode", "Rocznie")),
+        "margins": dict(preset["margins"]),
+        "buyback": dict(preset["buyback"]),
+        "rebalance_markup": dict(preset["rebalance_markup"]),
+        "withdrawal_mode": normalize_withdrawal_mode(withdrawal.get("mode")),
+        "withdrawal_amount": float(withdrawal.get("amount", 0.0)),
+        "withdrawal_indexation": float(withdrawal.get("indexation", 0.0)),
+        "withdrawal_freq": normalize_frequency(withdrawal.get("frequency", "month")),
+        "withdrawal_day": withdrawal.get("day", 1),
+        "withdrawal_start": pd.to_datetime(withdrawal.get("start", end_purchase_date)).date(),
+        "withdrawal_end": pd.to_datetime(withdrawal.get("end", end_purchase_date)).date(),
+    }
+
+
+# ====== KALENDARZ ======
+def get_last_business_day_of_month(date):
+    """Znajduje ostatni dzień roboczy danego miesiąca"""
+    profiling.count("last_business_day_of_month")
+    # Znajdź ostatni dzień miesiąca
+    next_month = date.replace(day=28) + pd.DateOffset(days=4)
+    last_day = next_month - pd.DateOffset(days=next_month.day)
+
+    # Cofnij się do ostatniego dnia roboczego (pomiń weekendy)
+    while last_day.weekday() >= 5:  # 5=sobota, 6=niedziela
+        last_day -= pd.DateOffset(days=1)
+
+    return last_day
+
+def get_last_business_day_of_year(year):
+    """Znajduje ostatni dzień roboczy danego roku"""
+    # Ostatni dzień roku
+    last_day = pd.Timestamp(year, 12, 31)
+
+    # Cofnij się do ostatniego dnia roboczego
+    while last_day.weekday() >= 5:
+        last_day -= pd.DateOffset(days=1)
+
+    return last_day
+
+def generate_purchase_dates(index, start_date, freq, day, end_date):
+    dates = []
+    current = pd.to_datetime(start_date)
+    end_date = pd.to_datetime(end_date)
+
+    if freq == "week":
+        while current <= end_date:
+            while current.weekday() != day:
+                current += timedelta(days=1)
+                if current > end_date:
+                    break
+            if current <= end_date:
+                dates.append(current)
+            current += timedelta(weeks=1)
+
+    elif freq == "month":
+        while current <= end_date:
+            current = current.replace(day=min(day, 28))
+            if current <= end_date:
+                dates.append(current)
+            current += pd.DateOffset(months=1)
+
+    elif freq == "quarter":
+        while current <= end_date:
+            current = current.replace(day=min(day, 28))
+            if current <= end_date:
+                dates.append(current)
+            current += pd.DateOffset(months=3)
+
+    if not dates:
+        return []
+    return list(index[index.get_indexer(dates, method="nearest")])
+
+
+# ====== WYPŁATY (faza dekumulacji) ======
+# Liczba wypłat w roku - w trybie "percent" roczna stopa dzielona jest na wypłaty
+PERIODS_PER_YEAR = {"week": 52, "month": 12, "quarter": 4}
+
+
+def has_withdrawals(plan):
+    return plan.get("withdrawal_mode", "none") != "none" and plan.get("withdrawal_freq") is not None
+
+
+def plan_end(plan):
+    """Ostatni dzień symulacji: koniec zakupów, a w planie z wypłatami koniec wypłat, jeśli późniejszy"""
+    end = pd.Timestamp(plan["end_purchase_date"]).date()
+    if has_withdrawals(plan):
+        end = max(end, pd.Timestamp(plan["withdrawal_end"]).date())
+    return end
+
+
+# Daty planu związane z jego startem - przesuwane razem z initial_date (rebalancing, okres wypłat)
+ANCHORED_DATE_KEYS = ("rebalance_1_start", "rebalance_2_start", "withdrawal_start", "withdrawal_end")
+
+
+def shift_plan_dates(plan, years):
+    """Kopia planu z datami ANCHORED_DATE_KEYS przesuniętymi o years lat (te same dni w roku)"""
+    shift = pd.DateOffset(years=years)
+    return {**plan, **{key: (pd.Timestamp(plan[key]) + shift).date() for key in ANCHORED_DATE_KEYS
+                       if plan.get(key) is not None}}
+
+
+def withdrawal_positions(index, plan, index_days=None):
+    """Pozycje sesji z wypłatą - terminy jak dla zakupów (najbliższa sesja)"""
+    if not has_withdrawals(plan):
+        return np.array([], dtype=np.int64)
+    return purchase_positions(index, plan["withdrawal_start"], plan["withdrawal_freq"], plan["withdrawal_day"],
+                              plan["withdrawal_end"], index_days)
+
+
+def withdrawal_terms(plans, index, inflation=None):
+    """Parametry wypłat jako tablice (plany): tryb procentowy, kwota lub ułamek wartości na wypłatę,
+    mnożnik kwoty w każdym roku kalendarza index (plany x lata) i pierwszy rok kalendarza.
+
+    Kwota trybu "indexed" rośnie od drugiego roku wypłat o inflację roku poprzedniego z tabeli inflation
+    (market.inflation() waluty planów); lata bez danych (i brak tabeli) - o withdrawal_indexation.
+    """
+    percent = np.array([plan.get("withdrawal_mode") == "percent" for plan in plans])
+    amount = np.array([
+        float(plan.get("withdrawal_amount", 0.0)) / 100 / PERIODS_PER_YEAR.get(plan.get("withdrawal_freq"), 1)
+        if plan.get("withdrawal_mode") == "percent" else float(plan.get("withdrawal_amount", 0.0))
+        for plan in plans
+    ])
+    years = np.arange(index.min().year, index.max().year + 1) if len(index) else np.array([0])
+    cpi = {} if inflation is None else {int(year): float(rate) for year, rate in
+                                        zip(inflation["Rok"], inflation["Inflacja (%)"]) if pd.notna(rate)}
+    scale = np.ones((len(plans), len(years)))
+    for k, plan in enumerate(plans):
+        if plan.get("withdrawal_mode") == "indexed" and has_withdrawals(plan):
+            assumed = float(plan.get("withdrawal_indexation", 0.0))
+            growth = np.array([1 + cpi.get(year - 1, assumed) / 100 for year in years])
+            growth[years <= pd.Timestamp(plan["withdrawal_start"]).year] = 1.0
+            scale[k] = np.cumprod(growth)
+    return percent, amount, scale, np.full(len(plans), years[0])
+
+
+def withdrawal_sales(holdings, invested, sell_prices, terms, year):
+    """Wypłata w roku year dla wierszy holdings (plany x metale) przy cenach odkupu sell_prices.
+
+    Metale sprzedawane są proporcjonalnie do wartości odkupu, a zainwestowany kapitał maleje w tej samej
+    proporcji (opłaty magazynowe liczone są od pozostałego kapitału). Wypłata nie przekracza wartości
+    portfela - wypłata większa od niej sprzedaje wszystko. Zwraca (ilości, kapitał, wypłacone kwoty, sprzedane ilości).
+    """
+    percent, amount, scale, first_year = terms
+    values = sell_prices * holdings
+    total = values[:, 0]
+    for j in range(1, values.shape[1]):
+        total = total + values[:, j]
+    scheduled = np.where(percent, total * amount, amount * scale[np.arange(len(scale)), year - first_year])
+    cash = np.where(total > 0, np.minimum(scheduled, total), 0.0)
+    share = cash / np.where(total > 0, total, 1.0)
+    sold = holdings * share[:, np.newaxis]
+    return holdings - sold, invested - invested * share, cash, sold
+
+
+# ====== SYMULACJA ======
+# Co ile dni symulacji raportowany jest postęp
+PROGRESS_EVERY_DAYS = 100
+
+
+def estimate_run_cost(index, plan):
+    """Przybliżony koszt symulacji w "dniach" (miesięczne opłaty magazynowe są ~3x droższe)"""
+    days = index.slice_indexer(pd.to_datetime(plan["initial_date"]), pd.to_datetime(plan_end(plan)))
+    n_days = len(range(*days.indices(len(index))))
+    return n_days * (3 if plan["storage_fee_mode"] == "monthly" else 1)
+
+
+def simulate(data, plan, progress=None, lots=None, inflation=None):
+    """Symulacja dzień po dniu w walucie planu (data: ceny z kolumnami <Metal>_<WALUTA>).
+
+    progress - opcjonalna funkcja wywoływana z ułamkiem 0..1; wyjątek z niej przerywa symulację.
+    lots - opcjonalny rejestr partii (taxlots.TaxLedger) dostający każdy zakup i sprzedaż.
+    Plan z wypłatami (has_withdrawals) liczony jest do plan_end, a wynik ma kolumnę "Withdrawn" (suma wypłat);
+    inflation - tabela market.inflation() waluty planu do indeksacji wypłat (withdrawal_terms).
+    Zakupy planu ze strategią inną niż stała kwota liczy hook z strategies.py (ten sam co w simulate_batch).
+    Dane z kolumnami <Metal>_<WALUTA>_sell (market_data.SELL_FIXES) mają osobne ceny sprzedaży i wyceny.
+    """
+    currency = plan.get("currency", BASE_CURRENCY)
+    col = {m: f"{m}_{currency}" for m in METALS}
+    # Sprzedaż i wycena (także decyzje rebalancingu i opłat) po cenach sprzedaży, zakupy po cenach zakupu
+    sell_col = {m: sell_column(data, m, currency) for m in METALS}
+    allocation = plan["allocation"]
+    margins = plan["margins"]
+    buyback_discounts = plan["buyback"]
+    rebalance_markup = plan["rebalance_markup"]
+    initial_allocation = plan["initial_allocation"]
+    purchase_amount = plan["purchase_amount"]
+    storage_fee = plan["storage_fee"]
+    vat = plan["vat"]
+    storage_metal = plan["storage_metal"]
+    mode = plan["storage_fee_mode"]
+
+    portfolio = {m: 0.0 for m in allocation}
+    history = []
+    invested = 0.0
+    withdrawn = 0.0
+    decumulation = has_withdrawals(plan)
+
+    all_dates = data.loc[plan["initial_date"]:plan_end(plan)].index
+    with profiling.stage("purchase_dates"):
+        purchase_dates = set(generate_purchase_dates(
+            data.index, plan["initial_date"], plan["purchase_freq"], plan["purchase_day"], plan["end_purchase_date"]
+        ))
+        withdrawal_dates = set(data.index[withdrawal_positions(data.index, plan)])
+    withdrawal = withdrawal_terms([plan], data.index, inflation)
+
+    strategy = None
+    if not strategies.is_fixed(plan):
+        metal_list = list(allocation)
+        buy_prices, sell_prices = price_matrices(data, metal_list, currency)
+        strategy = strategies.build(
+            [plan], buy_prices, _days(data.index),
+            np.array([[allocation[m] for m in metal_list]]),
+            np.array([[1 + margins[m] / 100 for m in metal_list]]),
+            np.array([[1 + buyback_discounts[m] / 100 for m in metal_list]]),
+            sell_prices,
+        )[0][0]
+        purchases_made = 0
+
+    last_rebalance_dates = {
+        "rebalance_1": None,
+        "rebalance_2": None
+    }
+
+    def apply_rebalance(d, label, condition_enabled, threshold_percent):
+        nonlocal last_rebalance_dates
+        profiling.count("apply_rebalance")
+
+        min_days_between_rebalances = 30
+
+        last_date = last_rebalance_dates.get(label)
+        if last_date is not None and (d - last_date).days < min_days_between_rebalances:
+            return f"rebalancing_skipped_{label}_too_soon"
+
+        prices = data.loc[d]
+        total_value = sum(prices[sell_col[m]] * portfolio[m] for m in allocation)
+
+        if total_value == 0:
+            return f"rebalancing_skipped_{label}_no_value"
+
+        current_shares = {
+            m: (prices[sell_col[m]] * portfolio[m]) / total_value
+            for m in allocation
+        }
+
+        rebalance_trigger = False
+        for metal in allocation:
+            deviation = abs(current_shares[metal] - allocation[metal]) * 100
+            if deviation >= threshold_percent:
+                rebalance_trigger = True
+                break
+
+        if condition_enabled and not rebalance_trigger:
+            return f"rebalancing_skipped_{label}_no_deviation"
+
+        target_value = {m: total_value * allocation[m] for m in allocation}
+
+        for metal in allocation:
+            current_value = prices[sell_col[metal]] * portfolio[metal]
+            diff = current_value - target_value[metal]
+
+            if diff > 0:
+                sell_price = prices[sell_col[metal]] * (1 + buyback_discounts[metal] / 100)
+                grams_to_sell = min(diff / sell_price, portfolio[metal])
+                portfolio[metal] -= grams_to_sell
+                cash = grams_to_sell * sell_price
+                if lots is not None:
+                    lots.sell(d, metal, grams_to_sell, sell_price, "rebalance")
+
+                for buy_metal in allocation:
+                    needed_value = target_value[buy_metal] - prices[sell_col[buy_metal]] * portfolio[buy_metal]
+                    if needed_value > 0:
+                        buy_price = prices[col[buy_metal]] * (1 + rebalance_markup[buy_metal] / 100)
+                        buy_grams = min(cash / buy_price, needed_value / buy_price)
+                        portfolio[buy_metal] += buy_grams
+                        cash -= buy_grams * buy_price
+                        if lots is not None:
+                            lots.buy(d, buy_metal, buy_grams, buy_price)
+                        if cash <= 0:
+                            break
+
+        last_rebalance_dates[label] = d
+        return label
+
+    rebalance_1_start = plan["rebalance_1_start"]
+    rebalance_2_start = plan["rebalance_2_start"]
+
+    # Początkowy zakup
+    initial_ts = data.index[data.index.get_indexer([pd.to_datetime(plan["initial_date"])], method="nearest")][0]
+    prices = data.loc[initial_ts]
+    for metal, percent in allocation.items():
+        price = prices[col[metal]] * (1 + margins[metal] / 100)
+        grams = (initial_allocation * percent) / price
+        portfolio[metal] += grams
+        if lots is not None:
+            lots.buy(initial_ts, metal, grams, price)
+    invested += initial_allocation
+    history.append((initial_ts, invested, dict(portfolio), "initial", withdrawn))
+
+    # Słownik do śledzenia ostatnich dat naliczania kosztów magazynowych
+    last_storage_dates = {}
+
+    n_days = len(all_dates)
+    profiling.count("simulated_days", n_days)
+    loop_started = time.perf_counter()
+    for i, d in enumerate(all_dates):
+        if progress is not None and i % PROGRESS_EVERY_DAYS == 0:
+            progress(i / n_days)
+
+        actions = []
+
+        if d in purchase_dates:
+            prices = data.loc[d]
+            if strategy is None:
+                for metal, percent in allocation.items():
+                    price = prices[col[metal]] * (1 + margins[metal] / 100)
+                    grams = (purchase_amount * percent) / price
+                    portfolio[metal] += grams
+                    if lots is not None:
+                        lots.buy(d, metal, grams, price)
+                invested += purchase_amount
+            else:
+                # Odcinek jednego dnia - kwoty na metale ze strategii
+                purchases_made += 1
+                amounts, spent = strategy.amounts(
+                    np.array([0]), np.array([data.index.get_loc(d)]), np.array([[True]]),
+                    np.array([[portfolio[m] for m in allocation]]), np.array([invested]), np.array([[purchases_made]])
+                )
+                for j, metal in enumerate(allocation):
+                    price = prices[col[metal]] * (1 + margins[metal] / 100)
+                    grams = float(amounts[0, 0, j]) / price
+                    portfolio[metal] += grams
+                    if lots is not None and grams > 0:
+                        lots.buy(d, metal, grams, price)
+                invested += float(spent[0, 0])
+            actions.append("recurring")
+
+        if plan["rebalance_1"] and d >= pd.to_datetime(rebalance_1_start) and d.month == rebalance_1_start.month and d.day == rebalance_1_start.day:
+            actions.append(apply_rebalance(d, "rebalance_1", plan["rebalance_1_condition"], plan["rebalance_1_threshold"]))
+
+        if plan["rebalance_2"] and d >= pd.to_datetime(rebalance_2_start) and d.month == rebalance_2_start.month and d.day == rebalance_2_start.day:
+            actions.append(apply_rebalance(d, "rebalance_2", plan["rebalance_2_condition"], plan["rebalance_2_threshold"]))
+
+        # Wypłata - sprzedaż wszystkich metali proporcjonalnie do wartości po cenie odkupu
+        if d in withdrawal_dates:
+            prices = data.loc[d]
+            sell_prices = np.array([[prices[sell_col[m]] * (1 + buyback_discounts[m] / 100) for m in allocation]])
+            holdings, left, cash, sold = withdrawal_sales(
+                np.array([[portfolio[m] for m in allocation]]), np.array([invested]), sell_prices, withdrawal, d.year
+            )
+            for j, metal in enumerate(allocation):
+                portfolio[metal] = float(holdings[0, j])
+                if lots is not None and sold[0, j] > 0:
+                    lots.sell(d, metal, float(sold[0, j]), float(sell_prices[0, j]), "withdrawal")
+            invested = float(left[0])
+            withdrawn += float(cash[0])
+            actions.append("withdrawal")
+
+        # Koszty magazynowe
+        should_charge_storage = False
+
+        if mode == "monthly":
+            # Sprawdź czy to ostatni dzień roboczy miesiąca
+            last_business_day = get_last_business_day_of_month(d)
+            if d.date() == last_business_day.date():
+                # Sprawdź czy nie naliczyliśmy już w tym miesiącu
+                month_key = f"{d.year}-{d.month}"
+                if month_key not in last_storage_dates:
+                    should_charge_storage = True
+                    last_storage_dates[month_key] = d
+        else:  # Rocznie
+            # Sprawdź czy to ostatni dzień roboczy roku
+            if d.month == 12:
+                last_business_day = get_last_business_day_of_year(d.year)
+                if d.date() == last_business_day.date():
+                    # Sprawdź czy nie naliczyliśmy już w tym roku
+                    year_key = str(d.year)
+                    if year_key not in last_storage_dates:
+                        should_charge_storage = True
+                        last_storage_dates[year_key] = d
+
+        if should_charge_storage:
+            profiling.count(f"storage_fee:{storage_metal if storage_metal in ('best_of_year', 'all') else 'metal'}")
+            storage_cost = invested * (storage_fee / 100) * (1 + vat / 100)
+            prices = data.loc[d]
+
+            if storage_metal == "best_of_year":
+                # Znajdź najlepszy metal z okresu
+                if mode == "monthly":
+                    # Dla miesięcznego - najlepszy z miesiąca
+                    month_start = d.replace(day=1)
+                    month_data = data.loc[month_start:d]
+                else:
+                    # Dla rocznego - najlepszy z roku
+                    year_start = pd.Timestamp(d.year, 1, 1)
+                    if year_start < data.index.min():
+                        year_start = data.index.min()
+                    month_data = data.loc[year_start:d]
+
+                if len(month_data) >= 2:
+                    growth = {}
+                    start_prices = month_data.iloc[0]
+                    end_prices = month_data.iloc[-1]
+
+                    for metal in allocation:
+                        if portfolio[metal] > 0:  # Tylko metale które posiadamy
+                            growth[metal] = (end_prices[sell_col[metal]] / start_prices[sell_col[metal]]) - 1
+
+                    if growth:
+                        metal_to_sell = max(growth, key=growth.get)
+                        sell_price = prices[sell_col[metal_to_sell]] * (1 + buyback_discounts[metal_to_sell] / 100)
+                        grams_needed = storage_cost / sell_price
+                        grams_needed = min(grams_needed, portfolio[metal_to_sell])
+                        portfolio[metal_to_sell] -= grams_needed
+                        if lots is not None:
+                            lots.sell(d, metal_to_sell, grams_needed, sell_price, "storage_fee")
+
+            elif storage_metal == "all":
+                total_value = sum(prices[sell_col[m]] * portfolio[m] for m in allocation)
+                if total_value > 0:
+                    for metal in allocation:
+                        share = (prices[sell_col[metal]] * portfolio[metal]) / total_value
+                        cash_needed = storage_cost * share
+                        sell_price = prices[sell_col[metal]] * (1 + buyback_discounts[metal] / 100)
+                        grams_needed = cash_needed / sell_price
+                        grams_needed = min(grams_needed, portfolio[metal])
+                        portfolio[metal] -= grams_needed
+                        if lots is not None:
+                            lots.sell(d, metal, grams_needed, sell_price, "storage_fee")
+            else:
+                # Konkretny metal
+                if portfolio[storage_metal] > 0:
+                    sell_price = prices[sell_col[storage_metal]] * (1 + buyback_discounts[storage_metal] / 100)
+                    grams_needed = storage_cost / sell_price
+                    grams_needed = min(grams_needed, portfolio[storage_metal])
+                    portfolio[storage_metal] -= grams_needed
+                    if lots is not None:
+                        lots.sell(d, storage_metal, grams_needed, sell_price, "storage_fee")
+
+            actions.append("storage_fee")
+            history.append((d, invested, dict(portfolio), "storage_fee", withdrawn))
+
+        if actions and "storage_fee" not in actions:
+            history.append((d, invested, dict(portfolio), ", ".join(actions), withdrawn))
+
+    profiling.record("daily_loop", time.perf_counter() - loop_started)
+
+    # Tworzenie DataFrame z wynikami
+    result_started = time.perf_counter()
+    df_result = pd.DataFrame([{
+        "Date": h[0],
+        "Invested": h[1],
+        **({"Withdrawn": h[4]} if decumulation else {}),
+        **{m: h[2][m] for m in allocation},
+        "Portfolio Value": sum(
+            data.loc[h[0]][sell_col[m]] * (1 + buyback_discounts[m] / 100) * h[2][m]
+            for m in allocation
+        ),
+        "Akcja": h[3]
+    } for h in history]).set_index("Date")
+    profiling.record("build_result", time.perf_counter() - result_started)
+
+    return df_result
+
+
+# ====== SYMULACJA WSADOWA (wiele planów w jednym przebiegu) ======
+# Parametry wspólne dla planów grupowanych razem (ta sama waluta, ceny i zakres dat)
+SHARED_KEYS = ("currency", "execution_fix", "initial_date", "end_purchase_date")
+
+# Parametry, które muszą być wspólne dla planów liczonych razem w simulate_batch (zakres dat może się różnić)
+PRICE_KEYS = ("currency", "execution_fix")
+
+# Parametry, od których zależy kalendarz zdarzeń planu (event_calendar)
+CALENDAR_KEYS = ("initial_date", "end_purchase_date", "purchase_freq", "purchase_day", "rebalance_1", "rebalance_1_start",
+                 "rebalance_2", "rebalance_2_start", "storage_fee_mode", "withdrawal_mode", "withdrawal_freq",
+                 "withdrawal_day", "withdrawal_start", "withdrawal_end")
+
+EVENT_KINDS = ("purchase", "rebalance_1", "rebalance_2", "withdrawal", "storage")
+
+# Najdłuższy odcinek dni z samymi zakupami liczony jednym wywołaniem strategii (pamięć: plany x dni x metale)
+PURCHASE_INTERVAL_DAYS = 256
+
+# Budżet pamięci bloku dni w simulate_batch (maski zdarzeń i bufory zakupów wszystkich planów) - rząd pamięci L2
+CACHE_BLOCK_BYTES = 1 << 20
+# Najkrótszy blok dni (bardzo duże paczki planów)
+MIN_BLOCK_DAYS = 16
+
+# Powody pominięcia rebalancingu (kody z _rebalance_many)
+REBALANCE_SKIPS = (None, "no_value", "no_deviation")
+
+# Jednostka zaokrąglenia float32 i zapas na operacje jednego zdarzenia (zakup, rebalancing, wypłata, opłata)
+FLOAT32_UNIT = 2.0 ** -24
+FLOAT32_OPS_PER_EVENT = 16
+
+
+def float32_error_bound(events):
+    """Górne oszacowanie względnego błędu wyniku simulate_batch(dtype=np.float32) wobec float64 po events zdarzeniach"""
+    return FLOAT32_OPS_PER_EVENT * FLOAT32_UNIT * (np.asarray(events) + 1)
+
+
+def sell_column(data, metal, currency):
+    """Kolumna cen sprzedaży i wyceny metalu - osobna tylko dla cen wykonania z market_data.SELL_FIXES"""
+    column = f"{metal}_{currency}{SELL_SUFFIX}"
+    return column if column in data.columns else f"{metal}_{currency}"
+
+
+def price_matrices(data, metals, currency):
+    """(ceny zakupu, ceny sprzedaży i wyceny) jako tablice dni x metale - bez osobnych cen sprzedaży ta sama tablica"""
+    prices = data[[f"{m}_{currency}" for m in metals]].to_numpy(dtype=float)
+    columns = [sell_column(data, m, currency) for m in metals]
+    if columns == [f"{m}_{currency}" for m in metals]:
+        return prices, prices
+    return prices, data[columns].to_numpy(dtype=float)
+
+
+def _days(dates):
+    """Daty jako datetime64[D] (arytmetyka kalendarza bez obiektów pandas)"""
+    return np.asarray(dates.values if hasattr(dates, "values") else dates).astype("datetime64[D]")
+
+
+def last_business_days(dates):
+    """Ostatni dzień roboczy (pon-pt) miesiąca dla każdej daty - wektorowo (datetime64[D])"""
+    month_end = (_days(dates).astype("datetime64[M]") + 1).astype("datetime64[D]") - 1
+    weekday = (month_end.astype(np.int64) + 3) % 7  # 1970-01-01 to czwartek
+    return month_end - np.maximum(weekday - 4, 0)
+
+
+def nearest_positions(index_days, targets):
+    """index.get_indexer(targets, method="nearest") dla posortowanych dni (remis - późniejsza sesja)"""
+    right = np.searchsorted(index_days, targets, side="left")
+    left = np.searchsorted(index_days, targets, side="right") - 1
+    has_right = right < len(index_days)
+    has_left = left >= 0
+    left_distance = targets - index_days[np.maximum(left, 0)]
+    right_distance = index_days[np.minimum(right, len(index_days) - 1)] - targets
+    use_left = has_left & (~has_right | (left_distance < right_distance))
+    return np.where(use_left, left, right)
+
+
+def purchase_targets(start_date, freq, day, end_date):
+    """Terminy zakupu z generate_purchase_dates przed dopasowaniem do sesji (datetime64[D])"""
+    start, end = np.datetime64(pd.Timestamp(start_date).date(), "D"), np.datetime64(pd.Timestamp(end_date).date(), "D")
+    none = np.array([], dtype="datetime64[D]")
+    if start > end:
+        return none
+    if freq == "week":
+        if day not in range(7):
+            return none
+        weekday = (start.astype(np.int64) + 3) % 7
+        return np.arange(start + (int(day) - weekday) % 7, end + 1, 7)
+    if freq in ("month", "quarter"):
+        if min(day, 28) < 1:
+            raise ValueError("day is out of range for month")
+        step = 1 if freq == "month" else 3
+        months = np.arange(start.astype("datetime64[M]"), end.astype("datetime64[M]") + 1, step)
+        dates = months.astype("datetime64[D]") + (min(int(day), 28) - 1)
+        return dates[dates <= end]
+    return none
+
+
+def purchase_positions(index, start_date, freq, day, end_date, index_days=None):
+    """Pozycje w indeksie dat z generate_purchase_dates - wektorowo (te same daty, najbliższe sesje)"""
+    dates = purchase_targets(start_date, freq, day, end_date)
+    if not len(dates):
+        return np.array([], dtype=np.int64)
+    return nearest_positions(_days(index) if index_days is None else index_days, dates)
+
+
+def day_fields(days):
+    """Pola kalendarza dni (datetime64[D]) dla calendar_masks: miesiąc 1-12, dzień miesiąca, ostatni dzień roboczy"""
+    months = days.astype("datetime64[M]")
+    return {
+        "month": months.astype(np.int64) % 12 + 1,
+        "day": (days - months.astype("datetime64[D]")).astype(np.int64) + 1,
+        "month_end": days == last_business_days(days),
+    }
+
+
+def event_calendar(index, plan, index_days=None, fields=None):
+    """Pozycja pierwszego dnia symulacji i maski dni z zakupem, rebalancingiem, wypłatą i opłatą magazynową.
+
+    fields - day_fields(index_days) liczone raz dla wielu planów na tym samym indeksie.
+    """
+    index_days = _days(index) if index_days is None else index_days
+    start = np.searchsorted(index_days, np.datetime64(pd.Timestamp(plan["initial_date"]).date(), "D"), side="left")
+    stop = np.searchsorted(index_days, np.datetime64(plan_end(plan), "D"), side="right")
+    stop = max(start, stop)
+    all_dates = index[start:stop]
+    days = index_days[start:stop]
+
+    purchase = np.zeros(len(all_dates), dtype=bool)
+    positions = purchase_positions(
+        index, plan["initial_date"], plan["purchase_freq"], plan["purchase_day"], plan["end_purchase_date"], index_days
+    ) - start
+    purchase[positions[(positions >= 0) & (positions < len(all_dates))]] = True
+    withdrawal = np.zeros(len(all_dates), dtype=bool)
+    positions = withdrawal_positions(index, plan, index_days) - start
+    withdrawal[positions[(positions >= 0) & (positions < len(all_dates))]] = True
+    fields = None if fields is None else {name: values[start:stop] for name, values in fields.items()}
+    return start, all_dates, {"purchase": purchase, "withdrawal": withdrawal, **calendar_masks(days, plan, fields)}
+
+
+def calendar_masks(days, plan, fields=None):
+    """Maski dni (datetime64[D]) z rebalancingiem i opłatą magazynową - zależą tylko od kalendarza"""
+    fields = day_fields(days) if fields is None else fields
+    month_number = fields["month"]
+    calendar = {}
+    for label in ("rebalance_1", "rebalance_2"):
+        rebalance_start = plan[f"{label}_start"]
+        if not plan[label]:
+            calendar[label] = np.zeros(len(days), dtype=bool)
+            continue
+        calendar[label] = (
+            (days >= np.datetime64(pd.Timestamp(rebalance_start).date(), "D"))
+            & (month_number == rebalance_start.month)
+            & (fields["day"] == rebalance_start.day)
+        )
+    storage = fields["month_end"].copy()
+    if plan["storage_fee_mode"] != "monthly":
+        storage &= month_number == 12
+    calendar["storage"] = storage
+    return calendar
+
+
+def _rebalance_one(holdings, prices, weights, buyback, markup, condition_enabled, threshold_percent, buy_prices=None):
+    """apply_rebalance z simulate() dla jednego wariantu (holdings: lista, zmieniana w miejscu).
+
+    prices - ceny sprzedaży i wyceny, buy_prices - ceny dokupowanych metali (domyślnie prices).
+    """
+    buy_prices = prices if buy_prices is None else buy_prices
+    n = len(holdings)
+    total_value = sum(prices[j] * holdings[j] for j in range(n))
+    if total_value == 0:
+        return "no_value"
+
+    rebalance_trigger = False
+    for j in range(n):
+        deviation = abs((prices[j] * holdings[j]) / total_value - weights[j]) * 100
+        if deviation >= threshold_percent:
+            rebalance_trigger = True
+            break
+    if condition_enabled and not rebalance_trigger:
+        return "no_deviation"
+
+    target_value = [total_value * weights[j] for j in range(n)]
+    for j in range(n):
+        diff = prices[j] * holdings[j] - target_value[j]
+        if diff > 0:
+            sell_price = prices[j] * buyback[j]
+            grams_to_sell = min(diff / sell_price, holdings[j])
+            holdings[j] -= grams_to_sell
+            cash = grams_to_sell * sell_price
+
+            for b in range(n):
+                needed_value = target_value[b] - prices[b] * holdings[b]
+                if needed_value > 0:
+                    buy_price = buy_prices[b] * markup[b]
+                    buy_grams = min(cash / buy_price, needed_value / buy_price)
+                    holdings[b] += buy_grams
+                    cash -= buy_grams * buy_price
+                    if cash <= 0:
+                        break
+    return None
+
+
+def _rebalance_many(holdings, prices, weights, buyback, markup, condition_enabled, threshold_percent, buy_prices=None):
+    """_rebalance_one dla wielu planów naraz (holdings, weights, buyback, markup: plany x metale; holdings
+    zmieniane w miejscu). Zwraca kod pominięcia dla każdego planu (indeks REBALANCE_SKIPS, 0 - wykonany)."""
+    buy_prices = prices if buy_prices is None else buy_prices
+    n = holdings.shape[1]
+    values = prices * holdings
+    total_value = values[:, 0]
+    for j in range(1, n):
+        total_value = total_value + values[:, j]
+    skipped = np.where(total_value == 0, 1, 0)
+    divisor = np.where(total_value == 0, 1, total_value)
+    trigger = (np.abs(values / divisor[:, np.newaxis] - weights) * 100 >= threshold_percent[:, np.newaxis]).any(axis=1)
+    skipped[(skipped == 0) & condition_enabled & ~trigger] = 2
+
+    rows = np.flatnonzero(skipped == 0)
+    part = holdings[rows]
+    target_value = total_value[rows, np.newaxis] * weights[rows]
+    for j in range(n):
+        diff = prices[j] * part[:, j] - target_value[:, j]
+        sellers = np.flatnonzero(diff > 0)
+        if not len(sellers):
+            continue
+        sell_price = prices[j] * buyback[rows[sellers], j]
+        grams_to_sell = np.minimum(diff[sellers] / sell_price, part[sellers, j])
+        part[sellers, j] -= grams_to_sell
+        cash = grams_to_sell * sell_price
+        # Zakupy po kolei jak w _rebalance_one - plan kończy, gdy po zakupie nie ma już gotówki
+        buying = np.ones(len(sellers), dtype=bool)
+        for b in range(n):
+            needed_value = target_value[sellers, b] - prices[b] * part[sellers, b]
+            buys = buying & (needed_value > 0)
+            if not buys.any():
+                continue
+            buy_price = buy_prices[b] * markup[rows[sellers], b]
+            buy_grams = np.minimum(cash / buy_price, needed_value / buy_price)
+            part[sellers[buys], b] += buy_grams[buys]
+            cash = np.where(buys, cash - buy_grams * buy_price, cash)
+            buying &= ~(buys & (cash <= 0))
+    holdings[rows] = part
+    return skipped
+
+
+def _charge_storage_one(holdings, prices, buyback, storage_cost, storage_metal, metals, window):
+    """Sprzedaż metalu na opłatę magazynową jak w simulate() (window: ceny okresu dla best_of_year)"""
+    if storage_metal == "best_of_year":
+        if len(window) >= 2:
+            growth = {j: (window[-1][j] / window[0][j]) - 1 for j in range(len(metals)) if holdings[j] > 0}
+            if growth:
+                j = max(growth, key=growth.get)
+                sell_price = prices[j] * buyback[j]
+                holdings[j] -= min(storage_cost / sell_price, holdings[j])
+    elif storage_metal == "all":
+        total_value = sum(prices[j] * holdings[j] for j in range(len(metals)))
+        if total_value > 0:
+            for j in range(len(metals)):
+                share = (prices[j] * holdings[j]) / total_value
+                sell_price = prices[j] * buyback[j]
+                holdings[j] -= min((storage_cost * share) / sell_price, holdings[j])
+    else:
+        j = metals.index(storage_metal)
+        if holdings[j] > 0:
+            sell_price = prices[j] * buyback[j]
+            holdings[j] -= min(storage_cost / sell_price, holdings[j])
+
+
+def simulate_batch(data, plans, progress=None, final_only=False, dtype=np.float64, inflation=None):
+    """Kilka planów o wspólnej walucie i cenie wykonania (PRICE_KEYS) w jednym przebiegu.
+
+    Macierz cen jest wspólna, a kalendarze planów ułożone na jednej osi dni (zakresy dat mogą się
+    różnić): odwiedzane są tylko dni, w których któryś plan ma zdarzenie, a zakupy, rebalancing,
+    wypłaty, opłaty i wycena liczone są dla wszystkich planów naraz. Kolejne dni, w których żaden plan
+    nie ma innego zdarzenia niż zakup, liczone są jednym odcinkiem (strategie zakupów ze strategies.py
+    dostają cały odcinek). Oś dni przetwarzana jest blokami (block_days): maski zdarzeń planów
+    rozpakowywane są ze spakowanych bitowo kalendarzy do buforów bloku, używanych ponownie w kolejnych
+    blokach.
+    Plany mogą różnić się kosztami, alokacją, zakresem dat, harmonogramem zakupów i wypłat, strategią
+    zakupów, rebalancingiem i trybem opłat. inflation - tabela inflacji do indeksacji wypłat jak w simulate().
+    Zwraca listę wyników identycznych z simulate().
+
+    final_only=True - bez historii zdarzeń (stała pamięć na plan): słownik tablic z ostatnim
+    wierszem każdego planu ("date", "invested", "holdings", "value"), sumą opłat magazynowych
+    ("storage_cost"), sumą wypłat ("withdrawn") i liczbą dni ze zdarzeniami planu ("events").
+
+    dtype=np.float32 - ilości, kwoty i wycena w pojedynczej precyzji (połowa pamięci buforów i wyników).
+    Względny błąd wartości końcowej wobec float64 nie przekracza float32_error_bound(liczba zdarzeń
+    planu), o ile float32 nie zmienia decyzji planu (próg odchylenia rebalancingu, wyczerpanie portfela).
+    """
+    plan = plans[0]
+    metals = list(plan["allocation"])
+    for other in plans[1:]:
+        if any(other.get(key) != plan.get(key) for key in PRICE_KEYS) or list(other["allocation"]) != metals:
+            raise ValueError("simulate_batch: plany muszą mieć wspólną walutę, cenę wykonania i listę metali")
+
+    dtype = np.dtype(dtype)
+    n_plans = len(plans)
+    currency = plan.get("currency", BASE_CURRENCY)
+    index = data.index
+    index_days = _days(index)
+    # Ceny float64 zostają do decyzji zależnych tylko od cen (metal best_of_year), obliczenia w dtype;
+    # sell_prices - sprzedaż i wycena (ta sama tablica, gdy dane nie mają osobnych cen sprzedaży)
+    exact_prices, exact_sell_prices = price_matrices(data, metals, currency)
+    prices = exact_prices.astype(dtype, copy=False)
+    sell_prices = prices if exact_sell_prices is exact_prices else exact_sell_prices.astype(dtype, copy=False)
+
+    def factors(key):
+        return np.array([[1 + other[key][m] / 100 for m in metals] for other in plans]).astype(dtype)
+
+    weights = np.array([[other["allocation"][m] for m in metals] for other in plans]).astype(dtype)
+    margin, buyback, markup = factors("margins"), factors("buyback"), factors("rebalance_markup")
+    condition = {label: np.array([bool(other[f"{label}_condition"]) for other in plans]) for label in ("rebalance_1", "rebalance_2")}
+    threshold = {label: np.array([float(other[f"{label}_threshold"]) for other in plans]) for label in ("rebalance_1", "rebalance_2")}
+    fee_rate = np.array([other["storage_fee"] / 100 for other in plans]).astype(dtype)
+    vat_factor = np.array([1 + other["vat"] / 100 for other in plans]).astype(dtype)
+    storage_metal = np.array([other["storage_metal"] for other in plans])
+    monthly_fee = np.array([other["storage_fee_mode"] == "monthly" for other in plans])
+    withdrawal = withdrawal_terms(plans, index, inflation)
+    decumulation = [has_withdrawals(other) for other in plans]
+
+    # Kalendarze (dni zdarzeń każdego rodzaju) - plany różniące się tylko kwotami i kosztami mają ten sam
+    # kalendarz, liczony raz
+    cache = {}
+    calendars = []
+    fields = day_fields(index_days)
+    group = np.empty(n_plans, dtype=np.int64)
+    for k, other in enumerate(plans):
+        calendar_key = tuple(str(other.get(key)) for key in CALENDAR_KEYS)
+        if calendar_key not in cache:
+            cache[calendar_key] = len(calendars)
+            plan_start, plan_dates, masks = event_calendar(index, other, index_days, fields)
+            calendars.append((plan_start, len(plan_dates),
+                              {kind: np.flatnonzero(masks[kind]).astype(np.int32) for kind in EVENT_KINDS}))
+        group[k] = cache[calendar_key]
+    start = min(c[0] for c in calendars)
+    stop = max(c[0] + c[1] for c in calendars)
+    n_days = stop - start
+
+    # Bloki dni (wielokrotność 8 - granice bajtów kalendarzy): maski zdarzeń i bufory zakupów wszystkich
+    # planów w bloku mieszczą się w CACHE_BLOCK_BYTES
+    bytes_per_day = n_plans * (len(EVENT_KINDS) + (2 * len(metals) + 2) * dtype.itemsize)
+    block_days = int(np.clip(CACHE_BLOCK_BYTES // bytes_per_day, MIN_BLOCK_DAYS, PURCHASE_INTERVAL_DAYS)) // 8 * 8
+
+    # Kalendarze na wspólnej osi dni (od najwcześniejszego startu) spakowane bitowo: rodzaj x kalendarz x dni/8,
+    # z zapasem na ostatni blok; dla planów rozpakowywany jest tylko bieżący blok
+    packed = np.zeros((len(EVENT_KINDS), len(calendars), (n_days + 7) // 8 + block_days // 8), dtype=np.uint8)
+    event_day = np.zeros(n_days, dtype=bool)
+    other_event = np.zeros(n_days, dtype=bool)
+    last_event = np.full(len(calendars), -1)
+    event_count = np.zeros(len(calendars), dtype=np.int64)
+    row = np.zeros(packed.shape[2] * 8, dtype=bool)
+    for u, (plan_start, _, offsets) in enumerate(calendars):
+        for n_kind, kind in enumerate(EVENT_KINDS):
+            day = offsets[kind] + (plan_start - start)
+            if not len(day):
+                continue
+            row[day] = True
+            packed[n_kind, u] = np.packbits(row)
+            row[day] = False
+            event_day[day] = True
+            if kind != "purchase":
+                other_event[day] = True
+            last_event[u] = max(last_event[u], int(day[-1]))
+        event_count[u] = len(np.unique(np.concatenate(list(offsets.values()))))
+    del calendars
+    event_days = np.flatnonzero(event_day)
+    plan_block = np.zeros((len(EVENT_KINDS), n_plans, block_days), dtype=np.uint8)
+    calendar = dict(zip(EVENT_KINDS, plan_block.view(bool)))
+    held_buffer = np.empty((n_plans, block_days + 1, len(metals)), dtype=dtype)
+    paid_buffer = np.empty((n_plans, block_days + 1), dtype=dtype)
+    cost_buffer = np.empty((n_plans, block_days, len(metals)), dtype=dtype)
+
+    # Początkowy zakup
+    initial_pos = nearest_positions(index_days, np.array([pd.Timestamp(other["initial_date"]).date() for other in plans],
+                                                         dtype="datetime64[D]"))
+    initial_allocation = np.array([float(other["initial_allocation"]) for other in plans]).astype(dtype)
+    holdings = (initial_allocation[:, np.newaxis] * weights) / (prices[initial_pos] * margin)
+    invested = initial_allocation.copy()
+    withdrawn = np.zeros(n_plans, dtype=dtype)
+    rows = [[(initial_pos[k], invested[k], holdings[k].copy(), "initial", withdrawn.dtype.type(0))] for k in range(n_plans)]
+
+    # Dzień ostatniego rebalancingu (numer dnia; brak - dawno przed początkiem danych)
+    last_rebalance = {"rebalance_1": np.full(n_plans, -10 ** 6), "rebalance_2": np.full(n_plans, -10 ** 6)}
+    storage_paid = np.zeros(n_plans, dtype=dtype)
+
+    # Zakupy - strategie dla grup planów, kwoty dla całego odcinka dni naraz
+    purchase_groups = strategies.build(plans, prices, index_days, weights, margin, buyback, sell_prices)
+    purchases_made = np.zeros(n_plans, dtype=np.int64)
+
+    def buy(columns, positions, record):
+        """Zakupy w kolumnach bloku columns (sesje positions); record - wiersz "recurring" dla każdego zakupu"""
+        buys = calendar["purchase"][:, columns]
+        day_prices = prices[positions]
+        n_columns = len(columns)
+        for strategy, members in purchase_groups:
+            active = np.flatnonzero(buys[members].any(axis=1))
+            if not len(active):
+                continue
+            k = members[active]
+            mask = buys[k]
+            numbers = purchases_made[k, np.newaxis] + np.cumsum(mask, axis=1)
+            amounts, spent = strategy.amounts(active, positions, mask, holdings[k], invested[k], numbers)
+            # Stan po każdym dniu odcinka - sumy narastające od stanu sprzed odcinka, dzień po dniu (w buforach bloku)
+            held = held_buffer[:len(k), :n_columns + 1]
+            paid = paid_buffer[:len(k), :n_columns + 1]
+            held[:, 0] = holdings[k]
+            paid[:, 0] = invested[k]
+            cost = np.multiply(day_prices, margin[k, np.newaxis], out=cost_buffer[:len(k), :n_columns])
+            np.divide(amounts, cost, out=held[:, 1:])
+            paid[:, 1:] = spent
+            np.cumsum(held, axis=1, out=held)
+            np.cumsum(paid, axis=1, out=paid)
+            holdings[k] = held[:, -1]
+            invested[k] = paid[:, -1]
+            purchases_made[k] = numbers[:, -1]
+            if record:
+                for r, t in zip(*np.nonzero(mask)):
+                    rows[k[r]].append((positions[t], paid[r, t + 1], held[r, t + 1].copy(), "recurring", withdrawn[k[r]]))
+
+    loop_started = time.perf_counter()
+    for block_start in range(0, n_days, block_days):
+        block_end = min(block_start + block_days, n_days)
+        block_events = event_days[np.searchsorted(event_days, block_start):np.searchsorted(event_days, block_end)]
+        if not len(block_events):
+            continue
+        unpacked = np.unpackbits(packed[:, :, block_start // 8:(block_start + block_days) // 8], axis=2)
+        np.take(unpacked, group, axis=1, out=plan_block)
+
+        # Odcinki: kolejne dni samych zakupów albo pojedynczy dzień, w którym któryś plan ma inne zdarzenie
+        segments = []
+        for i in block_events.tolist():
+            if other_event[i] or not segments or other_event[segments[-1][-1]]:
+                segments.append([i])
+            else:
+                segments[-1].append(i)
+
+        for segment in segments:
+            i = segment[0]
+            if progress is not None:
+                progress(i / n_days)
+            if not other_event[i]:
+                columns = np.array(segment) - block_start
+                buy(columns, start + block_start + columns, not final_only)
+                continue
+            c = i - block_start
+            pos = start + i
+            day = index_days[pos]
+            day_number = int(day.astype(np.int64))
+            day_prices = sell_prices[pos]
+            actions = {}
+
+            if calendar["purchase"][:, c].any():
+                buy(np.array([c]), np.array([pos]), False)
+                if not final_only:
+                    for k in np.flatnonzero(calendar["purchase"][:, c]):
+                        actions.setdefault(k, []).append("recurring")
+
+            for label in ("rebalance_1", "rebalance_2"):
+                due = np.flatnonzero(calendar[label][:, c])
+                if not len(due):
+                    continue
+                too_soon = day_number - last_rebalance[label][due] < 30
+                run = due[~too_soon]
+                part = holdings[run]
+                skipped = _rebalance_many(part, day_prices, weights[run], buyback[run], markup[run],
+                                          condition[label][run], threshold[label][run], prices[pos])
+                holdings[run] = part
+                last_rebalance[label][run[skipped == 0]] = day_number
+                if not final_only:
+                    for k in due[too_soon]:
+                        actions.setdefault(k, []).append(f"rebalancing_skipped_{label}_too_soon")
+                    for k, reason in zip(run, skipped):
+                        actions.setdefault(k, []).append(f"rebalancing_skipped_{label}_{REBALANCE_SKIPS[reason]}" if reason else label)
+
+            takers = np.flatnonzero(calendar["withdrawal"][:, c])
+            if len(takers):
+                year = int(day.astype("datetime64[Y]").astype(np.int64)) + 1970
+                holdings[takers], invested[takers], cash, _ = withdrawal_sales(
+                    holdings[takers], invested[takers], day_prices * buyback[takers], [terms[takers] for terms in withdrawal], year
+                )
+                withdrawn[takers] += cash
+                if not final_only:
+                    for k in takers:
+                        actions.setdefault(k, []).append("withdrawal")
+
+            payers = np.flatnonzero(calendar["storage"][:, c])
+            if len(payers):
+                storage_cost = invested[payers] * fee_rate[payers] * vat_factor[payers]
+                storage_paid[payers] += storage_cost
+                for metal, monthly in set(zip(storage_metal[payers].tolist(), monthly_fee[payers].tolist())):
+                    members = np.flatnonzero((storage_metal[payers] == metal) & (monthly_fee[payers] == monthly))
+                    window = []
+                    if metal == "best_of_year":
+                        if monthly:
+                            period_start = day.astype("datetime64[M]").astype("datetime64[D]")
+                        else:
+                            period_start = max(day.astype("datetime64[Y]").astype("datetime64[D]"), index_days[0])
+                        first = int(np.searchsorted(index_days, period_start))
+                        if pos > first:
+                            window = [exact_sell_prices[first], exact_sell_prices[pos]]
+                    part = holdings[payers[members]]
+                    _charge_storage_many(part, day_prices, buyback[payers[members]], storage_cost[members], metal, metals, window)
+                    holdings[payers[members]] = part
+
+            # Tryb final_only: wiersze nie są zapisywane
+            if not final_only:
+                for k in np.flatnonzero(plan_block[:, :, c].any(axis=0)):
+                    action = "storage_fee" if calendar["storage"][k, c] else ", ".join(actions[k])
+                    rows[k].append((pos, invested[k], holdings[k].copy(), action, withdrawn[k]))
+    profiling.record("batch_loop", time.perf_counter() - loop_started)
+
+    # Wyniki - wycena po cenie odkupu
+    if final_only:
+        # Ostatni wiersz planu = ostatni dzień z jego zdarzeniem (po nim stan się nie zmienia)
+        plan_last = last_event[group]
+        positions = np.where(plan_last >= 0, start + plan_last, initial_pos)
+        values = sell_prices[positions] * buyback * holdings
+        portfolio_value = values[:, 0]
+        for j in range(1, len(metals)):
+            portfolio_value = portfolio_value + values[:, j]
+        return {
+            "date": index[positions],
+            "invested": invested.copy(),
+            "holdings": holdings.copy(),
+            "value": portfolio_value,
+            "storage_cost": storage_paid,
+            "withdrawn": withdrawn,
+            "events": event_count[group],
+        }
+
+    return [_result_frame(index, sell_prices, buyback[k], metals, rows[k], decumulation[k]) for k in range(n_plans)]
+
+
+def _result_frame(index, prices, buyback, metals, rows, withdrawals=False):
+    """Wynik w formacie simulate() z wierszy (pozycja, zainwestowano, ilości, akcja[, suma wypłat]) - wycena po cenie odkupu
+    (prices - ceny sprzedaży i wyceny)"""
+    positions = np.array([row[0] for row in rows])
+    history = np.array([row[2] for row in rows])
+    values = prices[positions] * buyback * history
+    portfolio_value = values[:, 0]
+    for j in range(1, len(metals)):
+        portfolio_value = portfolio_value + values[:, j]
+    frame = pd.DataFrame({
+        "Date": index[positions],
+        "Invested": np.array([row[1] for row in rows], dtype=float),
+        **({"Withdrawn": np.array([row[4] for row in rows], dtype=float)} if withdrawals else {}),
+        **{m: history[:, j] for j, m in enumerate(metals)},
+        "Portfolio Value": portfolio_value,
+        "Akcja": [row[3] for row in rows],
+    })
+    return frame.set_index("Date")
+
+
+# ====== PODGLĄD (siatka końców miesięcy) ======
+def preview_supported(plan):
+    """Podgląd sumuje zakupy miesiąca - tylko stała kwota zakupu i plan bez wypłat"""
+    return not has_withdrawals(plan) and strategies.is_fixed(plan)
+
+
+def simulate_preview(data, plan):
+    """Przybliżony wynik w kilkanaście ms: zdarzenia każdego miesiąca przeniesione na jego ostatnią sesję.
+
+    Zakupy z miesiąca są sumowane i kupowane po cenie z końca miesiąca, rebalancing i opłaty
+    magazynowe liczone są w tym samym dniu. Kolumny jak w simulate(); błąd względem wyniku
+    dokładnego - analytics.preview_error. Tylko plany bez wypłat, ze stałą kwotą zakupu (preview_supported).
+    """
+    if not preview_supported(plan):
+        raise ValueError("simulate_preview: podgląd obsługuje tylko plany bez wypłat ze stałą kwotą zakupu")
+    metals = list(plan["allocation"])
+    currency = plan.get("currency", BASE_CURRENCY)
+    index = data.index
+    prices, sell_prices = price_matrices(data, metals, currency)
+    weights = np.array([plan["allocation"][m] for m in metals])
+    margin = np.array([1 + plan["margins"][m] / 100 for m in metals])
+    buyback = np.array([1 + plan["buyback"][m] / 100 for m in metals])
+    markup = [1 + plan["rebalance_markup"][m] / 100 for m in metals]
+
+    start, all_dates, calendar = event_calendar(index, plan)
+    initial_pos = nearest_positions(_days(index), np.array([pd.Timestamp(plan["initial_date"]).date()], dtype="datetime64[D]"))[0]
+    holdings = (plan["initial_allocation"] * weights) / (prices[initial_pos] * margin)
+    invested = float(plan["initial_allocation"])
+    rows = [(initial_pos, invested, holdings.copy(), "initial")]
+    if not len(all_dates):
+        return _result_frame(index, sell_prices, buyback, metals, rows)
+
+    # Ostatnia sesja każdego miesiąca i liczba zdarzeń w miesiącu
+    months = _days(all_dates).astype("datetime64[M]")
+    new_month = np.r_[True, months[1:] != months[:-1]]
+    month = np.cumsum(new_month) - 1
+    month_end = np.r_[np.flatnonzero(new_month)[1:] - 1, len(all_dates) - 1]
+    purchases = np.bincount(month, weights=calendar["purchase"], minlength=len(month_end))
+    events = {kind: np.bincount(month, weights=calendar[kind], minlength=len(month_end)) > 0
+              for kind in ("rebalance_1", "rebalance_2", "storage")}
+    last_rebalance = {"rebalance_1": None, "rebalance_2": None}
+
+    for m in np.flatnonzero((purchases > 0) | events["rebalance_1"] | events["rebalance_2"] | events["storage"]):
+        i = month_end[m]
+        pos = start + i
+        d = all_dates[i]
+        day_prices = sell_prices[pos]
+        actions = []
+        if purchases[m]:
+            amount = plan["purchase_amount"] * purchases[m]
+            holdings = holdings + (amount * weights) / (prices[pos] * margin)
+            invested += amount
+            actions.append("recurring")
+
+        for label in ("rebalance_1", "rebalance_2"):
+            if not events[label][m]:
+                continue
+            last_date = last_rebalance[label]
+            if last_date is not None and (d - last_date).days < 30:
+                actions.append(f"rebalancing_skipped_{label}_too_soon")
+                continue
+            row = holdings.tolist()
+            skipped = _rebalance_one(row, day_prices.tolist(), weights.tolist(), buyback.tolist(), markup,
+                                     plan[f"{label}_condition"], plan[f"{label}_threshold"], prices[pos].tolist())
+            if skipped:
+                actions.append(f"rebalancing_skipped_{label}_{skipped}")
+            else:
+                holdings = np.array(row)
+                last_rebalance[label] = d
+                actions.append(label)
+
+        if events["storage"][m]:
+            window = []
+            if plan["storage_metal"] == "best_of_year":
+                if plan["storage_fee_mode"] == "monthly":
+                    period_start = d.replace(day=1)
+                else:
+                    period_start = max(pd.Timestamp(d.year, 1, 1), index.min())
+                window = sell_prices[index.searchsorted(period_start):pos + 1].tolist()
+            storage_cost = invested * (plan["storage_fee"] / 100) * (1 + plan["vat"] / 100)
+            row = holdings.tolist()
+            _charge_storage_one(row, day_prices.tolist(), buyback.tolist(), storage_cost, plan["storage_metal"], metals, window)
+            holdings = np.array(row)
+            rows.append((pos, invested, holdings.copy(), "storage_fee"))
+        else:
+            rows.append((pos, invested, holdings.copy(), ", ".join(actions)))
+    return _result_frame(index, sell_prices, buyback, metals, rows)
+
+
+# ====== SZYBKA ŚCIEŻKA LINIOWA (plany bez rebalancingu) ======
+# Parametry podawane przy każdym wywołaniu simulate_linear - model od nich nie zależy
+LINEAR_PARAMS = ("allocation", "initial_allocation", "purchase_amount", "storage_fee", "vat")
+
+
+def linear_eligible(plan):
+    """Bez rebalancingu i wypłat, przy stałej kwocie zakupu ilości metali są liniowe względem wag i kwot
+    (opłaty liczone rekurencją po dniach opłat)"""
+    return not plan["rebalance_1"] and not plan["rebalance_2"] and not has_withdrawals(plan) and strategies.is_fixed(plan)
+
+
+def linear_model_key(plan):
+    """Klucz modelu liniowego: plan bez LINEAR_PARAMS + kolejność metali"""
+    key = {k: v for k, v in plan.items() if k not in LINEAR_PARAMS}
+    key["metals"] = list(plan["allocation"])
+    return json.dumps(key, sort_keys=True, default=str)
+
+
+def linear_model(data, plan):
+    """Wektory jednostkowe planu bez rebalancingu dla wierszy wyniku.
+
+    units[r, j] - gramy metalu j kupione do wiersza r za jednostkę kwoty zakupu cyklicznego przy wadze 1,
+    initial_cost[j] - cena zakupu początkowego (z marżą), purchases[r] - liczba zakupów do wiersza r.
+    Dla dni opłat zapisane są ceny i (best_of_year) wzrost cen w okresie.
+    """
+    if not linear_eligible(plan):
+        raise ValueError("linear_model: plan z rebalancingiem nie jest liniowy")
+    metals = list(plan["allocation"])
+    currency = plan.get("currency", BASE_CURRENCY)
+    index = data.index
+    prices, sell_prices = price_matrices(data, metals, currency)
+    margin = np.array([1 + plan["margins"][m] / 100 for m in metals])
+    buyback = np.array([1 + plan["buyback"][m] / 100 for m in metals])
+
+    start, all_dates, calendar = event_calendar(index, plan)
+    days = np.flatnonzero(calendar["purchase"] | calendar["storage"])
+    initial_pos = nearest_positions(_days(index), np.array([pd.Timestamp(plan["initial_date"]).date()], dtype="datetime64[D]"))[0]
+    positions = np.concatenate([[initial_pos], start + days])
+    purchase = np.concatenate([[False], calendar["purchase"][days]])
+    storage = np.concatenate([[False], calendar["storage"][days]])
+
+    unit = np.where(purchase[:, np.newaxis], 1.0 / (prices[positions] * margin), 0.0)
+    fee_rows = np.flatnonzero(storage)
+    windows = []
+    for r in fee_rows:
+        window = []
+        if plan["storage_metal"] == "best_of_year":
+            d = index[positions[r]]
+            if plan["storage_fee_mode"] == "monthly":
+                period_start = d.replace(day=1)
+            else:
+                period_start = max(pd.Timestamp(d.year, 1, 1), index.min())
+            first = index.searchsorted(period_start)
+            if positions[r] > first:
+                window = [sell_prices[first].tolist(), sell_prices[positions[r]].tolist()]
+        windows.append(window)
+
+    return {
+        "metals": metals,
+        "dates": index[positions],
+        "positions": positions,
+        "sell_prices": sell_prices[positions] * buyback,
+        "initial_cost": prices[initial_pos] * margin,
+        "units": np.cumsum(unit, axis=0),
+        "purchases": np.cumsum(purchase),
+        "actions": np.where(storage, "storage_fee", np.where(purchase, "recurring", "initial")),
+        "fee_rows": fee_rows,
+        "fee_prices": sell_prices[positions[fee_rows]].tolist(),
+        "fee_buyback": buyback.tolist(),
+        "fee_windows": windows,
+        "storage_metal": plan["storage_metal"],
+    }
+
+
+def simulate_linear(model, plan, final_only=False):
+    """Wynik planu bez rebalancingu z modelu liniowego (wagi, kwoty i opłata z planu) - jak simulate().
+
+    Zakupy to suma ważona wektorów jednostkowych; tylko dni opłat magazynowych liczone są po kolei
+    (_charge_storage_one na stanie portfela), bo opłata zależy od zainwestowanego kapitału i stanu metali.
+    final_only=True - tylko ostatni wiersz jak simulate_batch(final_only=True) dla jednego planu.
+    """
+    metals = model["metals"]
+    weights = np.array([plan["allocation"][m] for m in metals])
+    base = (plan["initial_allocation"] * weights) / model["initial_cost"]
+    step = plan["purchase_amount"] * weights
+    units = model["units"]
+    invested = plan["initial_allocation"] + plan["purchase_amount"] * model["purchases"]
+    fee_rows = model["fee_rows"]
+    fee_factor = (plan["storage_fee"] / 100) * (1 + plan["vat"] / 100)
+
+    # Stan portfela po każdej opłacie (różnica względem sumy samych zakupów przenoszona na kolejne wiersze)
+    after_fee = np.empty((len(fee_rows), len(metals)))
+    adjust = np.zeros((len(fee_rows), len(metals)))
+    state = base.copy()
+    previous = None
+    for k, r in enumerate(fee_rows):
+        state = state + step * (units[r] - (units[previous] if previous is not None else 0.0))
+        previous = r
+        storage_cost = invested[r] * fee_factor
+        if storage_cost != 0:
+            row = state.tolist()
+            _charge_storage_one(row, model["fee_prices"][k], model["fee_buyback"], storage_cost,
+                                model["storage_metal"], metals, model["fee_windows"][k])
+            state = np.array(row)
+        after_fee[k] = state
+        adjust[k] = state - (base + step * units[r])
+
+    rows = np.arange(len(units)) if not final_only else np.array([len(units) - 1])
+    holdings = base + step * units[rows]
+    if len(fee_rows):
+        last_fee = np.searchsorted(fee_rows, rows, side="right") - 1
+        charged = last_fee >= 0
+        holdings[charged] += adjust[last_fee[charged]]
+        # W dniu opłaty dokładny stan z rekurencji (np. wyczerpany metal = dokładnie 0)
+        is_fee = charged & (fee_rows[np.maximum(last_fee, 0)] == rows)
+        holdings[is_fee] = after_fee[last_fee[is_fee]]
+
+    values = model["sell_prices"][rows] * holdings
+    portfolio_value = values[:, 0]
+    for j in range(1, len(metals)):
+        portfolio_value = portfolio_value + values[:, j]
+    if final_only:
+        return {"date": model["dates"][rows], "invested": invested[rows].astype(float), "holdings": holdings, "value": portfolio_value}
+
+    frame = pd.DataFrame({
+        "Date": model["dates"],
+        "Invested": invested.astype(float),
+        **{m: holdings[:, j] for j, m in enumerate(metals)},
+        "Portfolio Value": portfolio_value,
+        "Akcja": model["actions"].tolist(),
+    })
+    return frame.set_index("Date")
+
+
+def _charge_storage_many(holdings, prices, buyback, storage_cost, storage_metal, metals, window):
+    """_charge_storage_one dla wielu planów naraz (holdings: plany x metale, zmieniane w miejscu;
+    buyback wspólny albo plany x metale)"""
+    sell_price = np.broadcast_to(prices * buyback, holdings.shape)
+    if storage_metal == "best_of_year":
+        if len(window) >= 2:
+            growth = np.array(window[-1]) / np.array(window[0]) - 1
+            owned = holdings > 0
+            rows = np.flatnonzero(owned.any(axis=1))
+            j = np.argmax(np.where(owned[rows], growth, -np.inf), axis=1)
+            holdings[rows, j] -= np.minimum(storage_cost[rows] / sell_price[rows, j], holdings[rows, j])
+    elif storage_metal == "all":
+        values = prices * holdings
+        total_value = values[:, 0]
+        for j in range(1, len(metals)):
+            total_value = total_value + values[:, j]
+        rows = np.flatnonzero(total_value > 0)
+        share = values[rows] / total_value[rows, np.newaxis]
+        holdings[rows] -= np.minimum((storage_cost[rows, np.newaxis] * share) / sell_price[rows], holdings[rows])
+    else:
+        j = metals.index(storage_metal)
+        rows = np.flatnonzero(holdings[:, j] > 0)
+        holdings[rows, j] -= np.minimum(storage_cost[rows] / sell_price[rows, j], holdings[rows, j])
+
+
+def simulate_linear_batch(model, plans):
+    """Stan końcowy wielu planów o wspólnym modelu liniowym (ten sam linear_model_key) - wektorowo.
+
+    Zwraca słownik jak simulate_batch(final_only=True) oraz "storage_cost" - suma naliczonych opłat magazynowych.
+    """
+    metals = model["metals"]
+    weights = np.array([[plan["allocation"][m] for m in metals] for plan in plans])
+    initial_allocation = np.array([float(plan["initial_allocation"]) for plan in plans])
+    purchase_amount = np.array([float(plan["purchase_amount"]) for plan in plans])
+    fee_factor = np.array([(plan["storage_fee"] / 100) * (1 + plan["vat"] / 100) for plan in plans])
+
+    units = model["units"]
+    step = purchase_amount[:, np.newaxis] * weights
+    holdings = (initial_allocation[:, np.newaxis] * weights) / model["initial_cost"]
+    storage_cost_total = np.zeros(len(plans))
+    previous = None
+    for k, r in enumerate(model["fee_rows"]):
+        holdings += step * (units[r] - (units[previous] if previous is not None else 0.0))
+        previous = r
+        storage_cost = (initial_allocation + purchase_amount * model["purchases"][r]) * fee_factor
+        storage_cost_total += storage_cost
+        _charge_storage_many(holdings, np.array(model["fee_prices"][k]), np.array(model["fee_buyback"]),
+                             storage_cost, model["storage_metal"], metals, model["fee_windows"][k])
+
+    last = len(units) - 1
+    if previous != last:
+        holdings += step * (units[last] - (units[previous] if previous is not None else 0.0))
+    values = model["sell_prices"][last] * holdings
+    portfolio_value = values[:, 0]
+    for j in range(1, len(metals)):
+        portfolio_value = portfolio_value + values[:, j]
+    return {
+        "date": model["dates"][[last] * len(plans)],
+        "invested": initial_allocation + purchase_amount * model["purchases"][last],
+        "holdings": holdings,
+        "value": portfolio_value,
+        "storage_cost": storage_cost_total,
+    }
+
+
+# ====== INFLACJA ======
+def apply_inflation(result, inflation):
+    """Dodaje kolumnę Portfolio Value Real (wartość zdyskontowana skumulowaną inflacją od roku startu)"""
+    inflation_dict = dict(zip(inflation["Rok"], inflation["Inflacja (%)"]))
+    years = result.index.year
+    start_year = years.min()
+    year_range = np.arange(start_year, years.max() + 1)
+    factors = np.cumprod([1 + inflation_dict.get(year, 0.0) / 100 for year in year_range])
+    cumulative_inflation = factors[years - start_year]
+    result["Portfolio Value Real"] = result["Portfolio Value"].to_numpy() / np.where(cumulative_inflation != 0, cumulative_inflation, 1.0)
+    return result
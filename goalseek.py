@@ -0,0 +1,166 @@
+# goalseek.py
+"""Szukanie parametru planu, przy którym wartość końcowa osiąga cel (nominalnie lub realnie).
+
+Parametry: purchase_amount, initial_allocation (najmniejsza kwota, przy której wartość końcowa osiąga cel)
+oraz end_purchase_date (najwcześniejszy koniec okresu z wartością co najmniej równą celowi).
+Wartość końcowa rośnie z kwotą; bez rebalancingu niemal liniowo (opłata pobierana jest z metalu
+zależnego od ilości), więc interpolacja z dwóch punktów trafia w cel co do grosza. Każdy przebieg liczy
+CANDIDATES kwot naraz - engine.simulate_linear_batch (plany bez rebalancingu) albo
+engine.simulate_batch(final_only=True) - a przedział z celem zawężany jest na zmianę siecznie i bisekcją.
+"""
+
+import numpy as np
+import pandas as pd
+
+import engine
+
+AMOUNT_PARAMS = ("purchase_amount", "initial_allocation")
+HORIZON_PARAM = "end_purchase_date"
+
+# Kwoty liczone razem w jednym przebiegu silnika (bisekcja zawęża przedział CANDIDATES + 1 razy)
+CANDIDATES = 8
+# Dokładność wyniku w walucie planu (najmniejsza wielokrotność osiągająca cel)
+AMOUNT_STEP = 0.01
+# Ile przebiegów poszerzających przedział (do x4^n), zanim cel uznany zostanie za nieosiągalny
+MAX_EXPANSIONS = 10
+
+
+class _Counter:
+    """Liczba wywołań silnika (do raportu) i wartości końcowe planów"""
+
+    def __init__(self, data, inflation, plan, real, model=None):
+        self.data = data
+        self.plan = plan
+        self.model = model
+        self.calls = 0
+        # Tabela do indeksacji wypłat w silniku, słownik rok -> inflacja do wartości realnej
+        self.inflation_table = inflation
+        self.inflation = dict(zip(inflation["Rok"], inflation["Inflacja (%)"])) if real else None
+        initial_pos = data.index.get_indexer([pd.to_datetime(plan["initial_date"])], method="nearest")[0]
+        self.start_year = data.index[initial_pos].year
+
+    def deflator(self, years):
+        """Skumulowana inflacja jak w engine.apply_inflation (od roku pierwszego zakupu)"""
+        if self.inflation is None:
+            return np.ones(len(years))
+        year_range = np.arange(self.start_year, max(years) + 1)
+        factors = np.cumprod([1 + self.inflation.get(year, 0.0) / 100 for year in year_range])
+        factors = factors[np.asarray(years) - self.start_year]
+        return np.where(factors != 0, factors, 1.0)
+
+    def values(self, param, amounts):
+        plans = [{**self.plan, param: float(amount)} for amount in amounts]
+        self.calls += 1
+        if self.model is not None:
+            summary = engine.simulate_linear_batch(self.model, plans)
+        else:
+            summary = engine.simulate_batch(self.data, plans, final_only=True, inflation=self.inflation_table)
+        return summary["value"] / self.deflator(summary["date"].year)
+
+
+def _cents(amounts, low, high):
+    """Kandydaci zaokrągleni do AMOUNT_STEP, bez powtórzeń, wewnątrz przedziału (low, high)"""
+    amounts = np.unique(np.round(np.asarray(amounts, dtype=float) / AMOUNT_STEP) * AMOUNT_STEP)
+    inside = amounts > low + AMOUNT_STEP / 2
+    if high is not None:
+        inside &= amounts < high - AMOUNT_STEP / 2
+    return amounts[inside]
+
+
+def _result(value, achieved, calls, method, reachable=True):
+    return {"value": value, "final_value": achieved, "calls": calls, "method": method, "reachable": reachable}
+
+
+def solve_amount(data, inflation, plan, param, target, real=False, model=None):
+    """Najmniejsza kwota param (purchase_amount lub initial_allocation), przy której wartość końcowa >= target.
+
+    model - gotowy engine.linear_model planu (plany bez rebalancingu); bez niego liczony jest tutaj.
+    Zwraca słownik: value (kwota z dokładnością AMOUNT_STEP), final_value (osiągnięta wartość),
+    calls (przebiegi silnika), method ("linear" - model liniowy / "batch" - simulate_batch), reachable.
+    """
+    if param not in AMOUNT_PARAMS:
+        raise ValueError(f"Nieznany parametr {param} (dostępne: {', '.join(AMOUNT_PARAMS)})")
+    if engine.linear_eligible(plan):
+        model = model if model is not None else engine.linear_model(data, plan)
+        counter, method = _Counter(data, inflation, plan, real, model), "linear"
+    else:
+        counter, method = _Counter(data, inflation, plan, real), "batch"
+
+    # Punkt zerowy i bieżąca kwota (lub 1000, gdy bieżąca jest zerowa) - jeden przebieg
+    probe = float(plan[param]) or 1000.0
+    zero_value, probe_value = counter.values(param, [0.0, probe])
+    if zero_value >= target:
+        return _result(0.0, zero_value, counter.calls, method)
+    low, low_value, previous = 0.0, zero_value, None
+    high, high_value = None, None
+    if probe_value >= target:
+        high, high_value = probe, probe_value
+    else:
+        previous, (low, low_value) = (low, low_value), (probe, probe_value)
+
+    # Przebiegi na zmianę: "sieczny" - CANDIDATES kwot co AMOUNT_STEP wokół punktu z interpolacji
+    # liniowej (plan bez rebalancingu jest prawie liniowy, więc zwykle zamyka przedział od razu)
+    # i bisekcyjny - przedział (low, high) dzielony równomiernie, a bez high poszerzany geometrycznie.
+    secant, expansions = True, 0
+    while high is None or high - low > AMOUNT_STEP * 1.5:
+        candidates = []
+        if secant and high is not None:
+            estimate = low + (target - low_value) * (high - low) / (high_value - low_value)
+            candidates = _cents(estimate + AMOUNT_STEP * (np.arange(CANDIDATES) - CANDIDATES // 2), low, high)
+        elif secant and low_value > previous[1]:
+            estimate = low + (target - low_value) * (low - previous[0]) / (low_value - previous[1])
+            candidates = _cents(estimate + AMOUNT_STEP * (np.arange(CANDIDATES) - CANDIDATES // 2), low, high)
+        elif high is not None:
+            candidates = _cents(np.linspace(low, high, CANDIDATES + 2)[1:-1], low, high)
+        elif not secant:
+            expansions += 1
+            if expansions > MAX_EXPANSIONS:
+                return _result(None, low_value, counter.calls, method, reachable=False)
+            candidates = _cents(max(low, probe) * np.geomspace(1.5, 4.0 ** expansions, CANDIDATES), low, high)
+        secant = not secant
+        if not len(candidates):
+            continue
+        values = counter.values(param, candidates)
+        reached = np.flatnonzero(values >= target)
+        if len(reached):
+            high, high_value = candidates[reached[0]], values[reached[0]]
+        below = np.flatnonzero(values < target)
+        if len(below) and candidates[below[-1]] > low:
+            previous, (low, low_value) = (low, low_value), (candidates[below[-1]], values[below[-1]])
+    return _result(round(float(high), 2), high_value, counter.calls, method)
+
+
+def solve_horizon(data, inflation, plan, target, real=False):
+    """Najwcześniejszy koniec okresu (end_purchase_date), przy którym wartość końcowa >= target.
+
+    Jeden przebieg do końca danych daje wartość każdego wiersza zdarzeń; plan kończący się w dniu
+    wiersza ma te same zdarzenia, więc wystarcza potwierdzić kandydata dokładną symulacją.
+    """
+    long_plan = {**plan, "end_purchase_date": data.index.max().date()}
+    counter = _Counter(data, inflation, long_plan, real)
+    counter.calls += 1
+    if engine.linear_eligible(long_plan):
+        result = engine.simulate_linear(engine.linear_model(data, long_plan), long_plan)
+    else:
+        result = engine.simulate_batch(data, [long_plan], inflation=inflation)[0]
+    values = result["Portfolio Value"].to_numpy() / counter.deflator(result.index.year)
+    dates = result.index
+
+    for k in np.flatnonzero(values >= target):
+        end = dates[k].date()
+        if end < pd.Timestamp(plan["initial_date"]).date():
+            continue
+        counter.plan = {**plan, HORIZON_PARAM: end}
+        counter.calls += 1
+        summary = engine.simulate_batch(data, [counter.plan], final_only=True, inflation=inflation)
+        achieved = summary["value"][0] / counter.deflator(summary["date"].year)[0]
+        if achieved >= target:
+            return _result(end, achieved, counter.calls, "history")
+    return _result(None, values.max() if len(values) else 0.0, counter.calls, "history", reachable=False)
+
+
+def goal_seek(data, inflation, plan, param, target, real=False, model=None):
+    """solve_amount lub solve_horizon zależnie od param (model - tylko dla kwot, zależy od końca okresu)"""
+    if param == HORIZON_PARAM:
+        return solve_horizon(data, inflation, plan, target, real)
+    return solve_amount(data, inflation, plan, param, target, real, model)
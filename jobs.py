@@ -0,0 +1,354 @@
+# jobs.py
+
+import os
+import threading
+import time
+import itertools
+import multiprocessing
+from collections import OrderedDict, Counter
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class JobCancelled(Exception):
+    """Zadanie zostało anulowane (ręcznie lub zastąpione nowszym)"""
+
+
+class Job:
+    """Zadanie liczone w tle: postęp 0..1 i flaga anulowania sprawdzana przy każdym raporcie"""
+
+    def __init__(self, key, label=""):
+        self.key = key
+        self.label = label
+        self.progress = 0.0
+        self.submitted = time.time()
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    def report(self, fraction):
+        """Wywoływane przez silnik - przerywa obliczenia, jeśli zadanie anulowano"""
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.key)
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def succeeded(self):
+        return self.done() and not self.future.cancelled() and self.future.exception() is None
+
+    def failed(self):
+        return self.done() and not self.future.cancelled() and self.future.exception() is not None
+
+    def result(self):
+        return self.future.result()
+
+
+class JobRunner:
+    """Wspólna dla procesu pula wątków do długich obliczeń"""
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sim-job")
+
+    def submit(self, key, fn, *args, label="", **kwargs):
+        """Uruchamia fn(*args, progress=job.report, **kwargs) w tle"""
+        job = Job(key, label)
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    @staticmethod
+    def _run(job, fn, args, kwargs):
+        job.report(0.0)
+        result = fn(*args, progress=job.report, **kwargs)
+        job.progress = 1.0
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def supersede(previous, key, runner, fn, *args, label="", **kwargs):
+    """Zwraca zadanie dla klucza - nieaktualne (inny klucz) anuluje i uruchamia nowe"""
+    if previous is not None and previous.key == key:
+        return previous
+    if previous is not None and not previous.done():
+        previous.cancel()
+    return runner.submit(key, fn, *args, label=label, **kwargs)
+
+
+# ====== HARMONOGRAM ZADAŃ (pula procesów, priorytety, limity sesji) ======
+# Klasy priorytetu - mniejsza liczba wychodzi z kolejki wcześniej
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Niższy priorytet procesów roboczych - ponowne uruchomienia skryptu Streamlit nie czekają na CPU
+WORKER_NICE = 5
+# Ile zadań (w kolejce i w toku) może mieć jedna sesja
+SESSION_QUOTA = 4
+# Ile zakończonych zadań zostaje do odczytu i deduplikacji
+KEEP_FINISHED = 32
+
+
+class QuotaExceeded(Exception):
+    """Sesja ma już maksymalną liczbę zadań w kolejce i w toku"""
+
+
+# Stan procesu roboczego: wspólne tablice postępu i flag anulowania (miejsce = numer slotu)
+_worker_slots = None
+
+
+def _init_worker(progress, cancelled, nice):
+    global _worker_slots
+    _worker_slots = (progress, cancelled)
+    try:
+        os.nice(nice)
+    except (AttributeError, OSError):
+        pass
+
+
+def _run_in_slot(slot, fn, args, kwargs):
+    progress, cancelled = _worker_slots
+
+    def report(fraction):
+        if cancelled[slot]:
+            raise JobCancelled(slot)
+        progress[slot] = min(max(float(fraction), 0.0), 1.0)
+
+    return fn(*args, progress=report, **kwargs)
+
+
+class ScheduledJob:
+    """Zadanie w harmonogramie - ten sam interfejs co Job (progress, done, result, cancel)"""
+
+    def __init__(self, scheduler, key, fn, args, kwargs, session, priority, label, seq):
+        self.key = key
+        self.label = label
+        self.session = session
+        self.priority = priority
+        self.owners = {session}
+        self.state = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.future = Future()
+        self.slot = None
+        self._scheduler = scheduler
+        self._call = (fn, args, kwargs)
+        self._seq = seq
+        self._final_progress = 0.0
+
+    @property
+    def progress(self):
+        if self.slot is not None:
+            return self._scheduler._progress[self.slot]
+        return self._final_progress
+
+    def cancel(self):
+        self._scheduler.cancel(self)
+
+    @property
+    def cancelled(self):
+        return self.state == "cancelled"
+
+    def done(self):
+        return self.future.done()
+
+    def succeeded(self):
+        return self.done() and not self.future.cancelled() and self.future.exception() is None
+
+    def failed(self):
+        return self.done() and not self.future.cancelled() and self.future.exception() is not None
+
+    def result(self):
+        return self.future.result()
+
+
+class Scheduler:
+    """Ograniczona pula procesów z kolejką priorytetową.
+
+    Zadania INTERACTIVE wychodzą z kolejki przed BATCH, a reserve_interactive slotów nigdy nie
+    zajmują zadania BATCH - krótkie analizy nie czekają za długimi. W obrębie klasy pierwszeństwo ma
+    sesja z najmniejszą liczbą zadań w toku (sprawiedliwy podział), potem kolejność zgłoszeń.
+    Identyczne zadania (ten sam klucz) są liczone raz, a sesja może mieć najwyżej quota zadań naraz.
+    """
+
+    def __init__(self, max_workers=None, reserve_interactive=1, quota=SESSION_QUOTA, keep_finished=KEEP_FINISHED):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.reserve_interactive = min(reserve_interactive, self.max_workers - 1)
+        self.quota = quota
+        self.keep_finished = keep_finished
+        self.stats = Counter()
+        self._lock = threading.RLock()
+        self._queue = []
+        self._running = {}
+        self._active = {}
+        self._finished = OrderedDict()
+        self._seq = itertools.count()
+        # Streamlit uruchamia skrypt jako __main__ - procesy spawn/forkserver wykonałyby w nim całą aplikację.
+        # fork (Linux, macOS) przejmuje też wczytane już ceny bez kopiowania (copy-on-write).
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        self._progress = self._context.Array("d", self.max_workers, lock=False)
+        self._cancelled = self._context.Array("b", self.max_workers, lock=False)
+        self._free_slots = list(range(self.max_workers))
+        self._pool = None
+
+    # --- zgłaszanie ---
+    def submit(self, key, fn, *args, session=None, priority=BATCH, label="", **kwargs):
+        """Zadanie dla klucza: istniejące (w kolejce, w toku lub niedawno zakończone) albo nowe.
+
+        fn musi być funkcją modułu (przekazywaną do procesu) przyjmującą progress=.
+        """
+        with self._lock:
+            self.stats["submitted"] += 1
+            job = self._active.get(key) or self._finished.get(key)
+            if job is not None:
+                self.stats["deduplicated"] += 1
+                job.owners.add(session)
+                if job.state == "queued" and priority < job.priority:
+                    job.priority = priority
+                self._dispatch()
+                return job
+            if session is not None and self.session_load(session) >= self.quota:
+                self.stats["rejected"] += 1
+                raise QuotaExceeded(session)
+            job = ScheduledJob(self, key, fn, args, kwargs, session, priority, label, next(self._seq))
+            self._active[key] = job
+            self._queue.append(job)
+            self._dispatch()
+            return job
+
+    def session_load(self, session):
+        with self._lock:
+            return sum(1 for job in self._active.values() if session in job.owners)
+
+    def cancel(self, job, session=None):
+        """Anuluje zadanie (z sesją - tylko jej udział; zadanie znika, gdy nie ma już właścicieli)"""
+        with self._lock:
+            if session is not None:
+                job.owners.discard(session)
+                if job.owners:
+                    return
+            if job.state == "queued":
+                self._queue.remove(job)
+                self._close(job, "cancelled")
+                job.future.cancel()
+            elif job.state == "running":
+                self._cancelled[job.slot] = 1
+                job.state = "cancelling"
+            self._dispatch()
+
+    # --- przydział slotów ---
+    def _next_job(self):
+        batch_running = sum(1 for job in self._running.values() if job.priority == BATCH)
+        running_per_session = Counter(job.session for job in self._running.values())
+        candidates = [job for job in self._queue
+                      if job.priority == INTERACTIVE or batch_running < self.max_workers - self.reserve_interactive]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda job: (job.priority, running_per_session[job.session], job._seq))
+
+    def _dispatch(self):
+        while self._free_slots and self._queue:
+            job = self._next_job()
+            if job is None:
+                return
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._context,
+                                                 initializer=_init_worker, initargs=(self._progress, self._cancelled, WORKER_NICE))
+            self._queue.remove(job)
+            job.slot = self._free_slots.pop(0)
+            self._progress[job.slot] = 0.0
+            self._cancelled[job.slot] = 0
+            job.state = "running"
+            job.started = time.time()
+            self._running[job.slot] = job
+            fn, args, kwargs = job._call
+            try:
+                pool_future = self._pool.submit(_run_in_slot, job.slot, fn, args, kwargs)
+            except BrokenProcessPool:
+                # Proces roboczy padł - nowa pula przy następnym zadaniu, to zadanie wraca na początek kolejki
+                self._pool = None
+                del self._running[job.slot]
+                self._free_slots.append(job.slot)
+                job.slot, job.state, job.started = None, "queued", None
+                self._queue.insert(0, job)
+                continue
+            pool_future.add_done_callback(lambda future, job=job: self._finish(job, future))
+
+    def _finish(self, job, pool_future):
+        with self._lock:
+            job._final_progress = self._progress[job.slot]
+            del self._running[job.slot]
+            self._free_slots.append(job.slot)
+            job.slot = None
+            error = pool_future.exception()
+            if isinstance(error, JobCancelled) or job.state == "cancelling":
+                self._close(job, "cancelled")
+                job.future.cancel()
+            elif error is not None:
+                if isinstance(error, BrokenProcessPool):
+                    self._pool = None
+                self._close(job, "failed")
+                job.future.set_exception(error)
+            else:
+                job._final_progress = 1.0
+                self._close(job, "done")
+                job.future.set_result(pool_future.result())
+                self._finished[job.key] = job
+                while len(self._finished) > self.keep_finished:
+                    self._finished.popitem(last=False)
+            self._dispatch()
+
+    def _close(self, job, state):
+        job.state = state
+        job.finished = time.time()
+        self.stats[state] += 1
+        if self._active.get(job.key) is job:
+            del self._active[job.key]
+
+    # --- odczyt stanu ---
+    def status(self, job):
+        """Stan do wyświetlenia: state, position (w kolejce), progress, czasy oczekiwania i obliczeń"""
+        with self._lock:
+            position = None
+            if job.state == "queued":
+                order = sorted(self._queue, key=lambda other: (other.priority, other._seq))
+                position = order.index(job) + 1
+            now = time.time()
+            return {
+                "state": job.state,
+                "priority": PRIORITY_NAMES[job.priority],
+                "position": position,
+                "progress": job.progress,
+                "waited": (job.started or now) - job.submitted,
+                "ran": ((job.finished or now) - job.started) if job.started else 0.0,
+            }
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "running": {PRIORITY_NAMES[p]: sum(1 for job in self._running.values() if job.priority == p) for p in PRIORITY_NAMES},
+                "queued": {PRIORITY_NAMES[p]: sum(1 for job in self._queue if job.priority == p) for p in PRIORITY_NAMES},
+                **self.stats,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            for job in list(self._queue):
+                self.cancel(job)
+            for slot in self._running:
+                self._cancelled[slot] = 1
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,226 @@
+# loadtest.py
+"""Test obciążeniowy: N równoległych sesji (AppTest, bez sieci) odtwarza scenariusze użytkownika.
+
+Sesje działają w wątkach jednego procesu i dzielą pamięć podręczną, jak sesje jednego serwera
+Streamlit. AppTest podmienia na czas przebiegu globalny Runtime, więc same przebiegi skryptu są
+szeregowane (RUN_LOCK) - zmierzone opóźnienie obejmuje oczekiwanie w kolejce, a symulacje w tle
+(jobs.JobRunner) liczą się równolegle z przebiegami innych sesji.
+
+Przykład:
+    python loadtest.py --sessions 8 --iterations 2
+    python loadtest.py --sessions 4 --cold --json wynik.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_FILE = os.path.join(APP_DIR, "rebalance_app.py")
+PRESET_DIR = os.path.join(APP_DIR, "presets")
+
+METALS = ["Gold", "Silver", "Platinum", "Palladium"]
+
+# Etykiety trybu opłat magazynowych w domyślnym języku (polskim)
+STORAGE_MODE_LABELS = {"yearly": "Rocznie", "monthly": "Miesięcznie"}
+
+# Scenariusz: lista kroków (akcja, parametr). Każdy krok to jedna lub więcej interakcji (reruns).
+SCRIPTS = {
+    "browse": [
+        ("load_preset", None),
+        ("shift_allocation", None),
+        ("storage_mode", "monthly"),
+        ("storage_mode", "yearly"),
+    ],
+    "presets": [
+        ("load_preset", None),
+        ("load_preset", None),
+    ],
+}
+
+# Odpytywanie zadania w tle (jak fragment show_job_progress)
+POLL_INTERVAL = 0.1
+RUN_TIMEOUT = 600
+
+RUN_LOCK = threading.Lock()
+
+
+def list_presets():
+    return sorted(f[:-5] for f in os.listdir(PRESET_DIR) if f.endswith(".json"))
+
+
+def rss_bytes():
+    """Bieżący RSS procesu (Linux: /proc, inaczej szczytowy z getrusage)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Session:
+    """Jedna symulowana sesja przeglądarki"""
+
+    def __init__(self, number, presets, seed):
+        self.number = number
+        self.presets = presets
+        self.random = random.Random(seed)
+        self.app = AppTest.from_file(APP_FILE, default_timeout=RUN_TIMEOUT)
+        self.reruns = []   # (akcja, sekundy) każdego pojedynczego przebiegu skryptu
+        self.steps = []    # (akcja, sekundy) do wyświetlenia wyniku aktualnego planu
+        self.errors = []
+
+    def run(self, action):
+        started = time.perf_counter()
+        with RUN_LOCK:
+            self.app.run()
+        self.reruns.append((action, time.perf_counter() - started))
+        if self.app.exception:
+            self.errors.append(f"{action}: {self.app.exception[0].message}")
+
+    def wait_for_job(self, action):
+        """Długie symulacje liczą się w tle - odpytuj jak przeglądarka, dopóki widać pasek postępu"""
+        while self.app.get("progress") and not self.app.exception:
+            time.sleep(POLL_INTERVAL)
+            self.run(action + ":poll")
+
+    def step(self, action, value):
+        started = time.perf_counter()
+        if action == "load_preset":
+            self.app.session_state["preset_to_load"] = self.random.choice(self.presets)
+            self.run(action)
+        elif action == "shift_allocation":
+            # Użytkownik przesuwa dwa suwaki: po pierwszym suma != 100 (komunikat błędu), po drugim znów 100
+            values = {m: self.app.slider(key=f"alloc_{m}").value for m in METALS}
+            source = max(values, key=values.get)
+            target = self.random.choice([m for m in METALS if m != source])
+            delta = self.random.randint(1, max(1, min(10, values[source])))
+            self.app.slider(key=f"alloc_{source}").set_value(values[source] - delta)
+            self.run(action)
+            self.app.slider(key=f"alloc_{target}").set_value(values[target] + delta)
+            self.run(action)
+        elif action == "storage_mode":
+            self.app.selectbox(key="storage_fee_mode").set_value(STORAGE_MODE_LABELS[value])
+            self.run(action)
+        else:
+            raise ValueError(f"Nieznana akcja: {action}")
+        self.wait_for_job(action)
+        self.steps.append((action, time.perf_counter() - started))
+
+    def play(self, script, iterations):
+        self.run("open")
+        for _ in range(iterations):
+            for action, value in script:
+                self.step(action, value)
+        return self
+
+
+def percentiles(values):
+    if not values:
+        return {"n": 0}
+    ms = np.array(values) * 1000
+    return {
+        "n": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 1),
+        "p95_ms": round(float(np.percentile(ms, 95)), 1),
+        "p99_ms": round(float(np.percentile(ms, 99)), 1),
+        "max_ms": round(float(ms.max()), 1),
+    }
+
+
+def load_test(sessions=4, iterations=1, script="browse", cold=False, seed=0):
+    os.chdir(APP_DIR)
+
+    # Rozgrzewka: importy i dane rynkowe, żeby nie liczyć ich do pamięci sesji
+    AppTest.from_file(APP_FILE, default_timeout=RUN_TIMEOUT).run()
+    if cold:
+        import streamlit as st
+        st.cache_data.clear()
+
+    presets = list_presets()
+    rss_before = rss_bytes()
+
+    # Sesje tworzone wcześniej, start wszystkich naraz
+    players = [Session(i, presets, seed + i) for i in range(sessions)]
+    barrier = threading.Barrier(sessions)
+
+    def play(player):
+        barrier.wait()
+        return player.play(SCRIPTS[script], iterations)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        finished = list(pool.map(play, players))
+    wall = time.perf_counter() - started
+    rss_after = rss_bytes()  # sesje (AppTest + session_state) nadal żyją
+
+    reruns = [seconds for p in finished for _, seconds in p.reruns]
+    steps = [seconds for p in finished for _, seconds in p.steps]
+    by_action = {}
+    for p in finished:
+        for action, seconds in p.steps:
+            by_action.setdefault(action, []).append(seconds)
+
+    return {
+        "sessions": sessions,
+        "iterations": iterations,
+        "script": script,
+        "cold": cold,
+        "wall_s": round(wall, 2),
+        "rerun_latency": percentiles(reruns),
+        "step_latency": percentiles(steps),
+        "step_latency_by_action": {action: percentiles(values) for action, values in by_action.items()},
+        "throughput_reruns_per_s": round(len(reruns) / wall, 2) if wall > 0 else 0.0,
+        "throughput_steps_per_s": round(len(steps) / wall, 2) if wall > 0 else 0.0,
+        "memory_per_session_kib": round((rss_after - rss_before) / sessions / 1024),
+        "errors": [e for p in finished for e in p.errors],
+    }
+
+
+def print_report(report):
+    print(f"Sesje: {report['sessions']}  scenariusz: {report['script']} x{report['iterations']}"
+          f"  {'zimny cache' if report['cold'] else 'ciepły cache'}  czas: {report['wall_s']} s")
+    print(f"{'':<28}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [("rerun", report["rerun_latency"]), ("krok (do wyniku)", report["step_latency"])]
+    rows += [(f"  {action}", stats) for action, stats in report["step_latency_by_action"].items()]
+    for label, stats in rows:
+        if stats["n"]:
+            print(f"{label:<28}{stats['n']:>6}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    print(f"Przepustowość: {report['throughput_reruns_per_s']} rerun/s, {report['throughput_steps_per_s']} kroków/s")
+    print(f"Pamięć na sesję (RSS): ~{report['memory_per_session_kib']} KiB")
+    for error in report["errors"]:
+        print(f"BŁĄD: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test obciążeniowy aplikacji (równoległe sesje AppTest)")
+    parser.add_argument("--sessions", type=int, default=4, help="liczba równoległych sesji")
+    parser.add_argument("--iterations", type=int, default=1, help="powtórzenia scenariusza w każdej sesji")
+    parser.add_argument("--script", choices=sorted(SCRIPTS), default="browse")
+    parser.add_argument("--cold", action="store_true", help="wyczyść st.cache_data przed startem")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="zapisz raport do pliku JSON")
+    args = parser.parse_args(argv)
+
+    report = load_test(args.sessions, args.iterations, args.script, args.cold, args.seed)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
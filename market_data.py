@@ -0,0 +1,289 @@
+# market_data.py
+
+import os
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+
+METALS = ["Gold", "Silver", "Platinum", "Palladium"]
+
+# Stała konwersji uncji trojańskiej na gramy (ilości w silniku są w uncjach)
+TROY_OUNCE_TO_GRAM = 31.1034768
+
+# Waluta, w której zapisane są ceny w lbma_data.csv
+BASE_CURRENCY = "EUR"
+
+PRICE_FILE = "lbma_data.csv"
+FX_FILE = "kursy_walut.csv"
+INFLATION_FILE = "inflacja.csv"
+
+# Opcjonalne fixingi w ciągu dnia (EUR), format długi: Date, Metal, Fix, Price
+FIXINGS_FILE = "lbma_fixings.csv"
+
+# Wiersze pliku fixingów wczytywane naraz (plik nie jest wczytywany w całości)
+FIXING_CHUNK_ROWS = 100_000
+
+# Cena wykonania planu (plan["execution_fix"]): cena dzienna z PRICE_FILE albo z fixingów dnia -
+# AM, PM, średnia ze wszystkich fixów lub najgorszy dla klienta fix: najwyższy przy zakupie, najniższy
+# przy sprzedaży (rebalancing, opłaty magazynowe, wypłaty) i wycenie portfela
+DAILY_FIX = "daily"
+FIX_POLICIES = ("AM", "PM", "average", "worst")
+
+# Polityki z osobną macierzą cen sprzedaży i wyceny (klucz tej macierzy w load_fixings); w cenach
+# planu (plan_prices) są to kolumny <Metal>_<WALUTA>_sell obok cen zakupu
+SELL_FIXES = {"worst": "worst_sell"}
+SELL_SUFFIX = "_sell"
+
+# Pliki CPI (format GUS, jak inflacja.csv) dla poszczególnych walut.
+# Brak pliku dla danej waluty -> inflacja.csv, czyli CPI waluty INFLATION_FILE_CURRENCY (cpi_currency).
+INFLATION_FILE_CURRENCY = "PLN"
+INFLATION_FILES = {
+    "PLN": "inflacja.csv",
+    "EUR": "inflacja_EUR.csv",
+    "USD": "inflacja_USD.csv",
+}
+
+
+def price_columns(currency):
+    """Nazwy kolumn cenowych dla danej waluty, np. Gold_PLN"""
+    return [f"{metal}_{currency}" for metal in METALS]
+
+
+def sell_price_columns(currency):
+    """Nazwy kolumn cen sprzedaży i wyceny (tylko polityki z SELL_FIXES), np. Gold_PLN_sell"""
+    return [f"{metal}_{currency}{SELL_SUFFIX}" for metal in METALS]
+
+
+def data_version(paths=None):
+    """Wersja danych - skrót z nazw, rozmiarów i czasów modyfikacji plików źródłowych"""
+    if paths is None:
+        paths = [PRICE_FILE, FX_FILE, FIXINGS_FILE] + sorted(set(INFLATION_FILES.values()))
+    digest = hashlib.sha1()
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        else:
+            digest.update(f"{path}:-;".encode())
+    return digest.hexdigest()[:12]
+
+
+# ====== CENY METALI ======
+def load_price_data(path=PRICE_FILE):
+    df = pd.read_csv(path, parse_dates=True, index_col=0)
+    df = df.sort_index()
+    df = df.dropna()
+    return df
+
+
+# ====== FIXINGI ======
+def _fix_session(fixes):
+    """Pora fixu: True - rano (AM lub godzina przed 12:00), False - po południu (PM lub od 12:00), NaN - inna etykieta"""
+    labels = fixes.astype(str).str.strip().str.upper()
+    hours = pd.to_numeric(labels.str.extract(r"^(\d{1,2}):\d{2}")[0], errors="coerce")
+    return (labels == "AM") | (hours < 12), (labels == "PM") | (hours >= 12)
+
+
+def load_fixings(index, path=FIXINGS_FILE, chunk_rows=FIXING_CHUNK_ROWS):
+    """Macierze cen EUR (T x 4, kalendarz index) dla polityk FIX_POLICIES i macierzy sprzedaży SELL_FIXES z pliku fixingów.
+
+    Plik czytany jest paczkami po chunk_rows wierszy - w pamięci są tylko akumulatory na dzień i metal.
+    Dni spoza kalendarza, nieznane metale i ceny niedodatnie są pomijane. Brak fixu danej pory w dniu
+    oznacza średnią z fixów dnia; dzień bez fixów danego metalu ma NaN (używana jest cena dzienna).
+    """
+    shape = (len(index), len(METALS))
+    morning, afternoon = np.full(shape, np.nan), np.full(shape, np.nan)
+    total, count, high, low = np.zeros(shape), np.zeros(shape), np.full(shape, -np.inf), np.full(shape, np.inf)
+    metal_codes = {metal: i for i, metal in enumerate(METALS)}
+
+    for chunk in pd.read_csv(path, usecols=["Date", "Metal", "Fix", "Price"], dtype={"Metal": str, "Fix": str},
+                             chunksize=chunk_rows):
+        rows = index.get_indexer(pd.to_datetime(chunk["Date"]))
+        columns = chunk["Metal"].str.strip().map(metal_codes).to_numpy(dtype=float)
+        prices = pd.to_numeric(chunk["Price"], errors="coerce").to_numpy(dtype=float)
+        valid = (rows >= 0) & ~np.isnan(columns) & (prices > 0)
+        is_am, is_pm = (mask.to_numpy(dtype=bool)[valid] for mask in _fix_session(chunk["Fix"]))
+        rows, columns, prices = rows[valid], columns[valid].astype(int), prices[valid]
+        np.add.at(total, (rows, columns), prices)
+        np.add.at(count, (rows, columns), 1)
+        np.maximum.at(high, (rows, columns), prices)
+        np.minimum.at(low, (rows, columns), prices)
+        morning[rows[is_am], columns[is_am]] = prices[is_am]
+        afternoon[rows[is_pm], columns[is_pm]] = prices[is_pm]
+
+    average = np.full(shape, np.nan)
+    np.divide(total, count, out=average, where=count > 0)
+    return {
+        "AM": np.where(np.isnan(morning), average, morning),
+        "PM": np.where(np.isnan(afternoon), average, afternoon),
+        "average": average,
+        "worst": np.where(count > 0, high, np.nan),
+        "worst_sell": np.where(count > 0, low, np.nan),
+    }
+
+
+# ====== KURSY WALUT ======
+def load_fx_data(path=FX_FILE):
+    """Kursy walut: kolumna Date + kolumny z kodami walut (ile jednostek waluty za 1 EUR)"""
+    if not os.path.exists(path):
+        return pd.DataFrame(dtype=float)
+    df = pd.read_csv(path, parse_dates=True, index_col=0)
+    df = df.sort_index()
+    df.columns = [c.strip().upper() for c in df.columns]
+    return df.drop(columns=[BASE_CURRENCY], errors="ignore").astype(float)
+
+
+def available_currencies(fx):
+    return [BASE_CURRENCY] + [c for c in fx.columns if fx[c].notna().any()]
+
+
+def convert_price_array(prices, fx):
+    """Przelicza macierz cen EUR na wszystkie waluty jednym zwektoryzowanym przebiegiem.
+
+    Zwraca (lista walut, tablica (C, T, 4)). Kurs z dni bez notowania FX uzupełniany
+    jest ostatnim znanym (a na początku pierwszym).
+    """
+    base = prices[price_columns(BASE_CURRENCY)].to_numpy(dtype=float)
+    currencies = available_currencies(fx)
+
+    # Macierz kursów (T, C) dopasowana do kalendarza cen metali
+    rates = np.ones((len(prices.index), len(currencies)))
+    if len(currencies) > 1:
+        aligned = fx[currencies[1:]].reindex(fx.index.union(prices.index)).ffill().bfill()
+        rates[:, 1:] = aligned.reindex(prices.index).to_numpy(dtype=float)
+
+    # (C, T, 4) = (1, T, 4) * (C, T, 1)
+    return currencies, base[np.newaxis, :, :] * rates.T[:, :, np.newaxis]
+
+
+def convert_price_matrices(prices, fx):
+    """Słownik waluta -> DataFrame z kolumnami <Metal>_<WALUTA>"""
+    currencies, converted = convert_price_array(prices, fx)
+    return {
+        currency: pd.DataFrame(converted[i], index=prices.index, columns=price_columns(currency))
+        for i, currency in enumerate(currencies)
+    }
+
+
+# ====== INFLACJA ======
+def _inflation_path(currency):
+    path = INFLATION_FILES.get(currency, INFLATION_FILE)
+    return path if os.path.exists(path) else INFLATION_FILE
+
+
+def cpi_currency(currency):
+    """Waluta, której CPI faktycznie opisuje load_inflation_data(currency) (różna od currency przy braku pliku)"""
+    return currency if _inflation_path(currency) != INFLATION_FILE else INFLATION_FILE_CURRENCY
+
+
+def load_inflation_data(currency="PLN"):
+    path = _inflation_path(currency)
+    df = pd.read_csv(path, sep=";", encoding="cp1250")
+    df["Wartosc"] = df["Wartosc"].astype(str).str.replace(",", ".").astype(float)
+    df["Inflacja (%)"] = df["Wartosc"] - 100
+    return df[["Rok", "Inflacja (%)"]]
+
+
+# ====== DANE WSPÓŁDZIELONE PRZEZ PROCES ======
+def _readonly(array):
+    array = np.ascontiguousarray(array)
+    array.setflags(write=False)
+    return array
+
+
+class MarketData:
+    """Ceny (wszystkie waluty) i inflacja trzymane raz na proces w tablicach tylko do odczytu.
+
+    prices()/inflation() zwracają nowe, lekkie DataFrame'y będące widokami na te same
+    tablice - bez kopiowania danych. Próba zmiany wartości w miejscu kończy się
+    ValueError zamiast cichego uszkodzenia wyników innych sesji.
+    """
+
+    def __init__(self, version, prices, fx, fixings=None):
+        self.version = version
+        self.index = prices.index
+        self.currencies, values = convert_price_array(prices, fx)
+        self._values = _readonly(values)
+        # Macierze cen wykonania (waluty x dni x metale) liczone raz - wybór polityki nie kosztuje nic w silniku
+        self.fixes = [DAILY_FIX]
+        self._fix_values = {DAILY_FIX: self._values}
+        base = prices[price_columns(BASE_CURRENCY)].to_numpy(dtype=float)
+        for policy, fixed in (fixings or {}).items():
+            filled = pd.DataFrame(np.where(np.isnan(fixed), base, fixed), index=prices.index, columns=price_columns(BASE_CURRENCY))
+            self._fix_values[policy] = _readonly(convert_price_array(filled, fx)[1])
+            if policy in FIX_POLICIES:
+                self.fixes.append(policy)
+        # Polityki z osobną ceną sprzedaży (SELL_FIXES): kolumny zakupu i sprzedaży w jednej tablicy
+        # (waluty x dni x 2*metale) - prices() zwraca jej widok, price_array/sell_price_array widoki połówek
+        self._paired = {}
+        for policy, sell in SELL_FIXES.items():
+            if policy in self._fix_values and sell in self._fix_values:
+                paired = _readonly(np.concatenate([self._fix_values[policy], self._fix_values[sell]], axis=2))
+                self._paired[policy] = paired
+                self._fix_values[policy], self._fix_values[sell] = paired[..., :len(METALS)], paired[..., len(METALS):]
+        self._inflation = {}
+        self._cpi_currency = {currency: cpi_currency(currency) for currency in self.currencies}
+        for currency in self.currencies:
+            df = load_inflation_data(currency)
+            self._inflation[currency] = (_readonly(df["Rok"].to_numpy()), _readonly(df["Inflacja (%)"].to_numpy(dtype=float)))
+
+    @classmethod
+    def load(cls, version=None):
+        prices = load_price_data()
+        fixings = load_fixings(prices.index) if os.path.exists(FIXINGS_FILE) else None
+        return cls(version or data_version(), prices, load_fx_data(), fixings)
+
+    def price_array(self, currency=BASE_CURRENCY, fix=DAILY_FIX):
+        """Tablica (T, 4) cen zakupu tylko do odczytu"""
+        if fix not in self.fixes:
+            raise ValueError(f"Brak cen dla fixu {fix} (dostępne: {', '.join(self.fixes)})")
+        return self._fix_values[fix][self.currencies.index(currency)]
+
+    def sell_price_array(self, currency=BASE_CURRENCY, fix=DAILY_FIX):
+        """Tablica (T, 4) cen sprzedaży i wyceny - dla polityk bez SELL_FIXES ta sama co price_array"""
+        if fix not in SELL_FIXES:
+            return self.price_array(currency, fix)
+        return self._fix_values[SELL_FIXES[fix]][self.currencies.index(currency)]
+
+    def prices(self, currency=BASE_CURRENCY, fix=DAILY_FIX):
+        """Ceny zakupu (kolumny price_columns), dla polityk z SELL_FIXES także ceny sprzedaży (sell_price_columns)"""
+        if fix in SELL_FIXES:
+            if fix not in self.fixes:
+                raise ValueError(f"Brak cen dla fixu {fix} (dostępne: {', '.join(self.fixes)})")
+            return pd.DataFrame(self._paired[fix][self.currencies.index(currency)], index=self.index,
+                                columns=price_columns(currency) + sell_price_columns(currency), copy=False)
+        return pd.DataFrame(self.price_array(currency, fix), index=self.index, columns=price_columns(currency), copy=False)
+
+    def plan_prices(self, plan):
+        """Ceny w walucie planu po jego cenie wykonania (plan["execution_fix"])"""
+        return self.prices(plan["currency"], plan.get("execution_fix", DAILY_FIX))
+
+    def inflation(self, currency=BASE_CURRENCY):
+        years, values = self._inflation[currency]
+        return pd.DataFrame({"Rok": years, "Inflacja (%)": values}, copy=False)
+
+    def cpi_currency(self, currency=BASE_CURRENCY):
+        """Waluta CPI użytego w inflation(currency) - inna niż currency oznacza zastępczą inflację"""
+        return self._cpi_currency[currency]
+
+    @property
+    def nbytes(self):
+        paired = {name for policy in self._paired for name in (policy, SELL_FIXES[policy])}
+        return (sum(v.nbytes for name, v in self._fix_values.items() if name not in paired)
+                + sum(v.nbytes for v in self._paired.values()) + self.index.nbytes
+                + sum(y.nbytes + v.nbytes for y, v in self._inflation.values()))
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_market_data(version=None):
+    """Jedna instancja MarketData na proces i wersję danych (starsze wersje są zwalniane)"""
+    version = version or data_version()
+    with _shared_lock:
+        if version not in _shared:
+            _shared.clear()
+            _shared[version] = MarketData.load(version)
+        return _shared[version]
@@ -0,0 +1,197 @@
+# profiling.py
+
+import os
+import io
+import json
+import time
+import threading
+import cProfile
+import pstats
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+# Włączenie cProfile dla każdego przebiegu (lub parametr ?profile=1 w adresie)
+PROFILE_ENV = "REB_PROFILE"
+# Panel diagnostyczny widoczny zawsze (lub parametr ?diagnostics=1)
+DIAGNOSTICS_ENV = "REB_DIAGNOSTICS"
+# Plik logu JSONL (jedna linia na przebieg)
+LOG_ENV = "REB_PROFILE_LOG"
+LOG_FILE = "diagnostics.jsonl"
+# Po przekroczeniu rozmiaru log jest przenoszony do <plik>.1
+LOG_MAX_BYTES = 5 * 1024 * 1024
+# Liczba funkcji z profilu zapisywana w logu i panelu
+PROFILE_TOP = 25
+
+_current = ContextVar("profiling_recorder", default=None)
+_log_lock = threading.Lock()
+
+
+def _flag(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def profiling_requested(query_params=None):
+    """cProfile włączony zmienną środowiskową REB_PROFILE lub parametrem ?profile=1"""
+    return _flag(os.environ.get(PROFILE_ENV, "")) or _flag((query_params or {}).get("profile", ""))
+
+
+def diagnostics_requested(query_params=None):
+    """Ukryty panel diagnostyczny: REB_DIAGNOSTICS, ?diagnostics=1 albo włączone profilowanie"""
+    return (_flag(os.environ.get(DIAGNOSTICS_ENV, "")) or _flag((query_params or {}).get("diagnostics", ""))
+            or profiling_requested(query_params))
+
+
+class Recorder:
+    """Czasy etapów i liczniki wywołań jednego przebiegu (opcjonalnie z cProfile)"""
+
+    def __init__(self, name, profile=False, **fields):
+        self.name = name
+        self.fields = fields
+        self.stages = {}
+        self.counters = Counter()
+        self.profile = None
+        self.total = 0.0
+        self._profiler = cProfile.Profile() if profile else None
+        self._started = None
+        self._token = None
+
+    def start(self):
+        # Przebiegi nie są zagnieżdżane - przerwany wcześniej (np. przez st.stop) zostaje zamknięty
+        previous = _current.get()
+        if previous is not None and previous is not self:
+            previous.stop()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        if self._profiler is not None:
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Inny profiler aktywny w tym procesie - przebieg bez cProfile
+                self._profiler = None
+        return self
+
+    def stop(self):
+        if self._started is None:
+            return self
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.profile = profile_summary(self._profiler)
+            self._profiler = None
+        self.total = time.perf_counter() - self._started
+        self._started = None
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Zatrzymanie w innym kontekście niż start (np. po st.stop) - tylko czyścimy
+            _current.set(None)
+        return self
+
+    def record(self, stage, seconds):
+        total, calls = self.stages.get(stage, (0.0, 0))
+        self.stages[stage] = (total + seconds, calls + 1)
+
+    def as_dict(self):
+        return {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "run": self.name,
+            "total_ms": round(self.total * 1000, 3),
+            "stages": {stage: {"ms": round(total * 1000, 3), "calls": calls} for stage, (total, calls) in self.stages.items()},
+            "counters": dict(self.counters),
+            **self.fields,
+            **({"profile": self.profile} if self.profile is not None else {}),
+        }
+
+
+def current():
+    return _current.get()
+
+
+# ====== API DLA KODU INSTRUMENTOWANEGO ======
+# Bez aktywnego Recordera wszystkie funkcje są praktycznie darmowe (jedno ContextVar.get)
+def record(stage, seconds):
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.record(stage, seconds)
+
+
+def count(name, n=1):
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.counters[name] += n
+
+
+@contextmanager
+def stage(name):
+    """Mierzy czas bloku i dopisuje go do etapu name bieżącego przebiegu"""
+    if _current.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+@contextmanager
+def recording(name, profile=False, log=True, **fields):
+    """Osobny przebieg (np. zadanie w tle) z własnym Recorderem zapisywanym do logu"""
+    recorder = Recorder(name, profile=profile, **fields).start()
+    try:
+        yield recorder
+    finally:
+        recorder.stop()
+        if log:
+            write_log(recorder)
+
+
+# ====== PROFIL I LOG ======
+def profile_summary(profiler, limit=PROFILE_TOP):
+    """Najdroższe funkcje (czas skumulowany) jako lista słowników"""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({function})",
+            "calls": calls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumtime_ms"], reverse=True)
+    return rows[:limit]
+
+
+def log_path():
+    return os.environ.get(LOG_ENV, LOG_FILE)
+
+
+def write_log(recorder, path=None):
+    """Dopisuje przebieg jako linię JSON; błędy zapisu nie przerywają aplikacji"""
+    path = path or log_path()
+    line = json.dumps(recorder.as_dict(), default=str, ensure_ascii=False)
+    with _log_lock:
+        try:
+            if os.path.exists(path) and os.path.getsize(path) > LOG_MAX_BYTES:
+                os.replace(path, path + ".1")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError:
+            pass
+
+
+def read_log(path=None, limit=50):
+    """Ostatnie wpisy logu (najnowsze na końcu)"""
+    path = path or log_path()
+    if not os.path.exists(path):
+        return []
+    with _log_lock, open(path, encoding="utf-8") as f:
+        lines = f.readlines()[-limit:]
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
@@ -5,55 +5,100 @@ import pandas as pd
 import numpy as np
 import os
 import json
-from datetime import datetime, timedelta
-
-# Stała konwersji uncji trojańskiej na gramy
-TROY_OUNCE_TO_GRAM = 31.1034768
+import uuid
+from datetime import datetime
+
+import market_data
+import engine
+import jobs
+import analytics
+import attribution
+import comparison
+import goalseek
+import decumulation
+import strategies
+import reducers
+import taxlots
+import profiling
+import warmer
+import altair as alt
+from market_data import TROY_OUNCE_TO_GRAM
 
 # Konfiguracja strony
 st.set_page_config(page_title="Symulator Metali Szlachetnych", layout="wide")
 
-# ====== FUNKCJE ŁADOWANIA DANYCH ======
-@st.cache_data
-def load_data():
-    df = pd.read_csv("lbma_data.csv", parse_dates=True, index_col=0)
-    df = df.sort_index()
-    df = df.dropna()
-    return df
-
-@st.cache_data
-def load_inflation_data():
-    df = pd.read_csv("inflacja.csv", sep=";", encoding="cp1250")
-    df["Wartosc"] = df["Wartosc"].str.replace(",", ".").astype(float)
-    df["Inflacja (%)"] = df["Wartosc"] - 100
-    return df[["Rok", "Inflacja (%)"]]
-
-data = load_data()
-inflation_real = load_inflation_data()
-
-# ====== NOWE FUNKCJE DLA KOSZTÓW MAGAZYNOWYCH ======
-def get_last_business_day_of_month(date):
-    """Znajduje ostatni dzień roboczy danego miesiąca"""
-    # Znajdź ostatni dzień miesiąca
-    next_month = date.replace(day=28) + pd.DateOffset(days=4)
-    last_day = next_month - pd.DateOffset(days=next_month.day)
-    
-    # Cofnij się do ostatniego dnia roboczego (pomiń weekendy)
-    while last_day.weekday() >= 5:  # 5=sobota, 6=niedziela
-        last_day -= pd.DateOffset(days=1)
-    
-    return last_day
+# Pomiar pełnego przebiegu skryptu (czasy etapów, liczniki, opcjonalnie cProfile)
+run_recorder = profiling.Recorder("rerun", profile=profiling.profiling_requested(st.query_params)).start()
 
-def get_last_business_day_of_year(year):
-    """Znajduje ostatni dzień roboczy danego roku"""
-    # Ostatni dzień roku
-    last_day = pd.Timestamp(year, 12, 31)
-    
-    # Cofnij się do ostatniego dnia roboczego
-    while last_day.weekday() >= 5:
-        last_day -= pd.DateOffset(days=1)
-    
-    return last_day
+# ====== FUNKCJE ŁADOWANIA DANYCH ======
+@st.cache_resource(max_entries=1)
+def load_market_data(data_version):
+    """Ceny i inflacja wspólne dla wszystkich sesji (tablice tylko do odczytu, bez kopii per sesja)"""
+    return market_data.shared_market_data(data_version)
+
+@st.cache_data(max_entries=64)
+def run_simulation(plan, data_version, _progress=None):
+    """Symulacja w walucie planu wraz z korektą o inflację tej waluty"""
+    market = load_market_data(data_version)
+    inflation = market.inflation(plan["currency"])
+    with profiling.stage("simulate"):
+        result = engine.simulate(market.plan_prices(plan), plan, progress=_progress, inflation=inflation)
+    with profiling.stage("inflation"):
+        return engine.apply_inflation(result, inflation)
+
+# Plany bez rebalancingu: model liniowy liczony raz, zmiana wag i kwot to tylko suma ważona wektorów
+@st.cache_resource(max_entries=16)
+def get_linear_model(model_key, data_version, _plan):
+    market = load_market_data(data_version)
+    return engine.linear_model(market.plan_prices(_plan), _plan)
+
+def run_linear_simulation(plan, data_version):
+    model = get_linear_model(engine.linear_model_key(plan), data_version, plan)
+    market = load_market_data(data_version)
+    with profiling.stage("simulate_linear"):
+        result = engine.simulate_linear(model, plan)
+    with profiling.stage("inflation"):
+        return engine.apply_inflation(result, market.inflation(plan["currency"]))
+
+# Przybliżony wynik (siatka końców miesięcy) pokazywany do czasu zakończenia dokładnej symulacji w tle
+@st.cache_data(max_entries=64)
+def run_preview(plan, data_version):
+    market = load_market_data(data_version)
+    with profiling.stage("simulate_preview"):
+        result = engine.simulate_preview(market.plan_prices(plan), plan)
+    return engine.apply_inflation(result, market.inflation(plan["currency"]))
+
+# ====== OBLICZENIA W TLE ======
+# Koszt symulacji (dni, patrz engine.estimate_run_cost), powyżej którego liczymy w tle
+HEAVY_RUN_COST = 8000
+
+@st.cache_resource
+def get_job_runner():
+    return jobs.JobRunner(max_workers=2)
+
+def simulation_job(plan, data_version, progress=None):
+    with profiling.recording("background_job", profile=profiling.profiling_requested(), currency=plan["currency"]):
+        return run_simulation(plan, data_version, _progress=progress)
+
+def plan_key(plan, data_version):
+    return json.dumps(plan, sort_keys=True, default=str) + "@" + data_version
+
+# Rozgrzewanie pamięci podręcznej presetami (start procesu i każda nowa wersja danych)
+@st.cache_resource
+def get_cache_warmer():
+    def warm(plan, version, progress):
+        run_simulation(plan, version, _progress=progress)
+        run_fee_attribution(plan, version)
+    return warmer.CacheWarmer(warm, folder="presets").start()
+
+with profiling.stage("load_data"):
+    data_version = market_data.data_version()
+    market = load_market_data(data_version)
+    data = market.prices()
+currencies = market.currencies
+
+if warmer.warmer_enabled():
+    get_cache_warmer().notify(data_version)
 
 # ====== PRESETY - KONFIGURACJA ======
 PRESET_FOLDER = "presets"
@@ -107,6 +152,9 @@ if "preset_to_load" in st.session_state:
         st.session_state["initial_allocation"] = preset.get("initial_allocation", 100000.0)
         st.session_state["initial_date"] = pd.to_datetime(preset.get("initial_date")).date()
         st.session_state["end_purchase_date"] = pd.to_datetime(preset.get("end_purchase_date")).date()
+        if "currency" in preset:
+            st.session_state["currency"] = preset["currency"]
+        st.session_state["execution_fix"] = preset.get("execution_fix", market_data.DAILY_FIX)
         
         # Alokacja
         st.session_state["alloc_Gold"] = preset["allocation"]["Gold"]
@@ -118,6 +166,10 @@ if "preset_to_load" in st.session_state:
         st.session_state["purchase_freq"] = preset["purchase"]["frequency"]
         st.session_state["purchase_day"] = preset["purchase"]["day"]
         st.session_state["purchase_amount"] = preset["purchase"]["amount"]
+        strategy = preset["purchase"].get("strategy", "fixed")
+        st.session_state["purchase_strategy"] = strategy if strategy in strategies.STRATEGIES else "fixed"
+        for key, value in preset["purchase"].get("strategy_params", {}).items():
+            st.session_state[f"strategy_{key}"] = value
         
         # ReBalancing - poprawna konwersja dat
         for k, v in preset["rebalance"].items():
@@ -142,9 +194,29 @@ if "preset_to_load" in st.session_state:
         # ReBalance markup
         for metal, value in preset["rebalance_markup"].items():
             st.session_state[f"rebalance_markup_{metal}"] = value
+
+        # Wypłaty (preset bez tej sekcji - plan bez wypłat)
+        withdrawal = preset.get("withdrawal", {})
+        st.session_state["withdrawal_mode"] = engine.normalize_withdrawal_mode(withdrawal.get("mode"))
+        if "amount" in withdrawal:
+            amount_key = "withdrawal_percent" if st.session_state["withdrawal_mode"] == "percent" else "withdrawal_amount"
+            st.session_state[amount_key] = float(withdrawal["amount"])
+        for key in ("indexation", "day"):
+            if key in withdrawal:
+                st.session_state[f"withdrawal_{key}"] = withdrawal[key]
+        if "frequency" in withdrawal:
+            frequency = engine.normalize_frequency(withdrawal["frequency"])
+            st.session_state["withdrawal_freq"] = frequency if frequency in ("month", "quarter") else "month"
+        for key in ("start", "end"):
+            if key in withdrawal:
+                st.session_state[f"withdrawal_{key}"] = pd.to_datetime(withdrawal[key]).date()
     
     del st.session_state["preset_to_load"]
 
+# Wartości widżetów z sekcji analiz (przyciski "Zastosuj") - ustawiane przed utworzeniem widżetów
+for key, value in st.session_state.pop("widgets_to_apply", {}).items():
+    st.session_state[key] = value
+
 # ====== JĘZYK ======
 if "language" not in st.session_state:
     st.session_state.language = "Polski"
@@ -161,6 +233,7 @@ translations = {
     "Polski": {
         "portfolio_value": "Wartość portfela",
         "real_portfolio_value": "Wartość portfela (realna, po inflacji)",
+        "real_value_cpi_fallback": "⚠️ Brak danych inflacji dla {0} - wartość realna i indeksacja wypłat liczone według inflacji {1}",
         "invested": "Zainwestowane",
         "storage_cost": "Koszty magazynowania",
         "chart_subtitle": "📈 Rozwój wartości portfela: nominalna i realna",
@@ -174,7 +247,7 @@ translations = {
         "margins_fees": "📊 Marże i prowizje",
         "buyback_prices": "💵 Ceny odkupu metali",
         "rebalance_prices": "♻️ Ceny ReBalancingu metali",
-        "initial_allocation": "Kwota początkowej alokacji (EUR)",
+        "initial_allocation": "Kwota początkowej alokacji ({})",
         "first_purchase_date": "Data pierwszego zakupu",
         "last_purchase_date": "Data ostatniego zakupu",
         "purchase_frequency": "Periodyczność zakupów",
@@ -185,7 +258,7 @@ translations = {
         "purchase_day_of_week": "Dzień tygodnia zakupu",
         "purchase_day_of_month": "Dzień miesiąca zakupu (1–28)",
         "purchase_day_of_quarter": "Dzień kwartału zakupu (1–28)",
-        "purchase_amount": "Kwota dokupu (EUR)",
+        "purchase_amount": "Kwota dokupu ({})",
         "rebalance_1": "ReBalancing 1",
         "rebalance_2": "ReBalancing 2",
         "deviation_condition": "Warunek odchylenia wartości",
@@ -238,8 +311,8 @@ translations = {
         "avg_annual_growth": "📈 Średni roczny rozwój cen wszystkich metali razem (ważony alokacją)",
         "weighted_avg_growth": "🌐 Średni roczny wzrost cen (ważony alokacją)",
         "simplified_view": "📅 Mały uproszczony podgląd: Pierwszy dzień każdego roku",
-        "invested_eur": "Zainwestowane (EUR)",
-        "portfolio_value_eur": "Wartość portfela (EUR)",
+        "invested_eur": "Zainwestowane ({})",
+        "portfolio_value_eur": "Wartość portfela ({})",
         "gold_g": "Złoto (g)",
         "silver_g": "Srebro (g)",
         "platinum_g": "Platyna (g)",
@@ -248,11 +321,171 @@ translations = {
         "storage_costs_summary": "📦 Podsumowanie kosztów magazynowania",
         "avg_annual_storage_cost": "Średnioroczny koszt magazynowy",
         "storage_cost_percentage": "Koszt magazynowania (% ostatni rok)",
-        "vat": "VAT (%)"
+        "vat": "VAT (%)",
+        "currency": "Waluta",
+        "execution_fix": "Cena wykonania",
+        "execution_fix_daily": "cena dzienna",
+        "execution_fix_AM": "fixing AM",
+        "execution_fix_PM": "fixing PM",
+        "execution_fix_average": "średnia z fixingów",
+        "execution_fix_worst": "najgorszy fixing dnia (zakup po najwyższym, sprzedaż i wycena po najniższym)",
+        "background_running": "⏳ Obliczenia w tle: {:.0f}%",
+        "cancel_job": "⛔ Anuluj obliczenia",
+        "job_cancelled": "⛔ Obliczenia anulowane.",
+        "stale_result": "⏳ Wyświetlany jest ostatni ukończony wynik – nowy jest w trakcie obliczeń.",
+        "preview_result": "≈ Podgląd przybliżony (ceny z końców miesięcy) – dokładny wynik jest w trakcie obliczeń.",
+        "preview_error": "✓ Dokładny wynik zastąpił podgląd. Błąd podglądu: wartość końcowa {:+.2f}%, maks. {:.2f}% na wykresie.",
+        "risk_title": "📉 Ryzyko i wyniki",
+        "risk_view": "Widok",
+        "portfolio_view": "Portfel (stopy ważone czasem)",
+        "cagr": "Średnioroczna stopa zwrotu (CAGR)",
+        "max_drawdown": "Maksymalne obsunięcie",
+        "volatility": "Zmienność roczna",
+        "time_under_water": "Najdłużej pod kreską",
+        "days": "dni",
+        "sharpe": "Wskaźnik Sharpe'a",
+        "sortino": "Wskaźnik Sortino",
+        "rolling_returns": "Kroczące stopy zwrotu (annualizowane)",
+        "window": "Okno",
+        "median": "Mediana",
+        "negative_share": "Okresy ujemne",
+        "max_rolling_volatility": "Maks. zmienność w oknie",
+        "diagnostics": "🔧 Diagnostyka",
+        "diagnostics_total": "Pełny przebieg: {:.1f} ms · log: {}",
+        "stages": "Etapy",
+        "counters": "Liczniki wywołań",
+        "profile_top": "cProfile - najdroższe funkcje",
+        "recent_runs": "Ostatnie przebiegi",
+        "cache_warmer": "Rozgrzewanie pamięci podręcznej (presety)",
+        "cache_warmer_status": "Stan: {} · {}/{} · wersja danych: {} · w toku: {}",
+        "fee_attribution_title": "🧾 Na co poszedł zwrot - atrybucja kosztów",
+        "fee_attribution_caption": "Ubytek kosztu = wartość końcowa bez tego kosztu minus wartość rzeczywista (z efektem procentu składanego).",
+        "component": "Składnik",
+        "amount": "Kwota ({})",
+        "share_of_invested": "% zainwestowanego",
+        "price_return": "Zwrot z cen (bez kosztów)",
+        "drag_margins": "Marże dealera przy zakupie",
+        "drag_buyback": "Dyskonto ceny odkupu",
+        "drag_rebalance_markup": "Narzuty przy ReBalancingu",
+        "drag_storage": "Koszty magazynowania",
+        "drag_interaction": "Interakcja kosztów",
+        "final_value": "Wartość końcowa",
+        "comparison_title": "⚖️ Porównanie portfeli",
+        "comparison_select": "Porównaj z",
+        "comparison_hint": "Wybierz warianty lub presety - wszystkie portfele liczone są razem w jednym przebiegu, w zakresie dat i walucie bieżącego planu.",
+        "current_plan": "Bieżący plan",
+        "lump_sum": "Jednorazowo (cały kapitał na start)",
+        "no_rebalance": "Bez ReBalancingu",
+        "single_metal": "100% {}",
+        "portfolio": "Portfel",
+        "gain": "Zysk",
+        "diff_vs_plan": "Różnica vs plan",
+        "first_divergence": "Pierwsza rozbieżność",
+        "drawdown_chart": "Obsunięcie od szczytu",
+        "rolling_title": "🔁 Kroczące starty - rozkład wyników planu",
+        "rolling_years": "Horyzont (lata)",
+        "rolling_step": "Start co",
+        "rolling_step_MS": "miesiąc",
+        "rolling_step_QS": "kwartał",
+        "rolling_step_YS": "rok",
+        "rolling_hint": "{} scenariuszy (ten sam plan uruchamiany od kolejnych dat) - {}.",
+        "rolling_interactive": "liczone od ręki",
+        "rolling_batch": "duża analiza, liczona w wolnych procesach po krótkich zadaniach",
+        "rolling_start": "▶️ Uruchom analizę",
+        "job_queued": "⏳ W kolejce - pozycja {} (czeka {:.0f} s)",
+        "rolling_running": "Analiza kroczących startów... {:.0f}%",
+        "rolling_quota": "⚠️ Osiągnięto limit zadań w tle dla sesji ({}) - poczekaj na ich zakończenie lub anuluj.",
+        "rolling_failed": "❌ Analiza nie powiodła się: {}",
+        "rolling_none": "Brak pełnych okresów o tym horyzoncie w zakresie danych.",
+        "rolling_summary": "{} scenariuszy: średni zwrot roczny {:.2f}% (odch. std. {:.2f} pp), zakres {:.2f}% … {:.2f}%.",
+        "rolling_percentile": "Percentyl",
+        "rolling_annual": "Zwrot roczny",
+        "rolling_gain": "Zysk całkowity",
+        "rolling_best": "Najlepsze starty",
+        "rolling_worst": "Najgorsze starty",
+        "rolling_start_date": "Start",
+        "tax_title": "🧮 Podatki - partie zakupowe (FIFO)",
+        "tax_hint": "Każda sprzedaż (rebalancing, opłata magazynowa) rozliczana jest z najstarszymi partiami. Zysk z partii trzymanych ponad rok jest w Niemczech wolny od podatku (§ 23 EStG); w Polsce podatkiem objęty jest cały zysk zrealizowany.",
+        "tax_start": "▶️ Policz partie",
+        "tax_running": "Rozliczanie partii... {:.0f}%",
+        "tax_failed": "❌ Rozliczenie partii nie powiodło się: {}",
+        "tax_year": "Rok",
+        "tax_proceeds": "Przychód ze sprzedaży",
+        "tax_cost": "Koszt nabycia",
+        "tax_realized": "Zysk zrealizowany",
+        "tax_realized_taxfree": "Zrealizowany: partie > 1 rok",
+        "tax_realized_taxable": "Zrealizowany: partie ≤ 1 rok",
+        "tax_unrealized": "Zysk niezrealizowany (koniec roku)",
+        "tax_unrealized_taxfree": "Niezrealizowany: partie > 1 rok",
+        "tax_taxfree_share": "Udział partii > 1 rok",
+        "tax_sales_summary": "Sprzedaże łącznie: rebalancing {} (zysk {}), opłaty magazynowe {} (zysk {}).",
+        "goal_title": "🎯 Cel - ile potrzeba, by osiągnąć wartość portfela",
+        "goal_target": "Wartość docelowa ({})",
+        "goal_basis": "Wartość",
+        "goal_nominal": "nominalna",
+        "goal_real": "realna (po inflacji)",
+        "goal_param": "Szukany parametr",
+        "goal_purchase_amount": "Kwota dokupu",
+        "goal_initial_allocation": "Kwota początkowej alokacji",
+        "goal_end_purchase_date": "Data ostatniego zakupu",
+        "goal_hint": "Pozostałe parametry planu bez zmian; wynik dotyczy historycznych cen z zakresu danych.",
+        "goal_result": "{}: **{}** - wartość końcowa {}.",
+        "goal_calls": "Przebiegów symulacji: {}.",
+        "goal_unreachable": "⚠️ Cel nieosiągalny w zakresie danych (najwyższa wartość: {}).",
+        "goal_apply": "✅ Zastosuj w planie",
+        "corr_title": "🔗 Korelacje metali (kroczące)",
+        "corr_window": "Okno",
+        "corr_end": "Okno kończące się",
+        "corr_hint": "Dzienne stopy zwrotu w walucie planu, kowariancje annualizowane; okno przesuwane sesja po sesji.",
+        "corr_matrix": "Korelacja",
+        "corr_covariance": "Kowariancja (roczna)",
+        "corr_chart": "Korelacje par metali w czasie",
+        "corr_min_variance": "Portfel minimalnej wariancji (bez krótkiej sprzedaży) w tym oknie: {} - zmienność {:.1f}% rocznie (alokacja planu: {:.1f}%).",
+        "corr_apply": "⚖️ Ustaw suwaki alokacji",
+        "purchase_strategy": "🎯 Strategia zakupów",
+        "strategy_fixed": "Stała kwota",
+        "strategy_value_averaging": "Uśrednianie wartości",
+        "strategy_buy_the_dip": "Dokupowanie spadków",
+        "strategy_contribution_rebalance": "Wpłaty do niedoważonych metali",
+        "strategy_growth": "Wzrost ścieżki docelowej (% rocznie)",
+        "strategy_max_multiple": "Maks. zakup (wielokrotność kwoty dokupu)",
+        "strategy_drop": "Spadek od maksimum (%)",
+        "strategy_boost": "Mnożnik kwoty po spadku",
+        "strategy_lookback": "Okno maksimum (sesje)",
+        "strategy_hint_fixed": "Kwota dokupu dzielona według alokacji.",
+        "strategy_hint_value_averaging": "Dokup uzupełnia wartość portfela (po cenie odkupu) do ścieżki: wpłata początkowa + n × kwota dokupu; bez sprzedaży.",
+        "strategy_hint_buy_the_dip": "Kwota na metal rośnie, gdy jego cena jest poniżej maksimum z okna o zadany procent.",
+        "strategy_hint_contribution_rebalance": "Kwota dokupu trafia do metali poniżej udziału docelowego - portfel wraca do alokacji bez sprzedaży.",
+        "withdrawals": "💸 Wypłaty (faza dekumulacji)",
+        "withdrawal_mode": "Rodzaj wypłat",
+        "withdrawal_mode_none": "Brak",
+        "withdrawal_mode_fixed": "Stała kwota",
+        "withdrawal_mode_indexed": "Kwota indeksowana inflacją",
+        "withdrawal_mode_percent": "Procent wartości",
+        "withdrawal_amount": "Kwota wypłaty ({})",
+        "withdrawal_percent": "Wypłata roczna (% wartości portfela)",
+        "withdrawal_indexation": "Inflacja w latach bez danych (% rocznie)",
+        "withdrawal_frequency": "Częstotliwość wypłat",
+        "withdrawal_day": "Dzień wypłaty (1–28)",
+        "withdrawal_start": "Pierwsza wypłata od",
+        "withdrawal_end": "Ostatnia wypłata do",
+        "withdrawal_hint": "Metale sprzedawane proporcjonalnie po cenie odkupu; symulacja trwa do ostatniej wypłaty.",
+        "withdrawn_total": "💸 Wypłacono łącznie",
+        "withdrawal_depleted": "⚠️ Portfel wyczerpany {} - kolejne wypłaty nie były możliwe.",
+        "swr_title": "🧮 Bezpieczna stopa wypłat (wszystkie historyczne starty)",
+        "swr_years": "Okres wypłat (lata)",
+        "swr_hint": "{} startów: kapitał początkowy {} bez dokupów, wypłaty - {}. Szukana najwyższa stopa roczna (% kapitału początkowego), przy której portfel nie wyczerpie się przed końcem okresu.",
+        "swr_running": "Szukanie stopy wypłat... {:.0f}%",
+        "swr_result": "Bezpieczna stopa: **{:.2f}%** rocznie ({} rocznie na start) - najgorszy start {}.",
+        "swr_summary": "Mediana po {} startach: {:.2f}%; przebiegów silnika: {}.",
+        "swr_capped": "Przy {} startach portfel wytrzymał nawet {:.0f}% rocznie.",
+        "swr_rate": "Najwyższa stopa wypłat (%)",
+        "swr_apply": "✅ Ustaw wypłaty w planie"
     },
     "Deutsch": {
         "portfolio_value": "Portfoliowert",
         "real_portfolio_value": "Portfoliowert (real, inflationsbereinigt)",
+        "real_value_cpi_fallback": "⚠️ Keine Inflationsdaten für {0} - Realwert und Indexierung der Entnahmen nach der Inflation in {1} berechnet",
         "invested": "Investiertes Kapital",
         "storage_cost": "Lagerkosten",
         "chart_subtitle": "📈 Entwicklung des Portfoliowerts: nominal und real",
@@ -266,7 +499,7 @@ translations = {
         "margins_fees": "📊 Margen und Gebühren",
         "buyback_prices": "💵 Rückkaufpreise der Metalle",
         "rebalance_prices": "♻️ Preise für ReBalancing der Metalle",
-        "initial_allocation": "Anfangsinvestition (EUR)",
+        "initial_allocation": "Anfangsinvestition ({})",
         "first_purchase_date": "Kaufstartdatum",
         "last_purchase_date": "Letzter Kauftag",
         "purchase_frequency": "Kaufhäufigkeit",
@@ -277,7 +510,7 @@ translations = {
         "purchase_day_of_week": "Wochentag für Kauf",
         "purchase_day_of_month": "Kauftag im Monat (1–28)",
         "purchase_day_of_quarter": "Kauftag im Quartal (1–28)",
-        "purchase_amount": "Kaufbetrag (EUR)",
+        "purchase_amount": "Kaufbetrag ({})",
         "rebalance_1": "ReBalancing 1",
         "rebalance_2": "ReBalancing 2",
         "deviation_condition": "Abweichungsbedingung",
@@ -330,8 +563,8 @@ translations = {
         "avg_annual_growth": "📈 Durchschnittliche jährliche Preisentwicklung aller Metalle (gewichtet nach Allokation)",
         "weighted_avg_growth": "🌐 Durchschnittliche jährliche Preissteigerung (gewichtete Allokation)",
         "simplified_view": "📅 Vereinfachte Übersicht: Erster Tag jedes Jahres",
-        "invested_eur": "Investiert (EUR)",
-        "portfolio_value_eur": "Portfoliowert (EUR)",
+        "invested_eur": "Investiert ({})",
+        "portfolio_value_eur": "Portfoliowert ({})",
         "gold_g": "Gold (g)",
         "silver_g": "Silber (g)",
         "platinum_g": "Platin (g)",
@@ -340,7 +573,166 @@ translations = {
         "storage_costs_summary": "📦 Zusammenfassung der Lagerkosten",
         "avg_annual_storage_cost": "Durchschnittliche jährliche Lagerkosten",
         "storage_cost_percentage": "Lagerkosten (% letztes Jahr)",
-        "vat": "MwSt (%)"
+        "vat": "MwSt (%)",
+        "currency": "Währung",
+        "execution_fix": "Ausführungspreis",
+        "execution_fix_daily": "Tagespreis",
+        "execution_fix_AM": "AM-Fixing",
+        "execution_fix_PM": "PM-Fixing",
+        "execution_fix_average": "Durchschnitt der Fixings",
+        "execution_fix_worst": "schlechtestes Fixing des Tages (Kauf zum höchsten, Verkauf und Bewertung zum niedrigsten)",
+        "background_running": "⏳ Berechnung im Hintergrund: {:.0f}%",
+        "cancel_job": "⛔ Berechnung abbrechen",
+        "job_cancelled": "⛔ Berechnung abgebrochen.",
+        "stale_result": "⏳ Angezeigt wird das letzte fertige Ergebnis – das neue wird noch berechnet.",
+        "preview_result": "≈ Näherungsvorschau (Monatsendkurse) – das exakte Ergebnis wird noch berechnet.",
+        "preview_error": "✓ Das exakte Ergebnis hat die Vorschau ersetzt. Fehler der Vorschau: Endwert {:+.2f} %, max. {:.2f} % im Diagramm.",
+        "risk_title": "📉 Risiko und Rendite",
+        "risk_view": "Ansicht",
+        "portfolio_view": "Portfolio (zeitgewichtete Renditen)",
+        "cagr": "Durchschnittliche jährliche Rendite (CAGR)",
+        "max_drawdown": "Maximaler Drawdown",
+        "volatility": "Jährliche Volatilität",
+        "time_under_water": "Längste Zeit unter Wasser",
+        "days": "Tage",
+        "sharpe": "Sharpe-Ratio",
+        "sortino": "Sortino-Ratio",
+        "rolling_returns": "Rollierende Renditen (annualisiert)",
+        "window": "Fenster",
+        "median": "Median",
+        "negative_share": "Negative Perioden",
+        "max_rolling_volatility": "Max. Volatilität im Fenster",
+        "diagnostics": "🔧 Diagnose",
+        "diagnostics_total": "Gesamter Durchlauf: {:.1f} ms · Log: {}",
+        "stages": "Phasen",
+        "counters": "Aufrufzähler",
+        "profile_top": "cProfile - teuerste Funktionen",
+        "recent_runs": "Letzte Durchläufe",
+        "cache_warmer": "Cache-Vorwärmung (Presets)",
+        "cache_warmer_status": "Status: {} · {}/{} · Datenversion: {} · in Arbeit: {}",
+        "fee_attribution_title": "🧾 Wohin die Rendite ging - Kostenzuordnung",
+        "fee_attribution_caption": "Kostenverlust = Endwert ohne diese Kosten minus tatsächlicher Endwert (inkl. Zinseszinseffekt).",
+        "component": "Komponente",
+        "amount": "Betrag ({})",
+        "share_of_invested": "% des investierten Kapitals",
+        "price_return": "Preisrendite (ohne Kosten)",
+        "drag_margins": "Händlermargen beim Kauf",
+        "drag_buyback": "Rückkaufabschlag",
+        "drag_rebalance_markup": "Aufschläge beim ReBalancing",
+        "drag_storage": "Lagerkosten",
+        "drag_interaction": "Wechselwirkung der Kosten",
+        "final_value": "Endwert",
+        "comparison_title": "⚖️ Portfoliovergleich",
+        "comparison_select": "Vergleichen mit",
+        "comparison_hint": "Varianten oder Presets wählen - alle Portfolios werden gemeinsam in einem Durchlauf berechnet, im Zeitraum und in der Währung des aktuellen Plans.",
+        "current_plan": "Aktueller Plan",
+        "lump_sum": "Einmalanlage (gesamtes Kapital zu Beginn)",
+        "no_rebalance": "Ohne ReBalancing",
+        "single_metal": "100% {}",
+        "portfolio": "Portfolio",
+        "gain": "Gewinn",
+        "diff_vs_plan": "Differenz zum Plan",
+        "first_divergence": "Erste Abweichung",
+        "drawdown_chart": "Drawdown vom Höchststand",
+        "rolling_title": "🔁 Rollierende Starts - Ergebnisverteilung des Plans",
+        "rolling_years": "Horizont (Jahre)",
+        "rolling_step": "Start alle",
+        "rolling_step_MS": "Monat",
+        "rolling_step_QS": "Quartal",
+        "rolling_step_YS": "Jahr",
+        "rolling_hint": "{} Szenarien (derselbe Plan ab aufeinanderfolgenden Daten) - {}.",
+        "rolling_interactive": "sofort berechnet",
+        "rolling_batch": "große Analyse, läuft in freien Prozessen nach kurzen Aufgaben",
+        "rolling_start": "▶️ Analyse starten",
+        "job_queued": "⏳ In der Warteschlange - Position {} (wartet {:.0f} s)",
+        "rolling_running": "Analyse der rollierenden Starts... {:.0f}%",
+        "rolling_quota": "⚠️ Limit für Hintergrundaufgaben der Sitzung erreicht ({}) - bitte warten oder abbrechen.",
+        "rolling_failed": "❌ Analyse fehlgeschlagen: {}",
+        "rolling_none": "Keine vollständigen Zeiträume mit diesem Horizont im Datenbereich.",
+        "rolling_summary": "{} Szenarien: mittlere Jahresrendite {:.2f}% (Std.-Abw. {:.2f} pp), Spanne {:.2f}% … {:.2f}%.",
+        "rolling_percentile": "Perzentil",
+        "rolling_annual": "Jahresrendite",
+        "rolling_gain": "Gesamtgewinn",
+        "rolling_best": "Beste Starts",
+        "rolling_worst": "Schlechteste Starts",
+        "rolling_start_date": "Start",
+        "tax_title": "🧮 Steuern - Kaufposten (FIFO)",
+        "tax_hint": "Jeder Verkauf (Rebalancing, Lagergebühr) wird mit den ältesten Kaufposten verrechnet. Gewinne aus Posten, die länger als ein Jahr gehalten wurden, sind in Deutschland steuerfrei (§ 23 EStG); in Polen ist der gesamte realisierte Gewinn steuerpflichtig.",
+        "tax_start": "▶️ Kaufposten berechnen",
+        "tax_running": "Kaufposten werden verrechnet... {:.0f}%",
+        "tax_failed": "❌ Verrechnung der Kaufposten fehlgeschlagen: {}",
+        "tax_year": "Jahr",
+        "tax_proceeds": "Verkaufserlös",
+        "tax_cost": "Anschaffungskosten",
+        "tax_realized": "Realisierter Gewinn",
+        "tax_realized_taxfree": "Realisiert: Posten > 1 Jahr",
+        "tax_realized_taxable": "Realisiert: Posten ≤ 1 Jahr",
+        "tax_unrealized": "Unrealisierter Gewinn (Jahresende)",
+        "tax_unrealized_taxfree": "Unrealisiert: Posten > 1 Jahr",
+        "tax_taxfree_share": "Anteil Posten > 1 Jahr",
+        "tax_sales_summary": "Verkäufe gesamt: Rebalancing {} (Gewinn {}), Lagergebühren {} (Gewinn {}).",
+        "goal_title": "🎯 Ziel - was nötig ist, um den Portfoliowert zu erreichen",
+        "goal_target": "Zielwert ({})",
+        "goal_basis": "Wert",
+        "goal_nominal": "nominal",
+        "goal_real": "real (inflationsbereinigt)",
+        "goal_param": "Gesuchter Parameter",
+        "goal_purchase_amount": "Kaufbetrag",
+        "goal_initial_allocation": "Anfangsinvestition",
+        "goal_end_purchase_date": "Letztes Kaufdatum",
+        "goal_hint": "Übrige Planparameter unverändert; das Ergebnis gilt für historische Preise im Datenbereich.",
+        "goal_result": "{}: **{}** - Endwert {}.",
+        "goal_calls": "Simulationsdurchläufe: {}.",
+        "goal_unreachable": "⚠️ Ziel im Datenbereich nicht erreichbar (höchster Wert: {}).",
+        "goal_apply": "✅ Im Plan übernehmen",
+        "corr_title": "🔗 Korrelationen der Metalle (rollierend)",
+        "corr_window": "Fenster",
+        "corr_end": "Fenster endet am",
+        "corr_hint": "Tägliche Renditen in Planwährung, annualisierte Kovarianzen; Fenster wird Sitzung für Sitzung verschoben.",
+        "corr_matrix": "Korrelation",
+        "corr_covariance": "Kovarianz (jährlich)",
+        "corr_chart": "Korrelationen der Metallpaare im Zeitverlauf",
+        "corr_min_variance": "Minimum-Varianz-Portfolio (ohne Leerverkäufe) in diesem Fenster: {} - Volatilität {:.1f}% p.a. (Planallokation: {:.1f}%).",
+        "corr_apply": "⚖️ Allokationsregler setzen",
+        "purchase_strategy": "🎯 Kaufstrategie",
+        "strategy_fixed": "Fester Betrag",
+        "strategy_value_averaging": "Value Averaging",
+        "strategy_buy_the_dip": "Nachkauf bei Kursrückgängen",
+        "strategy_contribution_rebalance": "Einzahlungen in untergewichtete Metalle",
+        "strategy_growth": "Wachstum des Zielpfads (% p.a.)",
+        "strategy_max_multiple": "Max. Kauf (Vielfaches des Kaufbetrags)",
+        "strategy_drop": "Rückgang vom Höchststand (%)",
+        "strategy_boost": "Betragsfaktor nach Rückgang",
+        "strategy_lookback": "Fenster für Höchststand (Handelstage)",
+        "strategy_hint_fixed": "Der Kaufbetrag wird gemäß Allokation aufgeteilt.",
+        "strategy_hint_value_averaging": "Der Kauf füllt den Portfoliowert (zum Rückkaufpreis) bis zum Zielpfad auf: Anfangsbetrag + n × Kaufbetrag; ohne Verkäufe.",
+        "strategy_hint_buy_the_dip": "Der Betrag pro Metall steigt, wenn sein Preis um den angegebenen Prozentsatz unter dem Höchststand des Fensters liegt.",
+        "strategy_hint_contribution_rebalance": "Der Kaufbetrag fließt in Metalle unter ihrem Zielanteil - das Portfolio kehrt ohne Verkäufe zur Allokation zurück.",
+        "withdrawals": "💸 Entnahmen (Entsparphase)",
+        "withdrawal_mode": "Entnahmeart",
+        "withdrawal_mode_none": "Keine",
+        "withdrawal_mode_fixed": "Fester Betrag",
+        "withdrawal_mode_indexed": "Inflationsindexierter Betrag",
+        "withdrawal_mode_percent": "Prozent des Werts",
+        "withdrawal_amount": "Entnahmebetrag ({})",
+        "withdrawal_percent": "Jährliche Entnahme (% des Portfoliowerts)",
+        "withdrawal_indexation": "Inflation in Jahren ohne Daten (% p.a.)",
+        "withdrawal_frequency": "Entnahmehäufigkeit",
+        "withdrawal_day": "Entnahmetag (1–28)",
+        "withdrawal_start": "Erste Entnahme ab",
+        "withdrawal_end": "Letzte Entnahme bis",
+        "withdrawal_hint": "Metalle werden anteilig zum Rückkaufpreis verkauft; die Simulation läuft bis zur letzten Entnahme.",
+        "withdrawn_total": "💸 Insgesamt entnommen",
+        "withdrawal_depleted": "⚠️ Portfolio am {} aufgebraucht - weitere Entnahmen waren nicht möglich.",
+        "swr_title": "🧮 Sichere Entnahmerate (alle historischen Starts)",
+        "swr_years": "Entnahmezeitraum (Jahre)",
+        "swr_hint": "{} Starts: Anfangskapital {} ohne Zukäufe, Entnahmen - {}. Gesucht wird die höchste jährliche Rate (% des Anfangskapitals), bei der das Portfolio bis zum Ende des Zeitraums reicht.",
+        "swr_running": "Suche der Entnahmerate... {:.0f}%",
+        "swr_result": "Sichere Rate: **{:.2f}%** p.a. ({} pro Jahr zum Start) - schlechtester Start {}.",
+        "swr_summary": "Median über {} Starts: {:.2f}%; Simulationsdurchläufe: {}.",
+        "swr_capped": "Bei {} Starts hielt das Portfolio sogar {:.0f}% p.a. stand.",
+        "swr_rate": "Höchste Entnahmerate (%)",
+        "swr_apply": "✅ Entnahmen im Plan übernehmen"
     }
 }
 
@@ -357,7 +749,8 @@ action_translations = {
         "rebalancing_skipped_rebalance_1_no_value": "pominięto ReBalancing 1 (brak wartości)",
         "rebalancing_skipped_rebalance_2_no_value": "pominięto ReBalancing 2 (brak wartości)",
         "rebalancing_skipped_rebalance_1_no_deviation": "pominięto ReBalancing 1 (brak odchylenia)",
-        "rebalancing_skipped_rebalance_2_no_deviation": "pominięto ReBalancing 2 (brak odchylenia)"
+        "rebalancing_skipped_rebalance_2_no_deviation": "pominięto ReBalancing 2 (brak odchylenia)",
+        "withdrawal": "wypłata"
     },
     "Deutsch": {
         "initial": "Anfänglich",
@@ -370,7 +763,8 @@ action_translations = {
         "rebalancing_skipped_rebalance_1_no_value": "ReBalancing 1 übersprungen (kein Wert)",
         "rebalancing_skipped_rebalance_2_no_value": "ReBalancing 2 übersprungen (kein Wert)",
         "rebalancing_skipped_rebalance_1_no_deviation": "ReBalancing 1 übersprungen (keine Abweichung)",
-        "rebalancing_skipped_rebalance_2_no_deviation": "ReBalancing 2 übersprungen (keine Abweichung)"
+        "rebalancing_skipped_rebalance_2_no_deviation": "ReBalancing 2 übersprungen (keine Abweichung)",
+        "withdrawal": "Entnahme"
     }
 }
 
@@ -387,1097 +781,1651 @@ def translate_action(action_str):
 
 
 # ====== GŁÓWNA APLIKACJA ======
+# Widżety, których wartości są przetłumaczonymi etykietami
+TRANSLATED_WIDGET_VALUES = {
+    "purchase_freq": ["none", "week", "month", "quarter"],
+    "storage_metal": ["best_of_year", "all_metals"],
+}
+STORAGE_FEE_MODE_LABELS = {
+    "Polski": ["Rocznie", "Miesięcznie"],
+    "Deutsch": ["Jährlich", "Monatlich"],
+}
+# Wypłaty - wartości widżetów to kody silnika (etykiety przez format_func)
+WITHDRAWAL_MODES = ["none", "fixed", "indexed", "percent"]
+WITHDRAWAL_FREQUENCIES = ["month", "quarter"]
+# Strategie zakupów - kody silnika, parametry (klucz widżetu strategy_<parametr>) i krok pól
+STRATEGY_PARAM_STEPS = {"growth": 0.5, "max_multiple": 0.5, "drop": 1.0, "boost": 0.25, "lookback": 10}
+
+def on_language_change():
+    """Zmiana języka zmienia tylko teksty - wynik symulacji pozostaje w pamięci"""
+    old_language = st.session_state.language
+    new_language = "Polski" if "Polski" in st.session_state["language_choice"] else "Deutsch"
+    st.session_state.language = new_language
+
+    # Przetłumacz zapamiętane wybory, aby zmiana języka nie zmieniała planu symulacji
+    for key, labels in TRANSLATED_WIDGET_VALUES.items():
+        for label in labels:
+            if st.session_state.get(key) == translations[old_language][label]:
+                st.session_state[key] = translations[new_language][label]
+    if st.session_state.get("storage_fee_mode") in STORAGE_FEE_MODE_LABELS[old_language]:
+        index = STORAGE_FEE_MODE_LABELS[old_language].index(st.session_state["storage_fee_mode"])
+        st.session_state["storage_fee_mode"] = STORAGE_FEE_MODE_LABELS[new_language][index]
+
 st.sidebar.header("🌐 Wybierz język / Sprache wählen")
-language_choice = st.sidebar.selectbox(
+st.sidebar.selectbox(
     "",
     ("🇵🇱 Polski", "🇩🇪 Deutsch"),
-    index=0 if st.session_state.language == "Polski" else 1
+    index=0 if st.session_state.language == "Polski" else 1,
+    key="language_choice",
+    on_change=on_language_change
 )
 
-new_language = "Polski" if "Polski" in language_choice else "Deutsch"
-if new_language != st.session_state.language:
-    st.session_state.language = new_language
-    st.rerun()
-
 language = st.session_state.language
 
-# Parametry symulacji
-st.sidebar.header(translations[language]["simulation_settings"])
-
-# Inwestycja: Kwoty i daty
-st.sidebar.subheader(translations[language]["investment_amounts"])
-
-today = datetime.today()
-default_initial_date = today.replace(year=today.year - 20)
-
-# Alokacja początkowa
-initial_allocation = st.sidebar.number_input(
-    translations[language]["initial_allocation"],
-    value=st.session_state.get("initial_allocation", 100000.0),
-    step=100.0,
-    key="initial_allocation"
-)
+# ====== PARAMETRY SYMULACJI (fragment) ======
+@st.fragment
+def render_inputs():
+    """Panel parametrów - zwraca plan symulacji (None przy błędnej alokacji).
+
+    Interakcja z panelem przelicza najpierw tylko ten fragment; całą stronę
+    przeładowujemy dopiero wtedy, gdy zmienił się plan symulacji.
+    """
+    full_run = st.session_state.pop("inputs_full_run", False)
+    plan = render_plan_widgets()
+    key = plan_key(plan, data_version) if plan is not None else None
+    if not full_run and key != st.session_state.get("inputs_plan_key"):
+        st.rerun(scope="app")
+    st.session_state["inputs_plan_key"] = key
+    return plan
+
+def render_plan_widgets():
+    """Widżety parametrów symulacji (panel boczny)"""
+    st.header(translations[language]["simulation_settings"])
+
+    # Inwestycja: Kwoty i daty
+    st.subheader(translations[language]["investment_amounts"])
+
+    today = datetime.today()
+    default_initial_date = today.replace(year=today.year - 20)
+
+    # Waluta symulacji
+    if st.session_state.get("currency") not in currencies:
+        st.session_state["currency"] = market_data.BASE_CURRENCY
+    currency = st.selectbox(
+        translations[language]["currency"],
+        currencies,
+        key="currency"
+    )
 
-# Data początkowa
-initial_date = st.sidebar.date_input(
-    translations[language]["first_purchase_date"],
-    value=st.session_state.get("initial_date", default_initial_date.date()),
-    min_value=data.index.min().date(),
-    max_value=data.index.max().date(),
-    key="initial_date"
-)
+    # Cena wykonania - wybór tylko, gdy wczytano plik fixingów
+    if st.session_state.get("execution_fix") not in market.fixes:
+        st.session_state["execution_fix"] = market_data.DAILY_FIX
+    if len(market.fixes) > 1:
+        execution_fix = st.selectbox(
+            translations[language]["execution_fix"],
+            market.fixes,
+            format_func=lambda f: translations[language][f"execution_fix_{f}"],
+            key="execution_fix"
+        )
+    else:
+        execution_fix = market_data.DAILY_FIX
+
+    # Alokacja początkowa
+    initial_allocation = st.number_input(
+        translations[language]["initial_allocation"].format(currency),
+        value=st.session_state.get("initial_allocation", 100000.0),
+        step=100.0,
+        key="initial_allocation"
+    )
 
-# Data końcowa - bez ograniczeń minimalnych
-end_purchase_date = st.sidebar.date_input(
-    translations[language]["last_purchase_date"],
-    value=st.session_state.get("end_purchase_date", data.index.max().date()),
-    min_value=initial_date,  # Zmienione - teraz minimum to data początkowa
-    max_value=data.index.max().date(),
-    key="end_purchase_date"
-)
+    # Data początkowa
+    initial_date = st.date_input(
+        translations[language]["first_purchase_date"],
+        value=st.session_state.get("initial_date", default_initial_date.date()),
+        min_value=data.index.min().date(),
+        max_value=data.index.max().date(),
+        key="initial_date"
+    )
 
-# Obliczenie liczby lat zakupów
-days_difference = (pd.to_datetime(end_purchase_date) - pd.to_datetime(initial_date)).days
-years_difference = days_difference / 365.25
+    # Data końcowa - bez ograniczeń minimalnych
+    end_purchase_date = st.date_input(
+        translations[language]["last_purchase_date"],
+        value=st.session_state.get("end_purchase_date", data.index.max().date()),
+        min_value=initial_date,  # Zmienione - teraz minimum to data początkowa
+        max_value=data.index.max().date(),
+        key="end_purchase_date"
+    )
 
-# Informacja o zakresie dat
-if years_difference >= 7:
-    st.sidebar.success(translations[language]["purchase_days_range"].format(years_difference))
-else:
-    st.sidebar.warning(translations[language]["short_period_warning"].format(years_difference))
-
-# Alokacja metali
-st.sidebar.subheader(translations[language]["metal_allocation"])
-
-# Domyślne wartości alokacji
-for metal, default in {"Gold": 40, "Silver": 20, "Platinum": 20, "Palladium": 20}.items():
-    if f"alloc_{metal}" not in st.session_state:
-        st.session_state[f"alloc_{metal}"] = default
-
-if st.sidebar.button(translations[language]["reset_allocation"]):
-    st.session_state["alloc_Gold"] = 40
-    st.session_state["alloc_Silver"] = 20
-    st.session_state["alloc_Platinum"] = 20
-    st.session_state["alloc_Palladium"] = 20
-    st.rerun()
-
-allocation_gold = st.sidebar.slider(translations[language]["gold"], 0, 100, key="alloc_Gold")
-allocation_silver = st.sidebar.slider(translations[language]["silver"], 0, 100, key="alloc_Silver")
-allocation_platinum = st.sidebar.slider(translations[language]["platinum"], 0, 100, key="alloc_Platinum")
-allocation_palladium = st.sidebar.slider(translations[language]["palladium"], 0, 100, key="alloc_Palladium")
-
-total = allocation_gold + allocation_silver + allocation_platinum + allocation_palladium
-if total != 100:
-    st.title(translations[language]["app_title"])
-    st.error(translations[language]["allocation_error"].format(total))
-    st.stop()
+    # Obliczenie liczby lat zakupów
+    days_difference = (pd.to_datetime(end_purchase_date) - pd.to_datetime(initial_date)).days
+    years_difference = days_difference / 365.25
 
-allocation = {
-    "Gold": allocation_gold / 100,
-    "Silver": allocation_silver / 100,
-    "Platinum": allocation_platinum / 100,
-    "Palladium": allocation_palladium / 100
-}
+    # Informacja o zakresie dat
+    if years_difference >= 7:
+        st.success(translations[language]["purchase_days_range"].format(years_difference))
+    else:
+        st.warning(translations[language]["short_period_warning"].format(years_difference))
+
+    # Alokacja metali
+    st.subheader(translations[language]["metal_allocation"])
+
+    # Domyślne wartości alokacji
+    for metal, default in {"Gold": 40, "Silver": 20, "Platinum": 20, "Palladium": 20}.items():
+        if f"alloc_{metal}" not in st.session_state:
+            st.session_state[f"alloc_{metal}"] = default
+
+    if st.button(translations[language]["reset_allocation"]):
+        st.session_state["alloc_Gold"] = 40
+        st.session_state["alloc_Silver"] = 20
+        st.session_state["alloc_Platinum"] = 20
+        st.session_state["alloc_Palladium"] = 20
+        st.rerun()
+
+    allocation_gold = st.slider(translations[language]["gold"], 0, 100, key="alloc_Gold")
+    allocation_silver = st.slider(translations[language]["silver"], 0, 100, key="alloc_Silver")
+    allocation_platinum = st.slider(translations[language]["platinum"], 0, 100, key="alloc_Platinum")
+    allocation_palladium = st.slider(translations[language]["palladium"], 0, 100, key="alloc_Palladium")
+
+    total = allocation_gold + allocation_silver + allocation_platinum + allocation_palladium
+    if total != 100:
+        return None
+
+    allocation = {
+        "Gold": allocation_gold / 100,
+        "Silver": allocation_silver / 100,
+        "Platinum": allocation_platinum / 100,
+        "Palladium": allocation_palladium / 100
+    }
 
-# Zakupy cykliczne
-st.sidebar.subheader(translations[language]["recurring_purchases"])
-
-purchase_freq_options = [
-    translations[language]["none"],
-    translations[language]["week"],
-    translations[language]["month"],
-    translations[language]["quarter"]
-]
-
-# Znajdź indeks dla zapisanej częstotliwości
-saved_freq = st.session_state.get("purchase_freq", translations[language]["month"])
-freq_index = 1  # domyślnie miesiąc
-if saved_freq in purchase_freq_options:
-    freq_index = purchase_freq_options.index(saved_freq)
-
-purchase_freq = st.sidebar.selectbox(
-    translations[language]["purchase_frequency"],
-    purchase_freq_options,
-    index=freq_index,
-    key="purchase_freq"
-)
+    # Zakupy cykliczne
+    st.subheader(translations[language]["recurring_purchases"])
 
-# Dzień zakupu w zależności od częstotliwości
-if purchase_freq == translations[language]["week"]:
-    days_of_week = [
-        translations[language]["monday"],
-        translations[language]["tuesday"],
-        translations[language]["wednesday"],
-        translations[language]["thursday"],
-        translations[language]["friday"]
+    purchase_freq_options = [
+        translations[language]["none"],
+        translations[language]["week"],
+        translations[language]["month"],
+        translations[language]["quarter"]
     ]
-    
-    saved_day = st.session_state.get("purchase_day", 0)
-    selected_day = st.sidebar.selectbox(
-        translations[language]["purchase_day_of_week"],
-        days_of_week,
-        index=saved_day if saved_day < len(days_of_week) else 0
-    )
-    purchase_day = days_of_week.index(selected_day)
-    default_purchase_amount = 250.0
-    
-elif purchase_freq == translations[language]["month"]:
-    purchase_day = st.sidebar.number_input(
-        translations[language]["purchase_day_of_month"],
-        min_value=1,
-        max_value=28,
-        value=st.session_state.get("purchase_day", 1),
-        key="purchase_day"
-    )
-    default_purchase_amount = 1000.0
-    
-elif purchase_freq == translations[language]["quarter"]:
-    purchase_day = st.sidebar.number_input(
-        translations[language]["purchase_day_of_quarter"],
-        min_value=1,
-        max_value=28,
-        value=st.session_state.get("purchase_day", 1),
-        key="purchase_day"
+
+    # Znajdź indeks dla zapisanej częstotliwości
+    saved_freq = st.session_state.get("purchase_freq", translations[language]["month"])
+    freq_index = 1  # domyślnie miesiąc
+    if saved_freq in purchase_freq_options:
+        freq_index = purchase_freq_options.index(saved_freq)
+
+    purchase_freq = st.selectbox(
+        translations[language]["purchase_frequency"],
+        purchase_freq_options,
+        index=freq_index,
+        key="purchase_freq"
     )
-    default_purchase_amount = 3250.0
-    
-else:
-    purchase_day = None
-    default_purchase_amount = 0.0
-
-purchase_amount = st.sidebar.number_input(
-    translations[language]["purchase_amount"],
-    value=st.session_state.get("purchase_amount", default_purchase_amount),
-    step=50.0,
-    key="purchase_amount"
-)
 
-# ReBalancing
-rebalance_base_year = initial_date.year + 1
-rebalance_1_default = datetime(rebalance_base_year, 4, 1)
-rebalance_2_default = datetime(rebalance_base_year, 10, 1)
+    # Dzień zakupu w zależności od częstotliwości
+    if purchase_freq == translations[language]["week"]:
+        days_of_week = [
+            translations[language]["monday"],
+            translations[language]["tuesday"],
+            translations[language]["wednesday"],
+            translations[language]["thursday"],
+            translations[language]["friday"]
+        ]
+
+        saved_day = st.session_state.get("purchase_day", 0)
+        selected_day = st.selectbox(
+            translations[language]["purchase_day_of_week"],
+            days_of_week,
+            index=saved_day if saved_day < len(days_of_week) else 0
+        )
+        purchase_day = days_of_week.index(selected_day)
+        default_purchase_amount = 250.0
+
+    elif purchase_freq == translations[language]["month"]:
+        purchase_day = st.number_input(
+            translations[language]["purchase_day_of_month"],
+            min_value=1,
+            max_value=28,
+            value=st.session_state.get("purchase_day", 1),
+            key="purchase_day"
+        )
+        default_purchase_amount = 1000.0
+
+    elif purchase_freq == translations[language]["quarter"]:
+        purchase_day = st.number_input(
+            translations[language]["purchase_day_of_quarter"],
+            min_value=1,
+            max_value=28,
+            value=st.session_state.get("purchase_day", 1),
+            key="purchase_day"
+        )
+        default_purchase_amount = 3250.0
 
-with st.sidebar.expander(translations[language]["rebalancing"], expanded=False):
-    rebalance_1 = st.checkbox(
-        translations[language]["rebalance_1"],
-        value=st.session_state.get("rebalance_1", True),
-        key="rebalance_1"
-    )
-    rebalance_1_condition = st.checkbox(
-        translations[language]["deviation_condition_1"],
-        value=st.session_state.get("rebalance_1_condition", False),
-        key="rebalance_1_condition"
-    )
-    rebalance_1_threshold = st.number_input(
-        translations[language]["deviation_threshold_1"],
-        min_value=0.0,
-        max_value=100.0,
-        value=st.session_state.get("rebalance_1_threshold", 12.0),
-        step=0.5,
-        key="rebalance_1_threshold"
-    )
-    rebalance_1_start = st.date_input(
-        translations[language]["start_rebalance"] + " 1",
-        value=st.session_state.get("rebalance_1_start", rebalance_1_default.date()),
-        min_value=data.index.min().date(),
-        max_value=data.index.max().date(),
-        key="rebalance_1_start"
-    )
-    
-    rebalance_2 = st.checkbox(
-        translations[language]["rebalance_2"],
-        value=st.session_state.get("rebalance_2", False),
-        key="rebalance_2"
-    )
-    rebalance_2_condition = st.checkbox(
-        translations[language]["deviation_condition_2"],
-        value=st.session_state.get("rebalance_2_condition", False),
-        key="rebalance_2_condition"
-    )
-    rebalance_2_threshold = st.number_input(
-        translations[language]["deviation_threshold_2"],
-        min_value=0.0,
-        max_value=100.0,
-        value=st.session_state.get("rebalance_2_threshold", 12.0),
-        step=0.5,
-        key="rebalance_2_threshold"
-    )
-    rebalance_2_start = st.date_input(
-        translations[language]["start_rebalance"] + " 2",
-        value=st.session_state.get("rebalance_2_start", rebalance_2_default.date()),
-        min_value=data.index.min().date(),
-        max_value=data.index.max().date(),
-        key="rebalance_2_start"
+    else:
+        purchase_day = None
+        default_purchase_amount = 0.0
+
+    purchase_amount = st.number_input(
+        translations[language]["purchase_amount"].format(currency),
+        value=st.session_state.get("purchase_amount", default_purchase_amount),
+        step=50.0,
+        key="purchase_amount"
     )
 
-# Koszty magazynowania
-storage_metal_options = [
-    "Gold", "Silver", "Platinum", "Palladium",
-    translations[language]["best_of_year"],
-    translations[language]["all_metals"]
-]
-
-with st.sidebar.expander(translations[language]["storage_costs"], expanded=False):
-    # Nowy wybór trybu naliczania
-    storage_fee_mode = st.selectbox(
-        "Tryb naliczania kosztów magazynowania" if language == "Polski" else "Lagerkostenberechnungsmodus",
-        ["Rocznie", "Miesięcznie"] if language == "Polski" else ["Jährlich", "Monatlich"],
-        key="storage_fee_mode"
-    )
-    
-    # Modyfikuj pole storage_fee w zależności od trybu
-    if storage_fee_mode in ["Rocznie", "Jährlich"]:
-        storage_fee = st.number_input(
-            translations[language]["annual_storage_fee"],
-            value=st.session_state.get("storage_fee", 1.5),
-            step=0.05,
-            key="storage_fee"
+    # Strategia zakupów - domyślnie stała kwota (parametry spoza wybranej strategii nie trafiają do planu)
+    purchase_strategy, strategy_params = "fixed", {}
+    if purchase_day is not None:
+        with st.expander(translations[language]["purchase_strategy"], expanded=False):
+            purchase_strategy = st.selectbox(
+                translations[language]["purchase_strategy"],
+                list(strategies.STRATEGIES),
+                format_func=lambda s: translations[language][f"strategy_{s}"],
+                key="purchase_strategy"
+            )
+            for name, default in strategies.STRATEGIES[purchase_strategy].defaults.items():
+                step = STRATEGY_PARAM_STEPS[name]
+                strategy_params[name] = st.number_input(
+                    translations[language][f"strategy_{name}"],
+                    min_value=1 if isinstance(step, int) else 0.0,
+                    value=st.session_state.get(f"strategy_{name}", type(step)(default)),
+                    step=step,
+                    key=f"strategy_{name}"
+                )
+            st.caption(translations[language][f"strategy_hint_{purchase_strategy}"])
+
+    # Wypłaty (faza dekumulacji) - domyślnie wyłączone, plan kończy się z końcem zakupów
+    with st.expander(translations[language]["withdrawals"], expanded=False):
+        withdrawal_mode = st.selectbox(
+            translations[language]["withdrawal_mode"],
+            WITHDRAWAL_MODES,
+            format_func=lambda m: translations[language][f"withdrawal_mode_{m}"],
+            key="withdrawal_mode"
         )
-    else:
-        storage_fee = st.number_input(
-            "Miesięczny koszt magazynowania (%)" if language == "Polski" else "Monatliche Lagerkosten (%)",
-            value=st.session_state.get("storage_fee", 0.05),
-            step=0.005,
-            key="storage_fee"
+        withdrawal_amount, withdrawal_indexation, withdrawal_freq, withdrawal_day = 0.0, 0.0, "month", 1
+        withdrawal_start = withdrawal_end = end_purchase_date
+        if withdrawal_mode != "none":
+            if withdrawal_mode == "percent":
+                withdrawal_amount = st.number_input(
+                    translations[language]["withdrawal_percent"],
+                    min_value=0.0,
+                    value=st.session_state.get("withdrawal_percent", 4.0),
+                    step=0.25,
+                    key="withdrawal_percent"
+                )
+            else:
+                withdrawal_amount = st.number_input(
+                    translations[language]["withdrawal_amount"].format(currency),
+                    min_value=0.0,
+                    value=st.session_state.get("withdrawal_amount", 1000.0),
+                    step=50.0,
+                    key="withdrawal_amount"
+                )
+            if withdrawal_mode == "indexed":
+                withdrawal_indexation = st.number_input(
+                    translations[language]["withdrawal_indexation"],
+                    value=st.session_state.get("withdrawal_indexation", 2.0),
+                    step=0.25,
+                    key="withdrawal_indexation"
+                )
+            withdrawal_freq = st.selectbox(
+                translations[language]["withdrawal_frequency"],
+                WITHDRAWAL_FREQUENCIES,
+                format_func=lambda f: translations[language][f],
+                key="withdrawal_freq"
+            )
+            withdrawal_day = st.number_input(
+                translations[language]["withdrawal_day"],
+                min_value=1,
+                max_value=28,
+                value=st.session_state.get("withdrawal_day", 1),
+                key="withdrawal_day"
+            )
+            withdrawal_start = st.date_input(
+                translations[language]["withdrawal_start"],
+                value=st.session_state.get("withdrawal_start", end_purchase_date),
+                min_value=data.index.min().date(),
+                max_value=data.index.max().date(),
+                key="withdrawal_start"
+            )
+            withdrawal_end = st.date_input(
+                translations[language]["withdrawal_end"],
+                value=st.session_state.get("withdrawal_end", data.index.max().date()),
+                min_value=data.index.min().date(),
+                max_value=data.index.max().date(),
+                key="withdrawal_end"
+            )
+            st.caption(translations[language]["withdrawal_hint"])
+
+    # ReBalancing
+    rebalance_base_year = initial_date.year + 1
+    rebalance_1_default = datetime(rebalance_base_year, 4, 1)
+    rebalance_2_default = datetime(rebalance_base_year, 10, 1)
+
+    with st.expander(translations[language]["rebalancing"], expanded=False):
+        rebalance_1 = st.checkbox(
+            translations[language]["rebalance_1"],
+            value=st.session_state.get("rebalance_1", True),
+            key="rebalance_1"
+        )
+        rebalance_1_condition = st.checkbox(
+            translations[language]["deviation_condition_1"],
+            value=st.session_state.get("rebalance_1_condition", False),
+            key="rebalance_1_condition"
+        )
+        rebalance_1_threshold = st.number_input(
+            translations[language]["deviation_threshold_1"],
+            min_value=0.0,
+            max_value=100.0,
+            value=st.session_state.get("rebalance_1_threshold", 12.0),
+            step=0.5,
+            key="rebalance_1_threshold"
+        )
+        rebalance_1_start = st.date_input(
+            translations[language]["start_rebalance"] + " 1",
+            value=st.session_state.get("rebalance_1_start", rebalance_1_default.date()),
+            min_value=data.index.min().date(),
+            max_value=data.index.max().date(),
+            key="rebalance_1_start"
         )
-    
-    vat = st.number_input(
-        translations[language]["vat"],
-        value=st.session_state.get("vat", 0.0),
-        key="vat"
-    )
-    
-    # Znajdź indeks dla zapisanego metalu
-    saved_metal = st.session_state.get("storage_metal", "Gold")
-    metal_index = 0
-    if saved_metal in storage_metal_options:
-        metal_index = storage_metal_options.index(saved_metal)
-    
-    storage_metal = st.selectbox(
-        translations[language]["metal_for_costs"],
-        storage_metal_options,
-        index=metal_index,
-        key="storage_metal"
-    )
 
-# Marże i prowizje
-with st.sidebar.expander(translations[language]["margins_fees"], expanded=False):
-    margins = {
-        "Gold": st.number_input(
-            translations[language]["gold_margin"],
-            value=st.session_state.get("margin_Gold", 15.6),
-            key="margin_Gold"
-        ),
-        "Silver": st.number_input(
-            translations[language]["silver_margin"],
-            value=st.session_state.get("margin_Silver", 18.36),
-            key="margin_Silver"
-        ),
-        "Platinum": st.number_input(
-            translations[language]["platinum_margin"],
-            value=st.session_state.get("margin_Platinum", 24.24),
-            key="margin_Platinum"
-        ),
-        "Palladium": st.number_input(
-            translations[language]["palladium_margin"],
-            value=st.session_state.get("margin_Palladium", 22.49),
-            key="margin_Palladium"
+        rebalance_2 = st.checkbox(
+            translations[language]["rebalance_2"],
+            value=st.session_state.get("rebalance_2", False),
+            key="rebalance_2"
+        )
+        rebalance_2_condition = st.checkbox(
+            translations[language]["deviation_condition_2"],
+            value=st.session_state.get("rebalance_2_condition", False),
+            key="rebalance_2_condition"
+        )
+        rebalance_2_threshold = st.number_input(
+            translations[language]["deviation_threshold_2"],
+            min_value=0.0,
+            max_value=100.0,
+            value=st.session_state.get("rebalance_2_threshold", 12.0),
+            step=0.5,
+            key="rebalance_2_threshold"
+        )
+        rebalance_2_start = st.date_input(
+            translations[language]["start_rebalance"] + " 2",
+            value=st.session_state.get("rebalance_2_start", rebalance_2_default.date()),
+            min_value=data.index.min().date(),
+            max_value=data.index.max().date(),
+            key="rebalance_2_start"
         )
-    }
 
-# Ceny odkupu
-with st.sidebar.expander(translations[language]["buyback_prices"], expanded=False):
-    buyback_discounts = {
-        "Gold": st.number_input(
-            translations[language]["gold_buyback"],
-            value=st.session_state.get("buyback_Gold", -1.5),
-            step=0.1,
-            key="buyback_Gold"
-        ),
-        "Silver": st.number_input(
-            translations[language]["silver_buyback"],
-            value=st.session_state.get("buyback_Silver", -3.0),
-            step=0.1,
-            key="buyback_Silver"
-        ),
-        "Platinum": st.number_input(
-            translations[language]["platinum_buyback"],
-            value=st.session_state.get("buyback_Platinum", -3.0),
-            step=0.1,
-            key="buyback_Platinum"
-        ),
-        "Palladium": st.number_input(
-            translations[language]["palladium_buyback"],
-            value=st.session_state.get("buyback_Palladium", -3.0),
-            step=0.1,
-            key="buyback_Palladium"
+    # Koszty magazynowania
+    storage_metal_options = [
+        "Gold", "Silver", "Platinum", "Palladium",
+        translations[language]["best_of_year"],
+        translations[language]["all_metals"]
+    ]
+
+    with st.expander(translations[language]["storage_costs"], expanded=False):
+        # Nowy wybór trybu naliczania
+        storage_fee_mode = st.selectbox(
+            "Tryb naliczania kosztów magazynowania" if language == "Polski" else "Lagerkostenberechnungsmodus",
+            STORAGE_FEE_MODE_LABELS[language],
+            key="storage_fee_mode"
         )
-    }
 
-# Ceny ReBalancingu
-with st.sidebar.expander(translations[language]["rebalance_prices"], expanded=False):
-    rebalance_markup = {
-        "Gold": st.number_input(
-            translations[language]["gold_rebalance"],
-            value=st.session_state.get("rebalance_markup_Gold", 6.5),
-            step=0.1,
-            key="rebalance_markup_Gold"
-        ),
-        "Silver": st.number_input(
-            translations[language]["silver_rebalance"],
-            value=st.session_state.get("rebalance_markup_Silver", 6.5),
-            step=0.1,
-            key="rebalance_markup_Silver"
-        ),
-        "Platinum": st.number_input(
-            translations[language]["platinum_rebalance"],
-            value=st.session_state.get("rebalance_markup_Platinum", 6.5),
-            step=0.1,
-            key="rebalance_markup_Platinum"
-        ),
-        "Palladium": st.number_input(
-            translations[language]["palladium_rebalance"],
-            value=st.session_state.get("rebalance_markup_Palladium", 6.5),
-            step=0.1,
-            key="rebalance_markup_Palladium"
+        # Modyfikuj pole storage_fee w zależności od trybu
+        if storage_fee_mode in ["Rocznie", "Jährlich"]:
+            storage_fee = st.number_input(
+                translations[language]["annual_storage_fee"],
+                value=st.session_state.get("storage_fee", 1.5),
+                step=0.05,
+                key="storage_fee"
+            )
+        else:
+            storage_fee = st.number_input(
+                "Miesięczny koszt magazynowania (%)" if language == "Polski" else "Monatliche Lagerkosten (%)",
+                value=st.session_state.get("storage_fee", 0.05),
+                step=0.005,
+                key="storage_fee"
+            )
+
+        vat = st.number_input(
+            translations[language]["vat"],
+            value=st.session_state.get("vat", 0.0),
+            key="vat"
         )
-    }
 
-# Presety
-with st.sidebar.expander("💾 Presety", expanded=False):
-    preset_name = st.text_input("Nazwa presetu")
-    
-    # Zapisywanie presetu
-    if st.button("Zapisz preset"):
-        preset_data = {
-            "initial_allocation": st.session_state.get("initial_allocation", 100000.0),
-            "initial_date": str(st.session_state.get("initial_date", initial_date)),
-            "end_purchase_date": str(st.session_state.get("end_purchase_date", end_purchase_date)),
-            "allocation": {
-                "Gold": st.session_state.get("alloc_Gold", 40),
-                "Silver": st.session_state.get("alloc_Silver", 20),
-                "Platinum": st.session_state.get("alloc_Platinum", 20),
-                "Palladium": st.session_state.get("alloc_Palladium", 20)
-            },
-            "purchase": {
-                "frequency": st.session_state.get("purchase_freq", translations[language]["month"]),
-                "day": st.session_state.get("purchase_day", 1),
-                "amount": st.session_state.get("purchase_amount", 1000.0)
-            },
-            "rebalance": {
-                "rebalance_1": st.session_state.get("rebalance_1", True),
-                "rebalance_1_condition": st.session_state.get("rebalance_1_condition", False),
-                "rebalance_1_threshold": st.session_state.get("rebalance_1_threshold", 12.0),
-                "rebalance_1_start": str(st.session_state.get("rebalance_1_start", rebalance_1_default.date())),
-                "rebalance_2": st.session_state.get("rebalance_2", False),
-                "rebalance_2_condition": st.session_state.get("rebalance_2_condition", False),
-                "rebalance_2_threshold": st.session_state.get("rebalance_2_threshold", 12.0),
-                "rebalance_2_start": str(st.session_state.get("rebalance_2_start", rebalance_2_default.date()))
-            },
-            "storage": {
-                "fee": st.session_state.get("storage_fee", 1.5),
-                "vat": st.session_state.get("vat", 0.0),
-                "metal": st.session_state.get("storage_metal", "Gold"),
-                "fee_mode": st.session_state.get("storage_fee_mode", "Rocznie")  # NOWY PARAMETR
-            },
-            "margins": {
-                metal: st.session_state.get(f"margin_{metal}", margin)
-                for metal, margin in margins.items()
-            },
-            "buyback": {
-                metal: st.session_state.get(f"buyback_{metal}", discount)
-                for metal, discount in buyback_discounts.items()
-            },
-            "rebalance_markup": {
-                metal: st.session_state.get(f"rebalance_markup_{metal}", markup)
-                for metal, markup in rebalance_markup.items()
-            }
+        # Znajdź indeks dla zapisanego metalu
+        saved_metal = st.session_state.get("storage_metal", "Gold")
+        metal_index = 0
+        if saved_metal in storage_metal_options:
+            metal_index = storage_metal_options.index(saved_metal)
+
+        storage_metal = st.selectbox(
+            translations[language]["metal_for_costs"],
+            storage_metal_options,
+            index=metal_index,
+            key="storage_metal"
+        )
+
+    # Marże i prowizje
+    with st.expander(translations[language]["margins_fees"], expanded=False):
+        margins = {
+            "Gold": st.number_input(
+                translations[language]["gold_margin"],
+                value=st.session_state.get("margin_Gold", 15.6),
+                key="margin_Gold"
+            ),
+            "Silver": st.number_input(
+                translations[language]["silver_margin"],
+                value=st.session_state.get("margin_Silver", 18.36),
+                key="margin_Silver"
+            ),
+            "Platinum": st.number_input(
+                translations[language]["platinum_margin"],
+                value=st.session_state.get("margin_Platinum", 24.24),
+                key="margin_Platinum"
+            ),
+            "Palladium": st.number_input(
+                translations[language]["palladium_margin"],
+                value=st.session_state.get("margin_Palladium", 22.49),
+                key="margin_Palladium"
+            )
         }
-        
-        # ... reszta kodu zapisywania bez zmian ...
-        
-        # Zapisz w session_state
-        st.session_state.saved_presets[preset_name] = preset_data
-        
-        # Próba zapisu do pliku (może nie działać na Streamlit Cloud)
-        try:
-            os.makedirs(PRESET_FOLDER, exist_ok=True)  # Upewnij się że folder istnieje
-            file_path = os.path.join(PRESET_FOLDER, f"{preset_name}.json")
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(preset_data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            # Na Streamlit Cloud może nie działać
-            print(f"Nie udało się zapisać presetu do pliku: {e}")
-        
-        st.success(f"Preset '{preset_name}' został zapisany")
-        
-        # Przycisk pobrania pliku
-        json_str = json.dumps(preset_data, indent=2, ensure_ascii=False)
-        st.download_button("📥 Pobierz preset jako plik JSON", json_str, file_name=f"{preset_name}.json", mime="application/json")
-    
-    # Lista presetów (z session_state i plików)
-    presets_from_files = []
-    if os.path.exists(PRESET_FOLDER):
-        presets_from_files = [f.replace(".json", "") for f in os.listdir(PRESET_FOLDER) if f.endswith(".json")]
-    
-    all_presets = list(set(list(st.session_state.saved_presets.keys()) + presets_from_files))
-    all_presets.sort()
-    
-    col1, col2 = st.columns([3, 1])
-    with col1:
-        selected_preset = st.selectbox("📂 Wczytaj/Usuń preset", options=[""] + all_presets)
-    
-    with col1:
-        if selected_preset and st.button("Wczytaj preset", type="primary"):
-            st.session_state["preset_to_load"] = selected_preset
-            st.rerun()
-    
-    with col2:
-        if selected_preset and st.button("🗑️ Usuń", type="secondary"):
-            # Usuń z session_state
-            if selected_preset in st.session_state.saved_presets:
-                del st.session_state.saved_presets[selected_preset]
-            
-            # Próba usunięcia pliku
-            try:
-                preset_path = os.path.join(PRESET_FOLDER, f"{selected_preset}.json")
-                if os.path.exists(preset_path):
-                    os.remove(preset_path)
-            except:
-                pass  # Ignoruj błędy na Streamlit Cloud
-            
-            st.success(f"Preset '{selected_preset}' został usunięty")
-            st.rerun()
-    
-    # Eksport wszystkich presetów
-    if all_presets:
-        st.markdown("---")
-        if st.button("📦 Pobierz wszystkie presety jako ZIP"):
-            import zipfile
-            import io
-            
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-                # Dodaj presety z session_state
-                for preset_name, preset_data in st.session_state.saved_presets.items():
-                    json_str = json.dumps(preset_data, indent=2, ensure_ascii=False)
-                    zip_file.writestr(f"{preset_name}.json", json_str)
-                
-                # Dodaj presety z plików (jeśli istnieją)
-                if os.path.exists(PRESET_FOLDER):
-                    for preset_file in os.listdir(PRESET_FOLDER):
-                        if preset_file.endswith(".json"):
-                            file_path = os.path.join(PRESET_FOLDER, preset_file)
-                            try:
-                                zip_file.write(file_path, preset_file)
-                            except:
-                                pass
-            
-            zip_buffer.seek(0)
-            st.download_button(
-                label="⬇️ Pobierz archiwum ZIP",
-                data=zip_buffer,
-                file_name="presety_metale.zip",
-                mime="application/zip"
+
+    # Ceny odkupu
+    with st.expander(translations[language]["buyback_prices"], expanded=False):
+        buyback_discounts = {
+            "Gold": st.number_input(
+                translations[language]["gold_buyback"],
+                value=st.session_state.get("buyback_Gold", -1.5),
+                step=0.1,
+                key="buyback_Gold"
+            ),
+            "Silver": st.number_input(
+                translations[language]["silver_buyback"],
+                value=st.session_state.get("buyback_Silver", -3.0),
+                step=0.1,
+                key="buyback_Silver"
+            ),
+            "Platinum": st.number_input(
+                translations[language]["platinum_buyback"],
+                value=st.session_state.get("buyback_Platinum", -3.0),
+                step=0.1,
+                key="buyback_Platinum"
+            ),
+            "Palladium": st.number_input(
+                translations[language]["palladium_buyback"],
+                value=st.session_state.get("buyback_Palladium", -3.0),
+                step=0.1,
+                key="buyback_Palladium"
             )
-    
-    # Informacja o przechowywaniu
-    st.info("💡 Presety są przechowywane w sesji. Na Streamlit Cloud znikną po restarcie aplikacji. Pobierz je jako plik, aby zachować na stałe.")
-    
-    # Import presetów
-    uploaded_file = st.file_uploader("📤 Wczytaj preset z pliku", type=['json'])
-    if uploaded_file is not None:
-        try:
-            preset_data = json.load(uploaded_file)
-            preset_name = uploaded_file.name.replace('.json', '')
+        }
+
+    # Ceny ReBalancingu
+    with st.expander(translations[language]["rebalance_prices"], expanded=False):
+        rebalance_markup = {
+            "Gold": st.number_input(
+                translations[language]["gold_rebalance"],
+                value=st.session_state.get("rebalance_markup_Gold", 6.5),
+                step=0.1,
+                key="rebalance_markup_Gold"
+            ),
+            "Silver": st.number_input(
+                translations[language]["silver_rebalance"],
+                value=st.session_state.get("rebalance_markup_Silver", 6.5),
+                step=0.1,
+                key="rebalance_markup_Silver"
+            ),
+            "Platinum": st.number_input(
+                translations[language]["platinum_rebalance"],
+                value=st.session_state.get("rebalance_markup_Platinum", 6.5),
+                step=0.1,
+                key="rebalance_markup_Platinum"
+            ),
+            "Palladium": st.number_input(
+                translations[language]["palladium_rebalance"],
+                value=st.session_state.get("rebalance_markup_Palladium", 6.5),
+                step=0.1,
+                key="rebalance_markup_Palladium"
+            )
+        }
+
+    # Plan symulacji
+    plan = {
+        "currency": currency,
+        "execution_fix": execution_fix,
+        "initial_allocation": initial_allocation,
+        "initial_date": initial_date,
+        "end_purchase_date": end_purchase_date,
+        "allocation": allocation,
+        "purchase_freq": engine.normalize_frequency(purchase_freq),
+        "purchase_day": purchase_day,
+        "purchase_amount": purchase_amount,
+        "purchase_strategy": purchase_strategy,
+        "strategy_params": strategy_params,
+        "rebalance_1": rebalance_1,
+        "rebalance_1_condition": rebalance_1_condition,
+        "rebalance_1_threshold": rebalance_1_threshold,
+        "rebalance_1_start": rebalance_1_start,
+        "rebalance_2": rebalance_2,
+        "rebalance_2_condition": rebalance_2_condition,
+        "rebalance_2_threshold": rebalance_2_threshold,
+        "rebalance_2_start": rebalance_2_start,
+        "storage_fee": storage_fee,
+        "vat": vat,
+        "storage_metal": engine.normalize_storage_metal(storage_metal),
+        "storage_fee_mode": engine.normalize_fee_mode(storage_fee_mode),
+        "margins": margins,
+        "buyback": buyback_discounts,
+        "rebalance_markup": rebalance_markup,
+        "withdrawal_mode": withdrawal_mode,
+        "withdrawal_amount": float(withdrawal_amount),
+        "withdrawal_indexation": float(withdrawal_indexation),
+        "withdrawal_freq": withdrawal_freq,
+        "withdrawal_day": int(withdrawal_day),
+        "withdrawal_start": withdrawal_start,
+        "withdrawal_end": withdrawal_end
+    }
+
+    return plan
+
+# ====== PRESETY (fragment) ======
+@st.fragment
+def render_presets(plan):
+    """Presety - wpisywanie nazwy, zapis czy eksport nie przeliczają symulacji"""
+    with st.expander("💾 Presety", expanded=False):
+        preset_name = st.text_input("Nazwa presetu")
+
+        # Zapisywanie presetu
+        if st.button("Zapisz preset"):
+            preset_data = {
+                "currency": st.session_state.get("currency", market_data.BASE_CURRENCY),
+                "execution_fix": st.session_state.get("execution_fix", market_data.DAILY_FIX),
+                "initial_allocation": st.session_state.get("initial_allocation", 100000.0),
+                "initial_date": str(st.session_state.get("initial_date", plan["initial_date"])),
+                "end_purchase_date": str(st.session_state.get("end_purchase_date", plan["end_purchase_date"])),
+                "allocation": {
+                    "Gold": st.session_state.get("alloc_Gold", 40),
+                    "Silver": st.session_state.get("alloc_Silver", 20),
+                    "Platinum": st.session_state.get("alloc_Platinum", 20),
+                    "Palladium": st.session_state.get("alloc_Palladium", 20)
+                },
+                "purchase": {
+                    "frequency": st.session_state.get("purchase_freq", translations[language]["month"]),
+                    "day": st.session_state.get("purchase_day", 1),
+                    "amount": st.session_state.get("purchase_amount", 1000.0),
+                    "strategy": plan["purchase_strategy"],
+                    "strategy_params": plan["strategy_params"]
+                },
+                "rebalance": {
+                    "rebalance_1": st.session_state.get("rebalance_1", True),
+                    "rebalance_1_condition": st.session_state.get("rebalance_1_condition", False),
+                    "rebalance_1_threshold": st.session_state.get("rebalance_1_threshold", 12.0),
+                    "rebalance_1_start": str(st.session_state.get("rebalance_1_start", plan["rebalance_1_start"])),
+                    "rebalance_2": st.session_state.get("rebalance_2", False),
+                    "rebalance_2_condition": st.session_state.get("rebalance_2_condition", False),
+                    "rebalance_2_threshold": st.session_state.get("rebalance_2_threshold", 12.0),
+                    "rebalance_2_start": str(st.session_state.get("rebalance_2_start", plan["rebalance_2_start"]))
+                },
+                "storage": {
+                    "fee": st.session_state.get("storage_fee", 1.5),
+                    "vat": st.session_state.get("vat", 0.0),
+                    "metal": st.session_state.get("storage_metal", "Gold"),
+                    "fee_mode": st.session_state.get("storage_fee_mode", "Rocznie")  # NOWY PARAMETR
+                },
+                "margins": {
+                    metal: st.session_state.get(f"margin_{metal}", margin)
+                    for metal, margin in plan["margins"].items()
+                },
+                "buyback": {
+                    metal: st.session_state.get(f"buyback_{metal}", discount)
+                    for metal, discount in plan["buyback"].items()
+                },
+                "rebalance_markup": {
+                    metal: st.session_state.get(f"rebalance_markup_{metal}", markup)
+                    for metal, markup in plan["rebalance_markup"].items()
+                },
+                "withdrawal": {
+                    "mode": plan["withdrawal_mode"],
+                    "amount": plan["withdrawal_amount"],
+                    "indexation": plan["withdrawal_indexation"],
+                    "frequency": plan["withdrawal_freq"],
+                    "day": plan["withdrawal_day"],
+                    "start": str(plan["withdrawal_start"]),
+                    "end": str(plan["withdrawal_end"])
+                }
+            }
+
+            # ... reszta kodu zapisywania bez zmian ...
+
+            # Zapisz w session_state
             st.session_state.saved_presets[preset_name] = preset_data
-            st.success(f"Preset '{preset_name}' został wczytany")
-            st.rerun()
-        except Exception as e:
-            st.error(f"Błąd wczytywania presetu: {e}")
 
-# ====== FUNKCJE POMOCNICZE ======
-def generate_purchase_dates(start_date, freq, day, end_date):
-    dates = []
-    current = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-    
-    if freq == translations[language]["week"]:
-        while current <= end_date:
-            while current.weekday() != day:
-                current += timedelta(days=1)
-                if current > end_date:
-                    break
-            if current <= end_date:
-                dates.append(current)
-            current += timedelta(weeks=1)
-    
-    elif freq == translations[language]["month"]:
-        while current <= end_date:
-            current = current.replace(day=min(day, 28))
-            if current <= end_date:
-                dates.append(current)
-            current += pd.DateOffset(months=1)
-    
-    elif freq == translations[language]["quarter"]:
-        while current <= end_date:
-            current = current.replace(day=min(day, 28))
-            if current <= end_date:
-                dates.append(current)
-            current += pd.DateOffset(months=3)
-    
-    return [data.index[data.index.get_indexer([d], method="nearest")][0] for d in dates if len(data.index.get_indexer([d], method="nearest")) > 0]
+            # Próba zapisu do pliku (może nie działać na Streamlit Cloud)
+            try:
+                os.makedirs(PRESET_FOLDER, exist_ok=True)  # Upewnij się że folder istnieje
+                file_path = os.path.join(PRESET_FOLDER, f"{preset_name}.json")
+                with open(file_path, "w", encoding="utf-8") as f:
+                    json.dump(preset_data, f, indent=2, ensure_ascii=False)
+            except Exception as e:
+                # Na Streamlit Cloud może nie działać
+                print(f"Nie udało się zapisać presetu do pliku: {e}")
+
+            st.success(f"Preset '{preset_name}' został zapisany")
+
+            # Przycisk pobrania pliku
+            json_str = json.dumps(preset_data, indent=2, ensure_ascii=False)
+            st.download_button("📥 Pobierz preset jako plik JSON", json_str, file_name=f"{preset_name}.json", mime="application/json")
+
+        # Lista presetów (z session_state i plików)
+        presets_from_files = []
+        if os.path.exists(PRESET_FOLDER):
+            presets_from_files = [f.replace(".json", "") for f in os.listdir(PRESET_FOLDER) if f.endswith(".json")]
+
+        all_presets = list(set(list(st.session_state.saved_presets.keys()) + presets_from_files))
+        all_presets.sort()
+
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            selected_preset = st.selectbox("📂 Wczytaj/Usuń preset", options=[""] + all_presets)
+
+        with col1:
+            if selected_preset and st.button("Wczytaj preset", type="primary"):
+                st.session_state["preset_to_load"] = selected_preset
+                st.rerun(scope="app")
+
+        with col2:
+            if selected_preset and st.button("🗑️ Usuń", type="secondary"):
+                # Usuń z session_state
+                if selected_preset in st.session_state.saved_presets:
+                    del st.session_state.saved_presets[selected_preset]
+
+                # Próba usunięcia pliku
+                try:
+                    preset_path = os.path.join(PRESET_FOLDER, f"{selected_preset}.json")
+                    if os.path.exists(preset_path):
+                        os.remove(preset_path)
+                except:
+                    pass  # Ignoruj błędy na Streamlit Cloud
+
+                st.success(f"Preset '{selected_preset}' został usunięty")
+                st.rerun(scope="fragment")
+
+        # Eksport wszystkich presetów
+        if all_presets:
+            st.markdown("---")
+            if st.button("📦 Pobierz wszystkie presety jako ZIP"):
+                import zipfile
+                import io
+
+                zip_buffer = io.BytesIO()
+                with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
+                    # Dodaj presety z session_state
+                    for preset_name, preset_data in st.session_state.saved_presets.items():
+                        json_str = json.dumps(preset_data, indent=2, ensure_ascii=False)
+                        zip_file.writestr(f"{preset_name}.json", json_str)
+
+                    # Dodaj presety z plików (jeśli istnieją)
+                    if os.path.exists(PRESET_FOLDER):
+                        for preset_file in os.listdir(PRESET_FOLDER):
+                            if preset_file.endswith(".json"):
+                                file_path = os.path.join(PRESET_FOLDER, preset_file)
+                                try:
+                                    zip_file.write(file_path, preset_file)
+                                except:
+                                    pass
+
+                zip_buffer.seek(0)
+                st.download_button(
+                    label="⬇️ Pobierz archiwum ZIP",
+                    data=zip_buffer,
+                    file_name="presety_metale.zip",
+                    mime="application/zip"
+                )
+
+        # Informacja o przechowywaniu
+        st.info("💡 Presety są przechowywane w sesji. Na Streamlit Cloud znikną po restarcie aplikacji. Pobierz je jako plik, aby zachować na stałe.")
+
+        # Import presetów
+        uploaded_file = st.file_uploader("📤 Wczytaj preset z pliku", type=['json'])
+        if uploaded_file is not None and st.session_state.get("uploaded_preset_id") != uploaded_file.file_id:
+            try:
+                preset_data = json.load(uploaded_file)
+                preset_name = uploaded_file.name.replace('.json', '')
+                st.session_state.saved_presets[preset_name] = preset_data
+                st.session_state["uploaded_preset_id"] = uploaded_file.file_id
+                st.success(f"Preset '{preset_name}' został wczytany")
+                st.rerun(scope="fragment")
+            except Exception as e:
+                st.error(f"Błąd wczytywania presetu: {e}")
 
-def find_best_metal_of_year(start_date, end_date):
-    start_prices = data.loc[start_date]
-    end_prices = data.loc[end_date]
-    growth = {}
-    for metal in ["Gold", "Silver", "Platinum", "Palladium"]:
-        growth[metal] = (end_prices[metal + "_EUR"] / start_prices[metal + "_EUR"]) - 1
-    return max(growth, key=growth.get)
+st.session_state["inputs_full_run"] = True
+with st.sidebar:
+    plan = render_inputs()
 
-def simulate(allocation):
-    portfolio = {m: 0.0 for m in allocation}
-    history = []
-    invested = 0.0
-    
-    all_dates = data.loc[initial_date:end_purchase_date].index
-    purchase_dates = generate_purchase_dates(initial_date, purchase_freq, purchase_day, end_purchase_date)
-    
-    last_rebalance_dates = {
-        "rebalance_1": None,
-        "rebalance_2": None
-    }
-    
-    def apply_rebalance(d, label, condition_enabled, threshold_percent):
-        nonlocal last_rebalance_dates
-        
-        min_days_between_rebalances = 30
-        
-        last_date = last_rebalance_dates.get(label)
-        if last_date is not None and (d - last_date).days < min_days_between_rebalances:
-            return f"rebalancing_skipped_{label}_too_soon"
-        
-        prices = data.loc[d]
-        total_value = sum(prices[m + "_EUR"] * portfolio[m] for m in allocation)
-        
-        if total_value == 0:
-            return f"rebalancing_skipped_{label}_no_value"
-        
-        current_shares = {
-            m: (prices[m + "_EUR"] * portfolio[m]) / total_value
-            for m in allocation
-        }
-        
-        rebalance_trigger = False
-        for metal in allocation:
-            deviation = abs(current_shares[metal] - allocation[metal]) * 100
-            if deviation >= threshold_percent:
-                rebalance_trigger = True
-                break
-        
-        if condition_enabled and not rebalance_trigger:
-            return f"rebalancing_skipped_{label}_no_deviation"
-        
-        target_value = {m: total_value * allocation[m] for m in allocation}
-        
-        for metal in allocation:
-            current_value = prices[metal + "_EUR"] * portfolio[metal]
-            diff = current_value - target_value[metal]
-            
-            if diff > 0:
-                sell_price = prices[metal + "_EUR"] * (1 + buyback_discounts[metal] / 100)
-                grams_to_sell = min(diff / sell_price, portfolio[metal])
-                portfolio[metal] -= grams_to_sell
-                cash = grams_to_sell * sell_price
-                
-                for buy_metal in allocation:
-                    needed_value = target_value[buy_metal] - prices[buy_metal + "_EUR"] * portfolio[buy_metal]
-                    if needed_value > 0:
-                        buy_price = prices[buy_metal + "_EUR"] * (1 + rebalance_markup[buy_metal] / 100)
-                        buy_grams = min(cash / buy_price, needed_value / buy_price)
-                        portfolio[buy_metal] += buy_grams
-                        cash -= buy_grams * buy_price
-                        if cash <= 0:
-                            break
-        
-        last_rebalance_dates[label] = d
-        return label
-    
-    # Początkowy zakup
-    initial_ts = data.index[data.index.get_indexer([pd.to_datetime(initial_date)], method="nearest")][0]
-    prices = data.loc[initial_ts]
-    for metal, percent in allocation.items():
-        price = prices[metal + "_EUR"] * (1 + margins[metal] / 100)
-        grams = (initial_allocation * percent) / price
-        portfolio[metal] += grams
-    invested += initial_allocation
-    history.append((initial_ts, invested, dict(portfolio), "initial"))
-    
-    # Słownik do śledzenia ostatnich dat naliczania kosztów magazynowych
-    last_storage_dates = {}
-    
-    for d in all_dates:
-        actions = []
-        
-        if d in purchase_dates:
-            prices = data.loc[d]
-            for metal, percent in allocation.items():
-                price = prices[metal + "_EUR"] * (1 + margins[metal] / 100)
-                grams = (purchase_amount * percent) / price
-                portfolio[metal] += grams
-            invested += purchase_amount
-            actions.append("recurring")
-        
-        if rebalance_1 and d >= pd.to_datetime(rebalance_1_start) and d.month == rebalance_1_start.month and d.day == rebalance_1_start.day:
-            actions.append(apply_rebalance(d, "rebalance_1", rebalance_1_condition, rebalance_1_threshold))
-        
-        if rebalance_2 and d >= pd.to_datetime(rebalance_2_start) and d.month == rebalance_2_start.month and d.day == rebalance_2_start.day:
-            actions.append(apply_rebalance(d, "rebalance_2", rebalance_2_condition, rebalance_2_threshold))
-        
-        # NOWA LOGIKA KOSZTÓW MAGAZYNOWYCH
-        should_charge_storage = False
-        
-        # Pobierz tryb naliczania z session_state
-        mode = st.session_state.get("storage_fee_mode", "Rocznie")
-        
-        if mode in ["Miesięcznie", "Monatlich"]:
-            # Sprawdź czy to ostatni dzień roboczy miesiąca
-            last_business_day = get_last_business_day_of_month(d)
-            if d.date() == last_business_day.date():
-                # Sprawdź czy nie naliczyliśmy już w tym miesiącu
-                month_key = f"{d.year}-{d.month}"
-                if month_key not in last_storage_dates:
-                    should_charge_storage = True
-                    last_storage_dates[month_key] = d
-        else:  # Rocznie
-            # Sprawdź czy to ostatni dzień roboczy roku
-            if d.month == 12:
-                last_business_day = get_last_business_day_of_year(d.year)
-                if d.date() == last_business_day.date():
-                    # Sprawdź czy nie naliczyliśmy już w tym roku
-                    year_key = str(d.year)
-                    if year_key not in last_storage_dates:
-                        should_charge_storage = True
-                        last_storage_dates[year_key] = d
-        
-        if should_charge_storage:
-            storage_cost = invested * (storage_fee / 100) * (1 + vat / 100)
-            prices = data.loc[d]
-            
-            if storage_metal == translations[language]["best_of_year"]:
-                # Znajdź najlepszy metal z okresu
-                if mode in ["Miesięcznie", "Monatlich"]:
-                    # Dla miesięcznego - najlepszy z miesiąca
-                    month_start = d.replace(day=1)
-                    month_data = data.loc[month_start:d]
-                else:
-                    # Dla rocznego - najlepszy z roku
-                    year_start = pd.Timestamp(d.year, 1, 1)
-                    if year_start < data.index.min():
-                        year_start = data.index.min()
-                    month_data = data.loc[year_start:d]
-                
-                if len(month_data) >= 2:
-                    growth = {}
-                    start_prices = month_data.iloc[0]
-                    end_prices = month_data.iloc[-1]
-                    
-                    for metal in allocation:
-                        if portfolio[metal] > 0:  # Tylko metale które posiadamy
-                            growth[metal] = (end_prices[metal + "_EUR"] / start_prices[metal + "_EUR"]) - 1
-                    
-                    if growth:
-                        metal_to_sell = max(growth, key=growth.get)
-                        sell_price = prices[metal_to_sell + "_EUR"] * (1 + buyback_discounts[metal_to_sell] / 100)
-                        grams_needed = storage_cost / sell_price
-                        grams_needed = min(grams_needed, portfolio[metal_to_sell])
-                        portfolio[metal_to_sell] -= grams_needed
-                
-            elif storage_metal == translations[language]["all_metals"]:
-                total_value = sum(prices[m + "_EUR"] * portfolio[m] for m in allocation)
-                if total_value > 0:
-                    for metal in allocation:
-                        share = (prices[metal + "_EUR"] * portfolio[metal]) / total_value
-                        cash_needed = storage_cost * share
-                        sell_price = prices[metal + "_EUR"] * (1 + buyback_discounts[metal] / 100)
-                        grams_needed = cash_needed / sell_price
-                        grams_needed = min(grams_needed, portfolio[metal])
-                        portfolio[metal] -= grams_needed
-            else:
-                # Konkretny metal
-                if portfolio[storage_metal] > 0:
-                    sell_price = prices[storage_metal + "_EUR"] * (1 + buyback_discounts[storage_metal] / 100)
-                    grams_needed = storage_cost / sell_price
-                    grams_needed = min(grams_needed, portfolio[storage_metal])
-                    portfolio[storage_metal] -= grams_needed
-            
-            actions.append("storage_fee")
-            history.append((d, invested, dict(portfolio), "storage_fee"))
-        
-        if actions and "storage_fee" not in actions:
-            history.append((d, invested, dict(portfolio), ", ".join(actions)))
-    
-    # Tworzenie DataFrame z wynikami
-    df_result = pd.DataFrame([{
-        "Date": h[0],
-        "Invested": h[1],
-        **{m: h[2][m] for m in allocation},
-        "Portfolio Value": sum(
-            data.loc[h[0]][m + "_EUR"] * (1 + buyback_discounts[m] / 100) * h[2][m]
-            for m in allocation
-        ),
-        "Akcja": h[3]
-    } for h in history]).set_index("Date")
-    
-    return df_result
+if plan is None:
+    st.title(translations[language]["app_title"])
+    total = sum(st.session_state[f"alloc_{metal}"] for metal in market_data.METALS)
+    st.error(translations[language]["allocation_error"].format(total))
+    st.stop()
+
+currency = plan["currency"]
+
+with st.sidebar:
+    render_presets(plan)
 
 # ====== GŁÓWNA CZĘŚĆ APLIKACJI ======
 st.title(translations[language]["app_title"])
 st.markdown("---")
 
-# Zawsze uruchamiaj symulację
-result = simulate(allocation)
+@st.fragment(run_every=0.5)
+def show_job_progress(job):
+    """Pasek postępu zadania w tle - po jego zakończeniu przeładowuje stronę z nowym wynikiem"""
+    if job.done():
+        st.rerun()
+    st.progress(job.progress, text=translations[language]["background_running"].format(job.progress * 100))
+    if st.button(translations[language]["cancel_job"]):
+        job.cancel()
+        st.rerun()
+
+def run_simulation_in_background(plan):
+    """Długie symulacje liczone w tle; do czasu zakończenia widoczny jest ostatni gotowy wynik"""
+    key = plan_key(plan, data_version)
+    last_result = st.session_state.get("last_result")
+    if last_result is not None and last_result[0] == key:
+        return last_result[1]
+
+    # Zmiana parametrów anuluje nieaktualne zadanie i uruchamia nowe
+    job = jobs.supersede(st.session_state.get("simulation_job"), key, get_job_runner(), simulation_job, plan, data_version)
+    st.session_state["simulation_job"] = job
+
+    if job.succeeded():
+        st.session_state["last_result"] = (key, job.result(), plan)
+        # Błąd podglądu, który właśnie został zastąpiony dokładnym wynikiem
+        preview = st.session_state.pop("preview", None)
+        if preview is not None and preview[0] == key:
+            error = analytics.preview_error(preview[1], job.result(), market.plan_prices(plan), plan)
+            st.session_state["preview_error"] = (key, error)
+        return job.result()
+
+    if job.cancelled:
+        st.warning(translations[language]["job_cancelled"])
+        if st.button(translations[language]["start_simulation"]):
+            del st.session_state["simulation_job"]
+            st.rerun()
+    elif job.failed():
+        raise job.future.exception()
+    else:
+        show_job_progress(job)
+        # Do czasu zakończenia - przybliżony podgląd nowego planu zamiast poprzedniego wyniku
+        # (podgląd nie liczy wypłat ani strategii zakupów - taki plan pokazuje poprzedni wynik)
+        if engine.preview_supported(plan):
+            preview = run_preview(plan, data_version)
+            st.session_state["preview"] = (key, preview)
+            st.session_state["last_result"] = (key + "#preview", preview, plan)
+            st.caption(translations[language]["preview_result"])
+            return preview
+
+    if last_result is None:
+        st.stop()
+    st.caption(translations[language]["stale_result"])
+    return last_result[1]
+
+def session_memo(name, key, build):
+    """Wyniki pochodne (tabele, dane wykresu) liczone raz na wynik i język w ramach sesji"""
+    memo = st.session_state.setdefault("session_memo", {})
+    if name not in memo or memo[name][0] != key:
+        memo[name] = (key, build())
+    return memo[name][1]
 
+# Wykres
+def build_chart_data(result, plan):
+    result_plot = result.copy()
+    result_plot["Storage Cost"] = 0.0
+
+    storage_costs = result_plot[result_plot["Akcja"] == "storage_fee"].index
+    for d in storage_costs:
+        result_plot.at[d, "Storage Cost"] = result_plot.at[d, "Invested"] * (plan["storage_fee"] / 100) * (1 + plan["vat"] / 100)
+
+    for col in ["Portfolio Value", "Portfolio Value Real", "Invested", "Storage Cost"]:
+        result_plot[col] = pd.to_numeric(result_plot[col], errors="coerce").fillna(0)
+
+    chart_data = result_plot[["Portfolio Value", "Portfolio Value Real", "Invested", "Storage Cost"]]
+
+    chart_data.rename(columns={
+        "Portfolio Value": f"💰 {translations[language]['portfolio_value']}",
+        "Portfolio Value Real": f"🏛️ {translations[language]['real_portfolio_value']}",
+        "Invested": f"💵 {translations[language]['invested']}",
+        "Storage Cost": f"📦 {translations[language]['storage_cost']}"
+    }, inplace=True)
+    return chart_data
+
+def cpi_fallback_note(currency):
+    """Ostrzeżenie, gdy inflacja waluty pochodzi z zastępczego pliku CPI (market_data.cpi_currency)"""
+    cpi = market.cpi_currency(currency)
+    return translations[language]["real_value_cpi_fallback"].format(currency, cpi) if cpi != currency else None
+
+@st.fragment
+def render_chart(result, plan, result_key):
+    chart_data = session_memo("chart_data", (result_key, language), lambda: build_chart_data(result, plan))
+    st.subheader(translations[language]["chart_subtitle"])
+    with profiling.stage("line_chart"):
+        st.line_chart(chart_data)
+    note = cpi_fallback_note(plan["currency"])
+    if note:
+        st.caption(note)
+
+def build_simple_table(result, currency):
+    """Tabela uproszczona (pierwszy dzień każdego roku) jako HTML"""
+    result_filtered = result.groupby(result.index.year).first()
+    result_with_grams = result_filtered.copy()
 
+    for metal in ["Gold", "Silver", "Platinum", "Palladium"]:
+        result_with_grams[metal] = result_with_grams[metal] * TROY_OUNCE_TO_GRAM
+
+    simple_table = pd.DataFrame({
+        translations[language]["invested_eur"].format(currency): result_with_grams["Invested"].round(0),
+        translations[language]["portfolio_value_eur"].format(currency): result_with_grams["Portfolio Value"].round(0),
+        translations[language]["gold_g"]: result_with_grams["Gold"].round(2),
+        translations[language]["silver_g"]: result_with_grams["Silver"].round(2),
+        translations[language]["platinum_g"]: result_with_grams["Platinum"].round(2),
+        translations[language]["palladium_g"]: result_with_grams["Palladium"].round(2),
+        translations[language]["action"]: result_with_grams["Akcja"].apply(translate_action)
+    })
+
+    simple_table[translations[language]["invested_eur"].format(currency)] = simple_table[translations[language]["invested_eur"].format(currency)].map(lambda x: f"{x:,.0f} {currency}")
+    simple_table[translations[language]["portfolio_value_eur"].format(currency)] = simple_table[translations[language]["portfolio_value_eur"].format(currency)].map(lambda x: f"{x:,.0f} {currency}")
+    return simple_table.to_html(index=True, escape=False)
 
-# Korekta wartości portfela o realną inflację
-inflation_dict = dict(zip(inflation_real["Rok"], inflation_real["Inflacja (%)"]))
+# Podsumowanie wyników
+@st.fragment
+def render_summary(result, plan, result_key, prices):
+    currency = plan["currency"]
+    price_cols = dict(zip(market_data.METALS, market_data.price_columns(currency)))
 
-def calculate_cumulative_inflation(start_year, current_year):
-    cumulative_factor = 1.0
-    for year in range(start_year, current_year + 1):
-        inflation = inflation_dict.get(year, 0.0) / 100
-        cumulative_factor *= (1 + inflation)
-    return cumulative_factor
+    st.subheader(translations[language]["summary_title"])
+    start_date = result.index.min()
+    end_date = result.index.max()
+    years = (end_date - start_date).days / 365.25
 
-start_year = result.index.min().year
-real_values = []
+    alokacja_kapitalu = result["Invested"].max()
+    wartosc_metali = result["Portfolio Value"].iloc[-1]
 
-for date in result.index:
-    nominal_value = result.loc[date, "Portfolio Value"]
-    current_year = date.year
-    cumulative_inflation = calculate_cumulative_inflation(start_year, current_year)
-    real_value = nominal_value / cumulative_inflation if cumulative_inflation != 0 else nominal_value
-    real_values.append(real_value)
+    if alokacja_kapitalu > 0 and years > 0:
+        roczny_procent = (wartosc_metali / alokacja_kapitalu) ** (1 / years) - 1
+    else:
+        roczny_procent = 0.0
 
-result["Portfolio Value Real"] = real_values
+    # Wzrost cen metali
+    st.subheader(translations[language]["metal_price_growth"])
 
-# Wykres
-result_plot = result.copy()
-result_plot["Storage Cost"] = 0.0
+    start_prices = prices.loc[start_date]
+    end_prices = prices.loc[end_date]
 
-storage_costs = result_plot[result_plot["Akcja"] == "storage_fee"].index
-for d in storage_costs:
-    result_plot.at[d, "Storage Cost"] = result_plot.at[d, "Invested"] * (storage_fee / 100) * (1 + vat / 100)
+    metale = ["Gold", "Silver", "Platinum", "Palladium"]
+    wzrosty = {}
 
-for col in ["Portfolio Value", "Portfolio Value Real", "Invested", "Storage Cost"]:
-    result_plot[col] = pd.to_numeric(result_plot[col], errors="coerce").fillna(0)
+    for metal in metale:
+        start_price = start_prices[price_cols[metal]]
+        end_price = end_prices[price_cols[metal]]
+        wzrost = (end_price / start_price - 1) * 100
+        wzrosty[metal] = wzrost
 
-chart_data = result_plot[["Portfolio Value", "Portfolio Value Real", "Invested", "Storage Cost"]]
+    # Wyświetlenie
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric(translations[language]["gold"], f"{wzrosty['Gold']:.2f}%")
+    with col2:
+        st.metric(translations[language]["silver"], f"{wzrosty['Silver']:.2f}%")
+    with col3:
+        st.metric(translations[language]["platinum"], f"{wzrosty['Platinum']:.2f}%")
+    with col4:
+        st.metric(translations[language]["palladium"], f"{wzrosty['Palladium']:.2f}%")
+
+    # Ilości metali w gramach
+    st.subheader(translations[language]["current_metal_amounts_g"])
+
+    aktualne_ilosci_uncje = {
+        "Gold": result.iloc[-1]["Gold"],
+        "Silver": result.iloc[-1]["Silver"],
+        "Platinum": result.iloc[-1]["Platinum"],
+        "Palladium": result.iloc[-1]["Palladium"]
+    }
 
-chart_data.rename(columns={
-    "Portfolio Value": f"💰 {translations[language]['portfolio_value']}",
-    "Portfolio Value Real": f"🏛️ {translations[language]['real_portfolio_value']}",
-    "Invested": f"💵 {translations[language]['invested']}",
-    "Storage Cost": f"📦 {translations[language]['storage_cost']}"
-}, inplace=True)
+    aktualne_ilosci_gramy = {
+        metal: ilosc * TROY_OUNCE_TO_GRAM
+        for metal, ilosc in aktualne_ilosci_uncje.items()
+    }
 
-st.subheader(translations[language]["chart_subtitle"])
-st.line_chart(chart_data)
+    kolory_metali = {
+        "Gold": "#D4AF37",
+        "Silver": "#C0C0C0",
+        "Platinum": "#E5E4E2",
+        "Palladium": "#CED0DD"
+    }
 
-# Podsumowanie wyników
-st.subheader(translations[language]["summary_title"])
-start_date = result.index.min()
-end_date = result.index.max()
-years = (end_date - start_date).days / 365.25
+    col1, col2, col3, col4 = st.columns(4)
 
-alokacja_kapitalu = result["Invested"].max()
-wartosc_metali = result["Portfolio Value"].iloc[-1]
+    with col1:
+        st.markdown(f"<h4 style='color:{kolory_metali['Gold']}; text-align: center;'>{translations[language]['gold']}</h4>", unsafe_allow_html=True)
+        st.metric(label="", value=f"{aktualne_ilosci_gramy['Gold']:.2f} {translations[language]['gram']}")
+    with col2:
+        st.markdown(f"<h4 style='color:{kolory_metali['Silver']}; text-align: center;'>{translations[language]['silver']}</h4>", unsafe_allow_html=True)
+        st.metric(label="", value=f"{aktualne_ilosci_gramy['Silver']:.2f} {translations[language]['gram']}")
+    with col3:
+        st.markdown(f"<h4 style='color:{kolory_metali['Platinum']}; text-align: center;'>{translations[language]['platinum']}</h4>", unsafe_allow_html=True)
+        st.metric(label="", value=f"{aktualne_ilosci_gramy['Platinum']:.2f} {translations[language]['gram']}")
+    with col4:
+        st.markdown(f"<h4 style='color:{kolory_metali['Palladium']}; text-align: center;'>{translations[language]['palladium']}</h4>", unsafe_allow_html=True)
+        st.metric(label="", value=f"{aktualne_ilosci_gramy['Palladium']:.2f} {translations[language]['gram']}")
+
+    # Podsumowanie finansowe
+    st.metric(translations[language]["capital_allocation"], f"{alokacja_kapitalu:,.2f} {currency}")
+    st.metric(translations[language]["metals_sale_value"], f"{wartosc_metali:,.2f} {currency}")
+    if "Withdrawn" in result:
+        st.metric(translations[language]["withdrawn_total"], f"{result['Withdrawn'].iloc[-1]:,.2f} {currency}")
+        depleted = result.index[(result["Portfolio Value"] <= 0) & (result["Withdrawn"] > 0)]
+        if len(depleted):
+            st.warning(translations[language]["withdrawal_depleted"].format(depleted[0].date()))
+
+    # Wartość zakupu metali dzisiaj
+    metale = ["Gold", "Silver", "Platinum", "Palladium"]
+    ilosc_metali = {metal: result.iloc[-1][metal] for metal in metale}
+
+    aktualne_ceny_z_marza = {
+        metal: prices.loc[result.index[-1], price_cols[metal]] * (1 + plan["margins"][metal] / 100)
+        for metal in metale
+    }
 
-if alokacja_kapitalu > 0 and years > 0:
-    roczny_procent = (wartosc_metali / alokacja_kapitalu) ** (1 / years) - 1
-else:
-    roczny_procent = 0.0
-
-# Wzrost cen metali
-st.subheader(translations[language]["metal_price_growth"])
-
-start_prices = data.loc[start_date]
-end_prices = data.loc[end_date]
-
-metale = ["Gold", "Silver", "Platinum", "Palladium"]
-wzrosty = {}
-
-for metal in metale:
-    start_price = start_prices[metal + "_EUR"]
-    end_price = end_prices[metal + "_EUR"]
-    wzrost = (end_price / start_price - 1) * 100
-    wzrosty[metal] = wzrost
-
-# Wyświetlenie
-col1, col2, col3, col4 = st.columns(4)
-with col1:
-    st.metric(translations[language]["gold"], f"{wzrosty['Gold']:.2f}%")
-with col2:
-    st.metric(translations[language]["silver"], f"{wzrosty['Silver']:.2f}%")
-with col3:
-    st.metric(translations[language]["platinum"], f"{wzrosty['Platinum']:.2f}%")
-with col4:
-    st.metric(translations[language]["palladium"], f"{wzrosty['Palladium']:.2f}%")
-
-# Ilości metali w gramach
-st.subheader(translations[language]["current_metal_amounts_g"])
-
-aktualne_ilosci_uncje = {
-    "Gold": result.iloc[-1]["Gold"],
-    "Silver": result.iloc[-1]["Silver"],
-    "Platinum": result.iloc[-1]["Platinum"],
-    "Palladium": result.iloc[-1]["Palladium"]
-}
+    wartosc_zakupu_metali = sum(
+        ilosc_metali[metal] * aktualne_ceny_z_marza[metal]
+        for metal in metale
+    )
 
-aktualne_ilosci_gramy = {
-    metal: ilosc * TROY_OUNCE_TO_GRAM
-    for metal, ilosc in aktualne_ilosci_uncje.items()
-}
+    st.metric(translations[language]["metals_purchase_value"], f"{wartosc_zakupu_metali:,.2f} {currency}")
 
-kolory_metali = {
-    "Gold": "#D4AF37",
-    "Silver": "#C0C0C0",
-    "Platinum": "#E5E4E2",
-    "Palladium": "#CED0DD"
-}
+    if wartosc_zakupu_metali > 0:
+        roznica_proc = ((wartosc_zakupu_metali / wartosc_metali) - 1) * 100
+    else:
+        roznica_proc = 0.0
 
-col1, col2, col3, col4 = st.columns(4)
-
-with col1:
-    st.markdown(f"<h4 style='color:{kolory_metali['Gold']}; text-align: center;'>{translations[language]['gold']}</h4>", unsafe_allow_html=True)
-    st.metric(label="", value=f"{aktualne_ilosci_gramy['Gold']:.2f} {translations[language]['gram']}")
-with col2:
-    st.markdown(f"<h4 style='color:{kolory_metali['Silver']}; text-align: center;'>{translations[language]['silver']}</h4>", unsafe_allow_html=True)
-    st.metric(label="", value=f"{aktualne_ilosci_gramy['Silver']:.2f} {translations[language]['gram']}")
-with col3:
-    st.markdown(f"<h4 style='color:{kolory_metali['Platinum']}; text-align: center;'>{translations[language]['platinum']}</h4>", unsafe_allow_html=True)
-    st.metric(label="", value=f"{aktualne_ilosci_gramy['Platinum']:.2f} {translations[language]['gram']}")
-with col4:
-    st.markdown(f"<h4 style='color:{kolory_metali['Palladium']}; text-align: center;'>{translations[language]['palladium']}</h4>", unsafe_allow_html=True)
-    st.metric(label="", value=f"{aktualne_ilosci_gramy['Palladium']:.2f} {translations[language]['gram']}")
-
-# Podsumowanie finansowe
-st.metric(translations[language]["capital_allocation"], f"{alokacja_kapitalu:,.2f} EUR")
-st.metric(translations[language]["metals_sale_value"], f"{wartosc_metali:,.2f} EUR")
-
-# Wartość zakupu metali dzisiaj
-metale = ["Gold", "Silver", "Platinum", "Palladium"]
-ilosc_metali = {metal: result.iloc[-1][metal] for metal in metale}
-
-aktualne_ceny_z_marza = {
-    metal: data.loc[result.index[-1], metal + "_EUR"] * (1 + margins[metal] / 100)
-    for metal in metale
-}
+    st.caption(translations[language]["difference_vs_portfolio"].format(roznica_proc))
 
-wartosc_zakupu_metali = sum(
-    ilosc_metali[metal] * aktualne_ceny_z_marza[metal]
-    for metal in metale
-)
+    # Średni wzrost
+    st.subheader(translations[language]["avg_annual_growth"])
 
-st.metric(translations[language]["metals_purchase_value"], f"{wartosc_zakupu_metali:,.2f} EUR")
+    weighted_start_price = sum(
+        plan["allocation"][metal] * prices.loc[result.index.min()][price_cols[metal]]
+        for metal in ["Gold", "Silver", "Platinum", "Palladium"]
+    )
 
-if wartosc_zakupu_metali > 0:
-    roznica_proc = ((wartosc_zakupu_metali / wartosc_metali) - 1) * 100
-else:
-    roznica_proc = 0.0
+    weighted_end_price = sum(
+        plan["allocation"][metal] * prices.loc[result.index.max()][price_cols[metal]]
+        for metal in ["Gold", "Silver", "Platinum", "Palladium"]
+    )
 
-st.caption(translations[language]["difference_vs_portfolio"].format(roznica_proc))
+    if weighted_start_price > 0 and years > 0:
+        weighted_avg_annual_growth = (weighted_end_price / weighted_start_price) ** (1 / years) - 1
+    else:
+        weighted_avg_annual_growth = 0.0
 
-# Średni wzrost
-st.subheader(translations[language]["avg_annual_growth"])
+    st.metric(translations[language]["weighted_avg_growth"], f"{weighted_avg_annual_growth * 100:.2f}%")
 
-weighted_start_price = sum(
-    allocation[metal] * data.loc[result.index.min()][metal + "_EUR"]
-    for metal in ["Gold", "Silver", "Platinum", "Palladium"]
-)
+    # Tabela uproszczona
+    st.subheader(translations[language]["simplified_view"])
 
-weighted_end_price = sum(
-    allocation[metal] * data.loc[result.index.max()][metal + "_EUR"]
-    for metal in ["Gold", "Silver", "Platinum", "Palladium"]
-)
+    with profiling.stage("simple_table"):
+        simple_table_html = session_memo("simple_table", (result_key, language), lambda: build_simple_table(result, currency))
+    st.markdown(
+        simple_table_html,
+        unsafe_allow_html=True
+    )
+    st.markdown(
+        """<style>
+        table {
+            font-size: 14px;
+        }
+        </style>""",
+        unsafe_allow_html=True
+    )
 
-if weighted_start_price > 0 and years > 0:
-    weighted_avg_annual_growth = (weighted_end_price / weighted_start_price) ** (1 / years) - 1
-else:
-    weighted_avg_annual_growth = 0.0
+# Atrybucja kosztów - warianty kontrfaktyczne w jednym przebiegu wsadowym
+@st.cache_data(max_entries=64)
+def run_fee_attribution(plan, data_version):
+    market = load_market_data(data_version)
+    report = attribution.fee_attribution(market.plan_prices(plan), plan, inflation=market.inflation(plan["currency"]))
+    return {k: v for k, v in report.items() if k != "results"}
+
+@st.fragment
+def render_fee_attribution(plan):
+    currency = plan["currency"]
+    report = run_fee_attribution(plan, data_version)
+    invested = report["invested"]
+
+    rows = [(translations[language]["invested"], invested), (translations[language]["price_return"], report["price_return"])]
+    rows += [(translations[language][f"drag_{c}"], -report["drag"][c]) for c in attribution.COST_COMPONENTS]
+    rows += [(translations[language]["drag_interaction"], -report["interaction"]), (translations[language]["final_value"], report["final_value"])]
+
+    st.subheader(translations[language]["fee_attribution_title"])
+    table = pd.DataFrame([{
+        translations[language]["component"]: label,
+        translations[language]["amount"].format(currency): f"{value:,.0f} {currency}",
+        translations[language]["share_of_invested"]: f"{value / invested * 100:.2f}%" if invested else "-",
+    } for label, value in rows])
+    st.markdown(table.to_html(index=False, escape=False), unsafe_allow_html=True)
+    st.caption(translations[language]["fee_attribution_caption"])
+
+# Porównanie portfeli - plan i warianty porównawcze w jednym przebiegu wsadowym
+COMPARISON_PRESET_PREFIX = "preset:"
+
+@st.cache_data(max_entries=16)
+def run_comparison(plans, data_version):
+    market = load_market_data(data_version)
+    plan = next(iter(plans.values()))
+    report = comparison.compare(market.plan_prices(plan), plans, inflation=market.inflation(plan["currency"]))
+    return {k: v for k, v in report.items() if k != "results"}
+
+def comparison_label(option):
+    if option == "plan":
+        return translations[language]["current_plan"]
+    if option.startswith(COMPARISON_PRESET_PREFIX):
+        return "📁 " + option[len(COMPARISON_PRESET_PREFIX):]
+    if option.startswith(comparison.SINGLE_METAL):
+        metal = option[len(comparison.SINGLE_METAL):]
+        return translations[language]["single_metal"].format(translations[language][metal.lower()])
+    return translations[language][option]
+
+@st.fragment
+def render_comparison(plan):
+    currency = plan["currency"]
+    with st.expander(translations[language]["comparison_title"]):
+        options = comparison.BASELINES + [COMPARISON_PRESET_PREFIX + name for name in sorted(st.session_state.saved_presets)]
+        selection = st.multiselect(translations[language]["comparison_select"], options, format_func=comparison_label, key="comparison_selection")
+        if not selection:
+            st.caption(translations[language]["comparison_hint"])
+            return
+
+        plans = {"plan": plan}
+        for option in selection:
+            if option.startswith(COMPARISON_PRESET_PREFIX):
+                preset = st.session_state.saved_presets[option[len(COMPARISON_PRESET_PREFIX):]]
+                plans[option] = comparison.rebase_plan(engine.plan_from_preset(preset, currency), plan)
+            else:
+                plans[option] = comparison.baseline_plan(data.index, plan, option)
+        report = run_comparison(plans, data_version)
+
+        # Krzywe wyceny i znaczniki pierwszej rozbieżności z bieżącym planem
+        portfolio_col = translations[language]["portfolio"]
+        value_col = translations[language]["portfolio_value"]
+        curves = report["curves"].rename(columns=comparison_label)
+        curves.index.name = "Date"
+        lines = alt.Chart(curves.reset_index().melt("Date", var_name=portfolio_col, value_name=value_col)).mark_line().encode(
+            x=alt.X("Date:T", title=None),
+            y=alt.Y(f"{value_col}:Q"),
+            color=alt.Color(f"{portfolio_col}:N"),
+        )
+        markers = pd.DataFrame([
+            {"Date": date, portfolio_col: comparison_label(name), translations[language]["first_divergence"]: date.strftime("%d.%m.%Y")}
+            for name, date in report["divergence"].items() if date is not None
+        ])
+        chart = lines
+        if not markers.empty:
+            chart = lines + alt.Chart(markers).mark_rule(strokeDash=[4, 4]).encode(
+                x="Date:T",
+                color=alt.Color(f"{portfolio_col}:N"),
+                tooltip=[f"{portfolio_col}:N", f"{translations[language]['first_divergence']}:N"],
+            )
+        st.altair_chart(chart)
+
+        table = report["table"]
+        st.markdown(pd.DataFrame({
+            portfolio_col: [comparison_label(name) for name in table.index],
+            translations[language]["invested"]: table["invested"].map(lambda x: f"{x:,.0f} {currency}"),
+            translations[language]["final_value"]: table["final_value"].map(lambda x: f"{x:,.0f} {currency}"),
+            translations[language]["gain"]: table["gain_pct"].map(lambda x: f"{x:.2f}%"),
+            translations[language]["diff_vs_plan"]: [f"{d:+,.0f} {currency} ({p:+.2f}%)" for d, p in zip(table["diff"], table["diff_pct"])],
+            translations[language]["first_divergence"]: table["first_divergence"].map(lambda d: d.strftime("%d.%m.%Y") if pd.notna(d) else "-"),
+        }).to_html(index=False, escape=False), unsafe_allow_html=True)
+
+# Kroczące starty - ciężka analiza w puli procesów wspólnej dla wszystkich sesji
+# Do tylu scenariuszy analiza ma priorytet interaktywny, większe idą jako zadania wsadowe
+INTERACTIVE_SCENARIOS = 60
+ROLLING_STEPS = ["MS", "QS", "YS"]
+
+@st.cache_resource
+def get_scheduler():
+    return jobs.Scheduler()
+
+def session_id():
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+    return st.session_state["session_id"]
+
+@st.fragment(run_every=1.0)
+def show_scheduled_job(job, name):
+    """Stan zadania z harmonogramu (pozycja w kolejce lub postęp) - po zakończeniu przeładowuje stronę"""
+    if job.done():
+        st.rerun()
+    status = get_scheduler().status(job)
+    if status["state"] == "queued":
+        st.info(translations[language]["job_queued"].format(status["position"], status["waited"]))
+    else:
+        st.progress(status["progress"], text=translations[language][f"{name}_running"].format(status["progress"] * 100))
+    if st.button(translations[language]["cancel_job"], key=f"{name}_cancel"):
+        get_scheduler().cancel(job, session_id())
+        st.rerun()
+
+def rolling_table(results):
+    percentiles = results["annual_quantiles"]["quantiles"]
+    return pd.DataFrame({
+        translations[language]["rolling_percentile"]: [f"P{q * 100:.0f}" for q in percentiles],
+        translations[language]["rolling_annual"]: [f"{v:.2f}%" for v in percentiles.values()],
+        translations[language]["rolling_gain"]: [f"{v:.1f}%" for v in results["gain_quantiles"]["quantiles"].values()],
+    })
+
+@st.fragment
+def render_rolling_study(plan):
+    with st.expander(translations[language]["rolling_title"]):
+        col1, col2 = st.columns(2)
+        years = col1.number_input(translations[language]["rolling_years"], min_value=1, max_value=40, value=10, key="rolling_years")
+        step = col2.selectbox(translations[language]["rolling_step"], ROLLING_STEPS, key="rolling_step",
+                              format_func=lambda s: translations[language][f"rolling_step_{s}"])
+        count = reducers.rolling_start_count(plan, market.prices(plan["currency"]).index, int(years), step)
+        if not count:
+            st.caption(translations[language]["rolling_none"])
+            return
+        priority = jobs.INTERACTIVE if count <= INTERACTIVE_SCENARIOS else jobs.BATCH
+        st.caption(translations[language]["rolling_hint"].format(
+            count, translations[language]["rolling_interactive" if priority == jobs.INTERACTIVE else "rolling_batch"]))
+
+        key = plan_key(plan, data_version) + f"#rolling:{int(years)}:{step}"
+        job = st.session_state.get("rolling_job")
+        if job is None or job.key != key or job.cancelled:
+            if not st.button(translations[language]["rolling_start"], key="rolling_run"):
+                return
+            if job is not None and not job.done():
+                get_scheduler().cancel(job, session_id())
+            try:
+                job = get_scheduler().submit(key, reducers.rolling_start_study, plan, data_version, int(years), step,
+                                             session=session_id(), priority=priority, label="rolling")
+            except jobs.QuotaExceeded:
+                st.warning(translations[language]["rolling_quota"].format(get_scheduler().quota))
+                return
+            st.session_state["rolling_job"] = job
+        if not job.done():
+            show_scheduled_job(job, "rolling")
+            return
+        if job.failed():
+            st.error(translations[language]["rolling_failed"].format(job.future.exception()))
+            return
+
+        results = job.result()
+        stats = results["annual_stats"]
+        st.caption(translations[language]["rolling_summary"].format(results["count"], stats["mean"], stats["std"], stats["min"], stats["max"]))
+        st.markdown(rolling_table(results).to_html(index=False, escape=False), unsafe_allow_html=True)
+        col1, col2 = st.columns(2)
+        for column, name in ((col1, "best"), (col2, "worst")):
+            column.markdown(f"**{translations[language][f'rolling_{name}']}**")
+            column.dataframe(pd.DataFrame({
+                translations[language]["rolling_start_date"]: [item["key"] for item in results[name]],
+                translations[language]["rolling_annual"]: [f"{item['value']:.2f}%" for item in results[name]],
+            }), hide_index=True)
+
+# Szukanie celu - kilka przebiegów silnika (plany bez rebalancingu: model liniowy wspólny z symulacją)
+GOAL_PARAMS = goalseek.AMOUNT_PARAMS + (goalseek.HORIZON_PARAM,)
+
+@st.cache_data(max_entries=64)
+def run_goal_seek(plan, data_version, param, target, real):
+    market = load_market_data(data_version)
+    model = None
+    if param in goalseek.AMOUNT_PARAMS and engine.linear_eligible(plan):
+        model = get_linear_model(engine.linear_model_key(plan), data_version, plan)
+    with profiling.stage("goal_seek"):
+        return goalseek.goal_seek(market.plan_prices(plan), market.inflation(plan["currency"]), plan, param, target, real, model)
+
+@st.fragment
+def render_goal_seek(plan):
+    currency = plan["currency"]
+    with st.expander(translations[language]["goal_title"]):
+        col1, col2, col3 = st.columns(3)
+        target = col1.number_input(translations[language]["goal_target"].format(currency), min_value=0.0, value=1000000.0,
+                                   step=10000.0, key="goal_target")
+        real = col2.radio(translations[language]["goal_basis"], (False, True), horizontal=True, key="goal_real",
+                          format_func=lambda r: translations[language]["goal_real" if r else "goal_nominal"])
+        param = col3.selectbox(translations[language]["goal_param"], GOAL_PARAMS, key="goal_param",
+                               format_func=lambda p: translations[language][f"goal_{p}"])
+        st.caption(translations[language]["goal_hint"])
+        note = cpi_fallback_note(currency) if real else None
+        if note:
+            st.caption(note)
+
+        solution = run_goal_seek(plan, data_version, param, float(target), real)
+        if not solution["reachable"]:
+            st.warning(translations[language]["goal_unreachable"].format(f"{solution['final_value']:,.0f} {currency}"))
+            return
+        value = solution["value"]
+        shown = str(value) if param == goalseek.HORIZON_PARAM else f"{value:,.2f} {currency}"
+        st.success(translations[language]["goal_result"].format(
+            translations[language][f"goal_{param}"], shown, f"{solution['final_value']:,.0f} {currency}"))
+        st.caption(translations[language]["goal_calls"].format(solution["calls"]))
+        if st.button(translations[language]["goal_apply"], key="goal_apply"):
+            st.session_state["widgets_to_apply"] = {param: value}
+            st.rerun(scope="app")
+
+# Bezpieczna stopa wypłat - bisekcja po wszystkich startach naraz, liczona w puli harmonogramu
+@st.fragment
+def render_safe_withdrawal(plan):
+    currency = plan["currency"]
+    with st.expander(translations[language]["swr_title"]):
+        col1, col2 = st.columns(2)
+        years = col1.number_input(translations[language]["swr_years"], min_value=1, max_value=40, value=30, key="swr_years")
+        step = col2.selectbox(translations[language]["rolling_step"], ROLLING_STEPS, key="swr_step",
+                              format_func=lambda s: translations[language][f"rolling_step_{s}"])
+        count = decumulation.start_count(plan, market.prices(plan["currency"]).index, int(years), step)
+        if not count:
+            st.caption(translations[language]["rolling_none"])
+            return
+        mode = plan["withdrawal_mode"] if plan["withdrawal_mode"] in decumulation.SWR_MODES else "fixed"
+        st.caption(translations[language]["swr_hint"].format(
+            count, f"{plan['initial_allocation']:,.0f} {currency}", translations[language][f"withdrawal_mode_{mode}"]))
+        note = cpi_fallback_note(currency) if mode == "indexed" else None
+        if note:
+            st.caption(note)
+
+        key = plan_key(plan, data_version) + f"#swr:{int(years)}:{step}"
+        job = st.session_state.get("swr_job")
+        if job is None or job.key != key or job.cancelled:
+            if not st.button(translations[language]["rolling_start"], key="swr_run"):
+                return
+            if job is not None and not job.done():
+                get_scheduler().cancel(job, session_id())
+            priority = jobs.INTERACTIVE if count <= INTERACTIVE_SCENARIOS else jobs.BATCH
+            try:
+                job = get_scheduler().submit(key, decumulation.safe_withdrawal_study, plan, data_version, int(years), step,
+                                             session=session_id(), priority=priority, label="swr")
+            except jobs.QuotaExceeded:
+                st.warning(translations[language]["rolling_quota"].format(get_scheduler().quota))
+                return
+            st.session_state["swr_job"] = job
+        if not job.done():
+            show_scheduled_job(job, "swr")
+            return
+        if job.failed():
+            st.error(translations[language]["rolling_failed"].format(job.future.exception()))
+            return
+
+        results = job.result()
+        safe_rate = results["safe_rate"]
+        st.success(translations[language]["swr_result"].format(
+            safe_rate, f"{plan['initial_allocation'] * safe_rate / 100:,.0f} {currency}", results["worst_start"]))
+        st.caption(translations[language]["swr_summary"].format(results["count"], results["median_rate"], results["passes"]))
+        capped = int(results["rates"]["capped"].sum())
+        if capped:
+            st.caption(translations[language]["swr_capped"].format(capped, decumulation.MAX_RATE))
+        st.line_chart(results["rates"]["rate"].rename(translations[language]["swr_rate"]))
+        if st.button(translations[language]["swr_apply"], key="swr_apply"):
+            freq = plan["withdrawal_freq"] or "month"
+            st.session_state["widgets_to_apply"] = {
+                "withdrawal_mode": mode,
+                "withdrawal_freq": freq,
+                "withdrawal_amount": round(plan["initial_allocation"] * safe_rate / 100 / engine.PERIODS_PER_YEAR[freq], 2),
+            }
+            st.rerun(scope="app")
+
+# Partie FIFO - pełna symulacja z rejestrem partii, liczona w puli harmonogramu
+TAX_COLUMNS = ["proceeds", "cost", "realized", "realized_taxfree", "realized_taxable", "unrealized", "unrealized_taxfree"]
+
+@st.fragment
+def render_tax_lots(plan):
+    currency = plan["currency"]
+    with st.expander(translations[language]["tax_title"]):
+        st.caption(translations[language]["tax_hint"])
+        key = plan_key(plan, data_version) + "#taxlots"
+        job = st.session_state.get("tax_job")
+        if job is None or job.key != key or job.cancelled:
+            if not st.button(translations[language]["tax_start"], key="tax_run"):
+                return
+            if job is not None and not job.done():
+                get_scheduler().cancel(job, session_id())
+            try:
+                job = get_scheduler().submit(key, taxlots.tax_report, plan, data_version,
+                                             session=session_id(), priority=jobs.INTERACTIVE, label="taxlots")
+            except jobs.QuotaExceeded:
+                st.warning(translations[language]["rolling_quota"].format(get_scheduler().quota))
+                return
+            st.session_state["tax_job"] = job
+        if not job.done():
+            show_scheduled_job(job, "tax")
+            return
+        if job.failed():
+            st.error(translations[language]["tax_failed"].format(job.future.exception()))
+            return
+
+        report = job.result()
+        years = report["years"]
+        table = pd.DataFrame({translations[language]["tax_year"]: years.index.astype(str)})
+        for column in TAX_COLUMNS:
+            table[translations[language][f"tax_{column}"]] = [f"{v:,.0f} {currency}" for v in years[column]]
+        table[translations[language]["tax_taxfree_share"]] = [f"{v:.1f}%" for v in years["taxfree_share"]]
+        st.dataframe(table, hide_index=True)
+
+        sales = report["sales"].reindex(["rebalance", "storage_fee"]).fillna(0.0)
+        st.caption(translations[language]["tax_sales_summary"].format(
+            *(f"{sales.loc[reason, column]:,.0f} {currency}" for reason in sales.index for column in ("proceeds", "gain"))))
+
+# Ryzyko i wyniki - wybór widoku przelicza tylko ten fragment
+@st.fragment
+def render_risk_analytics(result, plan, result_key, prices):
+    analysis = analytics.analyze(result, prices, plan, key=result_key)
+
+    st.subheader(translations[language]["risk_title"])
+    views = [analytics.PORTFOLIO] + market_data.METALS
+    view_labels = [translations[language]["portfolio_view"]] + [translations[language][m.lower()] for m in market_data.METALS]
+    view = st.selectbox(translations[language]["risk_view"], views, format_func=lambda v: view_labels[views.index(v)], key="risk_view")
+    stats = analysis[view]
 
-st.metric(translations[language]["weighted_avg_growth"], f"{weighted_avg_annual_growth * 100:.2f}%")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric(translations[language]["cagr"], f"{stats['cagr'] * 100:.2f}%")
+        st.metric(translations[language]["sharpe"], f"{stats['sharpe']:.2f}")
+    with col2:
+        st.metric(translations[language]["max_drawdown"], f"{stats['max_drawdown'] * 100:.2f}%")
+        st.metric(translations[language]["sortino"], f"{stats['sortino']:.2f}")
+    with col3:
+        st.metric(translations[language]["volatility"], f"{stats['volatility'] * 100:.2f}%")
+        st.metric(translations[language]["time_under_water"], f"{stats['time_under_water_days']} {translations[language]['days']}")
+
+    if stats["rolling"]:
+        st.markdown(f"**{translations[language]['rolling_returns']}**")
+        rolling_table = pd.DataFrame([{
+            translations[language]["window"]: window,
+            "Min": f"{row['min'] * 100:.2f}%",
+            translations[language]["median"]: f"{row['median'] * 100:.2f}%",
+            "Max": f"{row['max'] * 100:.2f}%",
+            translations[language]["negative_share"]: f"{row['share_negative'] * 100:.0f}%",
+            translations[language]["max_rolling_volatility"]: f"{row['max_volatility'] * 100:.2f}%"
+        } for window, row in stats["rolling"].items()])
+        st.markdown(rolling_table.to_html(index=False, escape=False), unsafe_allow_html=True)
+
+    st.markdown(f"**{translations[language]['drawdown_chart']}**")
+    st.area_chart(pd.Series(stats["drawdown"] * 100, index=analysis["dates"], name=translations[language]["drawdown_chart"]))
+
+# Korelacje kroczące - zależą tylko od danych: liczone raz na wersję danych, walutę i okno
+@st.cache_data(max_entries=16)
+def run_rolling_correlations(data_version, currency, window):
+    with profiling.stage("rolling_correlations"):
+        return analytics.rolling_correlations(load_market_data(data_version).prices(currency), window)
+
+def percent_allocation(weights):
+    """Wagi jako całkowite procenty z sumą 100 (metoda największych reszt) - wartości suwaków alokacji"""
+    percents = np.asarray(weights) * 100
+    rounded = np.floor(percents).astype(int)
+    for i in np.argsort(rounded - percents)[:100 - rounded.sum()]:
+        rounded[i] += 1
+    return rounded.tolist()
+
+@st.fragment
+def render_correlations(plan):
+    with st.expander(translations[language]["corr_title"]):
+        windows = list(analytics.CORRELATION_WINDOWS)
+        col1, col2 = st.columns([1, 3])
+        window = col1.selectbox(translations[language]["corr_window"], windows, index=windows.index("1Y"), key="corr_window")
+        report = run_rolling_correlations(data_version, plan["currency"], analytics.CORRELATION_WINDOWS[window])
+        dates = report["dates"]
+        # Wybór okna: ostatnia sesja każdego miesiąca
+        month_ends = pd.Series(dates, index=dates).groupby(dates.to_period("M")).last()
+        options = [d.date() for d in month_ends]
+        end = col2.select_slider(translations[language]["corr_end"], options, value=options[-1], key="corr_end")
+        k = dates.get_loc(pd.Timestamp(end))
+        st.caption(translations[language]["corr_hint"])
+
+        names = [translations[language][m.lower()] for m in market_data.METALS]
+        col1, col2 = st.columns(2)
+        col1.markdown(f"**{translations[language]['corr_matrix']}**")
+        col1.dataframe(pd.DataFrame(report["correlation"][k], index=names, columns=names).style.format("{:.2f}"))
+        col2.markdown(f"**{translations[language]['corr_covariance']}**")
+        col2.dataframe(pd.DataFrame(report["covariance"][k], index=names, columns=names).style.format("{:.4f}"))
+
+        st.markdown(f"**{translations[language]['corr_chart']}**")
+        positions = dates.get_indexer(month_ends)
+        pairs = {f"{names[i]} / {names[j]}": report["correlation"][positions, i, j]
+                 for i in range(len(names)) for j in range(i + 1, len(names))}
+        st.line_chart(pd.DataFrame(pairs, index=month_ends.index.to_timestamp()))
+
+        covariance = report["covariance"][k]
+        percents = percent_allocation(report["min_variance"][k])
+        current = np.array([plan["allocation"].get(m, 0.0) for m in market_data.METALS])
+        st.info(translations[language]["corr_min_variance"].format(
+            ", ".join(f"{name} {p}%" for name, p in zip(names, percents)),
+            report["min_volatility"][k] * 100, np.sqrt(max(current @ covariance @ current, 0.0)) * 100))
+        if st.button(translations[language]["corr_apply"], key="corr_apply"):
+            st.session_state["widgets_to_apply"] = {f"alloc_{m}": p for m, p in zip(market_data.METALS, percents)}
+            st.rerun(scope="app")
 
-# Tabela uproszczona
-st.subheader(translations[language]["simplified_view"])
+# Koszty magazynowania
+@st.fragment
+def render_storage_tables(result, plan):
+    currency = plan["currency"]
+    years = (result.index.max() - result.index.min()).days / 365.25
+
+    # Podsumowanie kosztów magazynowania
+    storage_fees = result[result["Akcja"] == "storage_fee"]
+
+    # Sprawdź czy są jakiekolwiek koszty magazynowania
+    if not storage_fees.empty:
+        # Upewnij się, że pobieramy wartość, a nie Series
+        total_cost_series = storage_fees["Invested"] * (plan["storage_fee"] / 100) * (1 + plan["vat"] / 100)
+        total_storage_cost = total_cost_series.sum()
+    else:
+        total_storage_cost = 0.0
 
-result_filtered = result.groupby(result.index.year).first()
-result_with_grams = result_filtered.copy()
+    if years > 0:
+        avg_annual_storage_cost = total_storage_cost / years
+    else:
+        avg_annual_storage_cost = 0.0
+
+    # Sprawdź czy jest ostatnia data kosztów magazynowania
+    if not storage_fees.empty:
+        last_storage_date = storage_fees.index.max()
+        if pd.notna(last_storage_date):
+            last_invested = result.loc[last_storage_date, "Invested"]
+            last_storage_cost = float(last_invested * (plan["storage_fee"] / 100) * (1 + plan["vat"] / 100))
+        else:
+            last_storage_cost = 0.0
+    else:
+        last_storage_cost = 0.0
 
-for metal in ["Gold", "Silver", "Platinum", "Palladium"]:
-    result_with_grams[metal] = result_with_grams[metal] * TROY_OUNCE_TO_GRAM
+    current_portfolio_value = float(result["Portfolio Value"].iloc[-1])
 
-simple_table = pd.DataFrame({
-    translations[language]["invested_eur"]: result_with_grams["Invested"].round(0),
-    translations[language]["portfolio_value_eur"]: result_with_grams["Portfolio Value"].round(0),
-    translations[language]["gold_g"]: result_with_grams["Gold"].round(2),
-    translations[language]["silver_g"]: result_with_grams["Silver"].round(2),
-    translations[language]["platinum_g"]: result_with_grams["Platinum"].round(2),
-    translations[language]["palladium_g"]: result_with_grams["Palladium"].round(2),
-    translations[language]["action"]: result_with_grams["Akcja"].apply(translate_action)
-})
+    if current_portfolio_value > 0 and last_storage_cost > 0:
+        storage_cost_percentage = (last_storage_cost / current_portfolio_value) * 100
+    else:
+        storage_cost_percentage = 0.0
 
-simple_table[translations[language]["invested_eur"]] = simple_table[translations[language]["invested_eur"]].map(lambda x: f"{x:,.0f} EUR")
-simple_table[translations[language]["portfolio_value_eur"]] = simple_table[translations[language]["portfolio_value_eur"]].map(lambda x: f"{x:,.0f} EUR")
+    st.subheader(translations[language]["storage_costs_summary"])
 
-st.markdown(
-    simple_table.to_html(index=True, escape=False),
-    unsafe_allow_html=True
-)
-st.markdown(
-    """<style>
-    table {
-        font-size: 14px;
-    }
-    </style>""",
-    unsafe_allow_html=True
-)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric(translations[language]["avg_annual_storage_cost"], f"{avg_annual_storage_cost:,.2f} {currency}")
+    with col2:
+        st.metric(translations[language]["storage_cost_percentage"], f"{storage_cost_percentage:.2f}%")
 
-# Podsumowanie kosztów magazynowania
-storage_fees = result[result["Akcja"] == "storage_fee"]
 
-# Sprawdź czy są jakiekolwiek koszty magazynowania
-if not storage_fees.empty:
-    # Upewnij się, że pobieramy wartość, a nie Series
-    total_cost_series = storage_fees["Invested"] * (storage_fee / 100) * (1 + vat / 100)
-    total_storage_cost = total_cost_series.sum()
-else:
-    total_storage_cost = 0.0
 
-if years > 0:
-    avg_annual_storage_cost = total_storage_cost / years
-else:
-    avg_annual_storage_cost = 0.0
-
-# Sprawdź czy jest ostatnia data kosztów magazynowania
-if not storage_fees.empty:
-    last_storage_date = storage_fees.index.max()
-    if pd.notna(last_storage_date):
-        last_invested = result.loc[last_storage_date, "Invested"]
-        last_storage_cost = float(last_invested * (storage_fee / 100) * (1 + vat / 100))
-    else:
-        last_storage_cost = 0.0
-else:
-    last_storage_cost = 0.0
+    # Podsumowanie kosztów magazynowania - NOWA SEKCJA
+    storage_fees = result[result["Akcja"] == "storage_fee"]
 
-current_portfolio_value = float(result["Portfolio Value"].iloc[-1])
+    if not storage_fees.empty:
+        st.subheader("📦 Szczegółowy wykaz kosztów magazynowania")
 
-if current_portfolio_value > 0 and last_storage_cost > 0:
-    storage_cost_percentage = (last_storage_cost / current_portfolio_value) * 100
-else:
-    storage_cost_percentage = 0.0
+        # Przygotuj dane do tabeli
+        storage_details = []
+        for idx, date in enumerate(storage_fees.index):
+            # Oblicz koszt dla tej daty
+            invested_at_date = result.loc[date, "Invested"]
+            storage_cost = invested_at_date * (plan["storage_fee"] / 100) * (1 + plan["vat"] / 100)
 
-st.subheader(translations[language]["storage_costs_summary"])
+            # Określ okres
+            if plan["storage_fee_mode"] == "monthly":
+                period = date.strftime("%B %Y")
+            else:
+                period = f"Rok {date.year}"
+
+            storage_details.append({
+                "Lp.": idx + 1,
+                "Data naliczenia": date.strftime("%d.%m.%Y"),
+                "Dzień tygodnia": date.strftime("%A"),
+                "Okres": period,
+                f"Kwota bazowa ({currency})": f"{invested_at_date:,.2f}",
+                f"Koszt magazynowania ({currency})": f"{storage_cost:,.2f}"
+            })
+
+        # Utwórz DataFrame
+        storage_df = pd.DataFrame(storage_details)
+
+        # Podsumowanie
+        col1, col2, col3 = st.columns(3)
+
+        total_storage_cost = sum(float(row[f"Koszt magazynowania ({currency})"].replace(",", "")) for row in storage_details)
+        avg_storage_cost = total_storage_cost / len(storage_details) if storage_details else 0
+
+        with col1:
+            st.metric(
+                "Tryb naliczania",
+                st.session_state.get("storage_fee_mode", "Rocznie")
+            )
 
-col1, col2 = st.columns(2)
-with col1:
-    st.metric(translations[language]["avg_annual_storage_cost"], f"{avg_annual_storage_cost:,.2f} EUR")
-with col2:
-    st.metric(translations[language]["storage_cost_percentage"], f"{storage_cost_percentage:.2f}%")
+        with col2:
+            st.metric(
+                "Liczba naliczeń",
+                f"{len(storage_details)}"
+            )
 
+        with col3:
+            st.metric(
+                "Suma kosztów magazynowania",
+                f"{total_storage_cost:,.2f} {currency}"
+            )
 
+        # Tabela szczegółowa
+        st.markdown("### Wykaz wszystkich naliczeń")
 
-# Podsumowanie kosztów magazynowania - NOWA SEKCJA
-storage_fees = result[result["Akcja"] == "storage_fee"]
+        # Stylowanie tabeli
+        st.markdown(
+            storage_df.to_html(index=False, escape=False),
+            unsafe_allow_html=True
+        )
 
-if not storage_fees.empty:
-    st.subheader("📦 Szczegółowy wykaz kosztów magazynowania")
-    
-    # Przygotuj dane do tabeli
-    storage_details = []
-    for idx, date in enumerate(storage_fees.index):
-        # Oblicz koszt dla tej daty
-        invested_at_date = result.loc[date, "Invested"]
-        storage_cost = invested_at_date * (storage_fee / 100) * (1 + vat / 100)
-        
-        # Określ okres
-        if st.session_state.get("storage_fee_mode", "Rocznie") in ["Miesięcznie", "Monatlich"]:
-            period = date.strftime("%B %Y")
+        # Informacja o stawce
+        if plan["storage_fee_mode"] == "monthly":
+            st.info(f"💡 Stawka miesięczna: {plan['storage_fee']}% + VAT {plan['vat']}% = {plan['storage_fee'] * (1 + plan['vat']/100):.3f}% efektywnie")
         else:
-            period = f"Rok {date.year}"
-        
-        storage_details.append({
-            "Lp.": idx + 1,
-            "Data naliczenia": date.strftime("%d.%m.%Y"),
-            "Dzień tygodnia": date.strftime("%A"),
-            "Okres": period,
-            "Kwota bazowa (EUR)": f"{invested_at_date:,.2f}",
-            "Koszt magazynowania (EUR)": f"{storage_cost:,.2f}"
-        })
-    
-    # Utwórz DataFrame
-    storage_df = pd.DataFrame(storage_details)
-    
-    # Podsumowanie
+            st.info(f"💡 Stawka roczna: {plan['storage_fee']}% + VAT {plan['vat']}% = {plan['storage_fee'] * (1 + plan['vat']/100):.3f}% efektywnie")
+
+        # Średnie koszty w zależności od trybu
+        if years > 0:
+            if plan["storage_fee_mode"] == "monthly":
+                months = years * 12
+                avg_monthly = total_storage_cost / months if months > 0 else 0
+                st.metric("Średni koszt miesięczny", f"{avg_monthly:,.2f} {currency}")
+            else:
+                avg_yearly = total_storage_cost / years
+                st.metric("Średni koszt roczny", f"{avg_yearly:,.2f} {currency}")
+
+    # Dodaj też informację o trybie w głównym podsumowaniu kosztów
+    st.subheader(translations[language]["storage_costs_summary"])
+
+    # Zmodyfikuj istniejące metryki kosztów magazynowania
     col1, col2, col3 = st.columns(3)
-    
-    total_storage_cost = sum(float(row["Koszt magazynowania (EUR)"].replace(",", "")) for row in storage_details)
-    avg_storage_cost = total_storage_cost / len(storage_details) if storage_details else 0
-    
     with col1:
-        st.metric(
-            "Tryb naliczania",
-            st.session_state.get("storage_fee_mode", "Rocznie")
-        )
-    
+        mode_label = "Tryb naliczania" if language == "Polski" else "Berechnungsmodus"
+        st.metric(mode_label, st.session_state.get("storage_fee_mode", "Rocznie"))
     with col2:
-        st.metric(
-            "Liczba naliczeń",
-            f"{len(storage_details)}"
-        )
-    
+        st.metric(translations[language]["avg_annual_storage_cost"], f"{avg_annual_storage_cost:,.2f} {currency}")
     with col3:
-        st.metric(
-            "Suma kosztów magazynowania",
-            f"{total_storage_cost:,.2f} EUR"
-        )
-    
-    # Tabela szczegółowa
-    st.markdown("### Wykaz wszystkich naliczeń")
-    
-    # Stylowanie tabeli
-    st.markdown(
-        storage_df.to_html(index=False, escape=False),
-        unsafe_allow_html=True
-    )
-    
-    # Informacja o stawce
-    if st.session_state.get("storage_fee_mode", "Rocznie") in ["Miesięcznie", "Monatlich"]:
-        st.info(f"💡 Stawka miesięczna: {storage_fee}% + VAT {vat}% = {storage_fee * (1 + vat/100):.3f}% efektywnie")
-    else:
-        st.info(f"💡 Stawka roczna: {storage_fee}% + VAT {vat}% = {storage_fee * (1 + vat/100):.3f}% efektywnie")
-    
-    # Średnie koszty w zależności od trybu
-    if years > 0:
-        if st.session_state.get("storage_fee_mode", "Rocznie") in ["Miesięcznie", "Monatlich"]:
-            months = years * 12
-            avg_monthly = total_storage_cost / months if months > 0 else 0
-            st.metric("Średni koszt miesięczny", f"{avg_monthly:,.2f} EUR")
-        else:
-            avg_yearly = total_storage_cost / years
-            st.metric("Średni koszt roczny", f"{avg_yearly:,.2f} EUR")
-
-# Dodaj też informację o trybie w głównym podsumowaniu kosztów
-st.subheader(translations[language]["storage_costs_summary"])
-
-# Zmodyfikuj istniejące metryki kosztów magazynowania
-col1, col2, col3 = st.columns(3)
-with col1:
-    mode_label = "Tryb naliczania" if language == "Polski" else "Berechnungsmodus"
-    st.metric(mode_label, st.session_state.get("storage_fee_mode", "Rocznie"))
-with col2:
-    st.metric(translations[language]["avg_annual_storage_cost"], f"{avg_annual_storage_cost:,.2f} EUR")
-with col3:
-    st.metric(translations[language]["storage_cost_percentage"], f"{storage_cost_percentage:.2f}%")
+        st.metric(translations[language]["storage_cost_percentage"], f"{storage_cost_percentage:.2f}%")
+
+# Zawsze uruchamiaj symulację (wynik w pamięci podręcznej per plan, waluta i wersja danych)
+result_key = plan_key(plan, data_version)
+last_result = st.session_state.get("last_result")
+if last_result is not None and last_result[0] == result_key:
+    # Np. zmiana języka - ten sam plan, wynik bez ponownego liczenia
+    result = last_result[1]
+elif engine.linear_eligible(plan):
+    result = run_linear_simulation(plan, data_version)
+    st.session_state["last_result"] = (result_key, result, plan)
+elif engine.estimate_run_cost(data.index, plan) <= HEAVY_RUN_COST:
+    result = run_simulation(plan, data_version)
+    st.session_state["last_result"] = (result_key, result, plan)
+else:
+    result = run_simulation_in_background(plan)
+
+# Wyświetlany wynik może pochodzić z poprzedniego planu (nowy liczy się w tle)
+result_key, result, result_plan = st.session_state["last_result"]
+preview_error = st.session_state.get("preview_error")
+if preview_error is not None and preview_error[0] == result_key:
+    st.caption(translations[language]["preview_error"].format(preview_error[1]["final"] * 100, preview_error[1]["max"] * 100))
+prices = market.plan_prices(result_plan)
+
+with profiling.stage("chart"):
+    render_chart(result, result_plan, result_key)
+with profiling.stage("summary"):
+    render_summary(result, result_plan, result_key, prices)
+with profiling.stage("fee_attribution"):
+    render_fee_attribution(result_plan)
+with profiling.stage("comparison"):
+    render_comparison(result_plan)
+with profiling.stage("goal_seek"):
+    render_goal_seek(result_plan)
+with profiling.stage("safe_withdrawal"):
+    render_safe_withdrawal(result_plan)
+with profiling.stage("rolling_study"):
+    render_rolling_study(result_plan)
+with profiling.stage("tax_lots"):
+    render_tax_lots(result_plan)
+with profiling.stage("risk_analytics"):
+    render_risk_analytics(result, result_plan, result_key, prices)
+with profiling.stage("correlations"):
+    render_correlations(result_plan)
+with profiling.stage("storage_tables"):
+    render_storage_tables(result, result_plan)
+
+# ====== DIAGNOSTYKA (ukryta: ?diagnostics=1, ?profile=1 lub REB_DIAGNOSTICS) ======
+run_recorder.fields.update(currency=result_plan["currency"], run_cost=engine.estimate_run_cost(data.index, plan))
+run_recorder.stop()
+profiling.write_log(run_recorder)
+
+def render_diagnostics(recorder):
+    with st.expander(translations[language]["diagnostics"], expanded=True):
+        st.caption(translations[language]["diagnostics_total"].format(recorder.total * 1000, profiling.log_path()))
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"**{translations[language]['stages']}**")
+            st.dataframe(pd.DataFrame([
+                {"stage": stage, "ms": round(total * 1000, 2), "calls": calls}
+                for stage, (total, calls) in recorder.stages.items()
+            ]), hide_index=True)
+        with col2:
+            st.markdown(f"**{translations[language]['counters']}**")
+            st.dataframe(pd.DataFrame([{"counter": name, "count": n} for name, n in recorder.counters.items()]), hide_index=True)
+
+        if recorder.profile:
+            st.markdown(f"**{translations[language]['profile_top']}**")
+            st.dataframe(pd.DataFrame(recorder.profile), hide_index=True)
+
+        if warmer.warmer_enabled():
+            status = get_cache_warmer().snapshot()
+            st.markdown(f"**{translations[language]['cache_warmer']}**")
+            st.caption(translations[language]["cache_warmer_status"].format(
+                status["state"], status["done"], status["total"], status["version"] or "-", status["current"] or "-"))
+            if status["presets"] or status["errors"]:
+                st.dataframe(pd.DataFrame(
+                    [{"preset": name, "s": seconds, "error": ""} for name, seconds in status["presets"].items()]
+                    + [{"preset": name, "s": None, "error": error} for name, error in status["errors"].items()]
+                ), hide_index=True)
+
+        recent = profiling.read_log(limit=20)
+        if recent:
+            st.markdown(f"**{translations[language]['recent_runs']}**")
+            st.dataframe(pd.DataFrame([
+                {"time": r["time"], "run": r["run"], "total_ms": r["total_ms"], **{s: v["ms"] for s, v in r["stages"].items()}}
+                for r in reversed(recent)
+            ]), hide_index=True)
+
+if profiling.diagnostics_requested(st.query_params):
+    render_diagnostics(run_recorder)
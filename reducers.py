@@ -0,0 +1,309 @@
+# reducers.py
+"""Strumieniowe podsumowania dużych zbiorów scenariuszy (przeglądy parametrów, kroczące starty).
+
+Scenariusze liczone są paczkami przez engine.simulate_batch(final_only=True), a z każdej paczki
+do reduktorów trafiają tylko wskaźniki końcowe - pamięć nie rośnie z liczbą scenariuszy.
+Reduktor ma metody update(values, keys), merge(other) i result().
+"""
+
+import math
+import heapq
+import itertools
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import engine
+import market_data
+
+# Domyślny rozmiar paczki (plany liczone jednym wywołaniem simulate_batch)
+CHUNK_SIZE = 256
+
+# Wskaźniki scenariusza dostępne dla reduktorów
+FIELDS = ("final_value", "invested", "profit", "gain_pct", "annual_return_pct")
+
+
+# ====== REDUKTORY ======
+class RunningStats:
+    """Liczność, średnia, wariancja (Welford / Chan przy łączeniu), minimum i maksimum"""
+
+    def __init__(self, field="final_value"):
+        self.field = field
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values, keys=None):
+        values = np.asarray(values, dtype=float)
+        if len(values):
+            self._combine(len(values), float(values.mean()), float(((values - values.mean()) ** 2).sum()),
+                          float(values.min()), float(values.max()))
+
+    def _combine(self, count, mean, m2, low, high):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def merge(self, other):
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def result(self):
+        variance = self.m2 / (self.count - 1) if self.count > 1 else 0.0
+        return {"count": self.count, "mean": self.mean if self.count else None, "variance": variance,
+                "std": math.sqrt(variance), "min": self.min if self.count else None,
+                "max": self.max if self.count else None}
+
+
+class Histogram:
+    """Histogram o stałych przedziałach (edges) z licznikami wartości poza zakresem"""
+
+    def __init__(self, field="final_value", edges=None, bins=50, range=(0.0, 1e6)):
+        self.field = field
+        self.edges = np.asarray(edges, dtype=float) if edges is not None else np.linspace(range[0], range[1], bins + 1)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.below = 0
+        self.above = 0
+
+    def update(self, values, keys=None):
+        values = np.asarray(values, dtype=float)
+        self.counts += np.histogram(values, bins=self.edges)[0]
+        self.below += int((values < self.edges[0]).sum())
+        self.above += int((values > self.edges[-1]).sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.below += other.below
+        self.above += other.above
+        return self
+
+    def result(self):
+        return {"edges": self.edges.tolist(), "counts": self.counts.tolist(), "below": self.below, "above": self.above}
+
+
+class QuantileSketch:
+    """Percentyle ze szkicu o logarytmicznych koszykach (jak DDSketch).
+
+    Zwracany kwantyl różni się od dokładnego (z tego samego rankingu) o najwyżej
+    relative_accuracy jego wartości bezwzględnej; pamięć zależy od rozpiętości wartości, nie od ich liczby.
+    """
+
+    def __init__(self, field="final_value", quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99),
+                 relative_accuracy=0.005, min_value=1e-9):
+        self.field = field
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zero = 0
+        self.count = 0
+
+    def _add(self, store, values):
+        buckets, counts = np.unique(np.ceil(np.log(values) / self._log_gamma).astype(np.int64), return_counts=True)
+        store.update(dict(zip(buckets.tolist(), counts.tolist())))
+
+    def update(self, values, keys=None):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        positive = values > self.min_value
+        negative = values < -self.min_value
+        self.zero += int(len(values) - positive.sum() - negative.sum())
+        if positive.any():
+            self._add(self.positive, values[positive])
+        if negative.any():
+            self._add(self.negative, -values[negative])
+
+    def merge(self, other):
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zero += other.zero
+        self.count += other.count
+        return self
+
+    def _value(self, bucket):
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self.negative, reverse=True):
+            seen += self.negative[bucket]
+            if seen > rank:
+                return -self._value(bucket)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for bucket in sorted(self.positive):
+            seen += self.positive[bucket]
+            if seen > rank:
+                return self._value(bucket)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+    def result(self):
+        return {"count": self.count, "relative_accuracy": self.relative_accuracy,
+                "quantiles": {q: self.quantile(q) for q in self.quantiles}}
+
+
+class TopK:
+    """k najlepszych (largest=True) lub najgorszych scenariuszy z kluczami"""
+
+    def __init__(self, field="final_value", k=10, largest=True):
+        self.field = field
+        self.k = k
+        self.largest = largest
+        self._heap = []  # (wartość ze znakiem, numer kolejny, klucz) - na szczycie najsłabszy z zachowanych
+        self._counter = itertools.count()
+
+    def update(self, values, keys=None):
+        values = np.asarray(values, dtype=float)
+        if keys is None:
+            keys = [None] * len(values)
+        sign = 1.0 if self.largest else -1.0
+        # Wstępny wybór w paczce - do kopca trafia najwyżej k kandydatów
+        candidates = np.flatnonzero(~np.isnan(values))
+        if len(candidates) > self.k:
+            candidates = candidates[np.argpartition(-sign * values[candidates], self.k - 1)[:self.k]]
+        for i in candidates.tolist():
+            item = (sign * values[i], next(self._counter), keys[i])
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def merge(self, other):
+        sign = 1.0 if self.largest else -1.0
+        for value, _, key in other._heap:
+            self.update([sign * value], [key])
+        return self
+
+    def result(self):
+        sign = 1.0 if self.largest else -1.0
+        return [{"key": key, "value": sign * value} for value, _, key in sorted(self._heap, reverse=True)]
+
+
+# ====== SCENARIUSZE ======
+def sweep(plan, grid):
+    """Przegląd parametrów: (klucz, plan) dla każdej kombinacji wartości z grid (klucz planu -> lista wartości)"""
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield tuple(values), {**plan, **dict(zip(names, values))}
+
+
+def rolling_starts(plan, index, years, step="MS"):
+    """Ten sam plan uruchamiany co step (częstotliwość pandas) z horyzontem zakupów years lat.
+
+    Daty rebalancingu i okres wypłat przesuwane są razem ze startem (engine.shift_plan_dates);
+    starty, dla których plan kończyłby się po ostatniej sesji, są pomijane.
+    """
+    last = index.max()
+    initial = pd.to_datetime(plan["initial_date"])
+    for start in pd.date_range(initial, last, freq=step):
+        end = start + pd.DateOffset(years=years)
+        shifted = {**engine.shift_plan_dates(plan, start.year - initial.year),
+                   "initial_date": start.date(), "end_purchase_date": end.date()}
+        if pd.Timestamp(engine.plan_end(shifted)) > last:
+            break
+        yield start.date().isoformat(), shifted
+
+
+# ====== PRZEBIEG ======
+def scenario_fields(summary, starts):
+    """Wskaźniki końcowe paczki (słownik z simulate_batch(final_only=True), starts - daty początkowe planów)"""
+    invested, value = summary["invested"], summary["value"]
+    ratio = np.where(invested > 0, value / np.where(invested > 0, invested, 1.0), np.nan)
+    years = (summary["date"] - pd.to_datetime(starts)).days.to_numpy() / 365.25
+    with np.errstate(invalid="ignore"):
+        annual = np.where(years > 0, np.power(ratio, 1 / np.where(years > 0, years, 1.0)) - 1, np.nan)
+    return {"final_value": value, "invested": invested, "profit": value - invested,
+            "gain_pct": (ratio - 1) * 100, "annual_return_pct": annual * 100}
+
+
+def _group_key(plan):
+    """Plany liczone jednym simulate_batch: wspólne ceny (PRICE_KEYS) i kolejność metali - daty mogą się różnić"""
+    return tuple(str(plan[key]) for key in engine.PRICE_KEYS) + tuple(plan["allocation"])
+
+
+def reduce_scenarios(data, scenarios, reducers, chunk_size=CHUNK_SIZE, progress=None, dtype=np.float64, inflation=None):
+    """Przelicza scenariusze ((klucz, plan) lub same plany) i składa wskaźniki w reduktorach.
+
+    Plany o wspólnej walucie i cenie wykonania zbierane są w paczki po chunk_size; gdy oczekujących
+    planów jest więcej niż chunk_size, liczona jest największa grupa. W pamięci jest więc najwyżej
+    chunk_size planów naraz. dtype=np.float32 - paczki liczone w pojedynczej precyzji (błąd:
+    engine.float32_error_bound). inflation - tabela inflacji waluty planów (indeksacja wypłat).
+    Zwraca {nazwa: reduktor.result()} oraz liczbę scenariuszy.
+    """
+    for name, reducer in reducers.items():
+        if reducer.field not in FIELDS:
+            raise ValueError(f"Reduktor {name}: nieznany wskaźnik {reducer.field} (dostępne: {', '.join(FIELDS)})")
+    pending = {}
+    state = {"pending": 0, "done": 0}
+
+    def flush(group):
+        items = pending.pop(group)
+        state["pending"] -= len(items)
+        summary = engine.simulate_batch(data, [plan for _, plan in items], final_only=True, dtype=dtype,
+                                        inflation=inflation)
+        fields = scenario_fields(summary, [plan["initial_date"] for _, plan in items])
+        keys = [key for key, _ in items]
+        for reducer in reducers.values():
+            reducer.update(fields[reducer.field], keys)
+        state["done"] += len(items)
+        if progress is not None:
+            progress(state["done"])
+
+    for n, scenario in enumerate(scenarios):
+        key, plan = scenario if isinstance(scenario, tuple) else (n, scenario)
+        group = _group_key(plan)
+        pending.setdefault(group, []).append((key, plan))
+        state["pending"] += 1
+        if len(pending[group]) >= chunk_size:
+            flush(group)
+        elif state["pending"] > chunk_size:
+            flush(max(pending, key=lambda g: len(pending[g])))
+    for group in list(pending):
+        flush(group)
+    return {name: reducer.result() for name, reducer in reducers.items()}, state["done"]
+
+
+# ====== ANALIZY W TLE ======
+def rolling_start_count(plan, index, years, step="MS"):
+    """Liczba scenariuszy rolling_starts (do wyboru priorytetu zadania)"""
+    return sum(1 for _ in rolling_starts(plan, index, years, step))
+
+
+def rolling_start_study(plan, data_version, years, step="MS", progress=None):
+    """Rozkład wyników planu uruchamianego co step z horyzontem years lat (zadanie dla jobs.Scheduler).
+
+    Dane wczytywane są w procesie roboczym (market_data.shared_market_data), więc do procesu trafia
+    tylko plan. progress dostaje ułamek przeliczonych scenariuszy.
+    """
+    market = market_data.shared_market_data(data_version)
+    data = market.plan_prices(plan)
+    total = max(rolling_start_count(plan, data.index, years, step), 1)
+    reducers = {
+        "annual_stats": RunningStats("annual_return_pct"),
+        "annual_quantiles": QuantileSketch("annual_return_pct", quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)),
+        "gain_quantiles": QuantileSketch("gain_pct", quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)),
+        "best": TopK("annual_return_pct", k=5, largest=True),
+        "worst": TopK("annual_return_pct", k=5, largest=False),
+    }
+    if progress is not None:
+        progress(0.0)
+    report = (lambda done: progress(done / total)) if progress is not None else None
+    results, count = reduce_scenarios(data, rolling_starts(plan, data.index, years, step), reducers,
+                                      chunk_size=64, progress=report, inflation=market.inflation(plan["currency"]))
+    return {**results, "count": count, "years": years, "step": step}
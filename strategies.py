@@ -0,0 +1,207 @@
+# strategies.py
+"""Strategie zakupów cyklicznych: ile waluty i w które metale trafia w każdym terminie zakupu.
+
+Strategia tworzona jest raz na przebieg silnika dla planów, które ją stosują (tablice weights, margin,
+buyback mają wiersz na plan, prices i days - wszystkie sesje; sell_prices - ceny sprzedaży i wyceny, gdy
+cena wykonania ma je osobno). Metoda amounts() dostaje cały odcinek
+dni, w którym zachodzą tylko zakupy (simulate_batch) albo jeden dzień (simulate), i zwraca kwoty
+(plany x dni x metale) oraz wydatek (plany x dni, dopisywany do "Invested"). Silnik zamienia kwoty na
+uncje po cenie z marżą i dodaje je dzień po dniu - strategia zależna od stanu portfela liczy ten sam
+stan u siebie, więc wynik nie zależy od podziału na odcinki.
+
+    python strategies.py --plans 64 --years 20
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import engine
+import market_data
+
+
+# ====== STRATEGIE ======
+class FixedAmount:
+    """purchase_amount dzielone wagami alokacji (dotychczasowe zachowanie silnika)"""
+
+    defaults = {}
+
+    def __init__(self, plans, prices, days, weights, margin, buyback, sell_prices=None):
+        self.plans = plans
+        self.prices = prices
+        self.sell_prices = prices if sell_prices is None else sell_prices
+        self.days = days
+        self.weights = weights
+        self.margin = margin
+        self.buyback = buyback
+        self.amount = np.array([float(plan["purchase_amount"]) for plan in plans])
+
+    def param(self, name):
+        """Parametr strategii (strategy_params planu albo wartość domyślna) dla każdego planu"""
+        return np.array([float(plan.get("strategy_params", {}).get(name, self.defaults[name])) for plan in self.plans])
+
+    def amounts(self, rows, positions, buys, holdings, invested, numbers):
+        """rows - plany (indeksy w self.plans), positions - sesje odcinka, buys - maska zakupów (plany x dni),
+        holdings/invested - stan przed odcinkiem, numbers - numer kolejnego zakupu planu (plany x dni)"""
+        spent = np.where(buys, self.amount[rows, np.newaxis], 0.0)
+        return spent[:, :, np.newaxis] * self.weights[rows, np.newaxis, :], spent
+
+
+class BuyTheDip(FixedAmount):
+    """Kwota na metal razy boost, gdy jego cena jest co najmniej drop % poniżej maksimum z lookback sesji"""
+
+    defaults = {"drop": 10.0, "boost": 2.0, "lookback": 250}
+
+    def __init__(self, plans, prices, days, weights, margin, buyback, sell_prices=None):
+        super().__init__(plans, prices, days, weights, margin, buyback, sell_prices)
+        self.boost = self.param("boost")
+        self.threshold = 1 - self.param("drop") / 100
+        self.lookback = self.param("lookback").astype(int)
+        # Kroczące maksimum cen - raz na długość okna
+        self.highs = {n: pd.DataFrame(prices).rolling(max(n, 1), min_periods=1).max().to_numpy() for n in set(self.lookback)}
+
+    def amounts(self, rows, positions, buys, holdings, invested, numbers):
+        high = np.stack([self.highs[self.lookback[k]][positions] for k in rows])
+        dip = self.prices[positions] <= self.threshold[rows, np.newaxis, np.newaxis] * high
+        factor = np.where(dip, self.boost[rows, np.newaxis, np.newaxis], 1.0)
+        amounts = np.where(buys[:, :, np.newaxis], self.amount[rows, np.newaxis, np.newaxis] * self.weights[rows, np.newaxis, :] * factor, 0.0)
+        spent = amounts[:, :, 0]
+        for j in range(1, amounts.shape[2]):
+            spent = spent + amounts[:, :, j]
+        return amounts, spent
+
+
+class ValueAveraging(FixedAmount):
+    """Uzupełnianie wartości portfela (po cenie odkupu) do ścieżki docelowej.
+
+    Cel po n-tym zakupie: (initial_allocation + n * purchase_amount) * (1 + growth %) ^ lata od startu.
+    Zakup między 0 (bez sprzedaży) a max_multiple * purchase_amount, dzielony wagami alokacji.
+    """
+
+    defaults = {"growth": 0.0, "max_multiple": 3.0}
+
+    def __init__(self, plans, prices, days, weights, margin, buyback, sell_prices=None):
+        super().__init__(plans, prices, days, weights, margin, buyback, sell_prices)
+        self.base = np.array([float(plan["initial_allocation"]) for plan in plans])
+        self.growth = 1 + self.param("growth") / 100
+        self.cap = self.param("max_multiple") * self.amount
+        self.start = np.array([np.datetime64(pd.Timestamp(plan["initial_date"]).date(), "D") for plan in plans])
+
+    def amounts(self, rows, positions, buys, holdings, invested, numbers):
+        weights, margin, buyback = self.weights[rows], self.margin[rows], self.buyback[rows]
+        holdings = holdings.copy()
+        amounts = np.zeros(buys.shape + (weights.shape[1],))
+        spent = np.zeros(buys.shape)
+        for t in np.flatnonzero(buys.any(axis=0)):
+            day_prices = self.prices[positions[t]]
+            values = self.sell_prices[positions[t]] * buyback * holdings
+            value = values[:, 0]
+            for j in range(1, values.shape[1]):
+                value = value + values[:, j]
+            years = (self.days[positions[t]] - self.start[rows]).astype(np.int64) / 365.25
+            target = (self.base[rows] + numbers[:, t] * self.amount[rows]) * self.growth[rows] ** years
+            spent[:, t] = np.where(buys[:, t], np.clip(target - value, 0.0, self.cap[rows]), 0.0)
+            amounts[:, t] = spent[:, t, np.newaxis] * weights
+            holdings = holdings + amounts[:, t] / (day_prices * margin)
+        return amounts, spent
+
+
+class ContributionRebalance(FixedAmount):
+    """Nowa wpłata trafia do metali poniżej docelowego udziału (bez sprzedaży), proporcjonalnie do niedoboru.
+
+    Niedobór metalu: max(waga * (wartość + wpłata) - wartość metalu, 0) przy cenach bez kosztów,
+    jak w rebalancingu; przy portfelu w proporcjach wpłata dzielona jest wagami alokacji.
+    """
+
+    def amounts(self, rows, positions, buys, holdings, invested, numbers):
+        weights, margin = self.weights[rows], self.margin[rows]
+        holdings = holdings.copy()
+        amounts = np.zeros(buys.shape + (weights.shape[1],))
+        spent = np.where(buys, self.amount[rows, np.newaxis], 0.0)
+        for t in np.flatnonzero(buys.any(axis=0)):
+            day_prices = self.prices[positions[t]]
+            values = self.sell_prices[positions[t]] * holdings
+            total = values[:, 0]
+            for j in range(1, values.shape[1]):
+                total = total + values[:, j]
+            deficit = np.maximum(weights * (total + spent[:, t])[:, np.newaxis] - values, 0.0)
+            deficit_sum = deficit.sum(axis=1)
+            share = np.divide(deficit, deficit_sum[:, np.newaxis], out=np.zeros_like(deficit),
+                              where=deficit_sum[:, np.newaxis] > 0)
+            amounts[:, t] = spent[:, t, np.newaxis] * share
+            holdings = holdings + amounts[:, t] / (day_prices * margin)
+        return amounts, spent
+
+
+STRATEGIES = {
+    "fixed": FixedAmount,
+    "value_averaging": ValueAveraging,
+    "buy_the_dip": BuyTheDip,
+    "contribution_rebalance": ContributionRebalance,
+}
+
+
+def strategy_name(plan):
+    """Kod strategii planu (plany bez klucza purchase_strategy - "fixed")"""
+    name = plan.get("purchase_strategy") or "fixed"
+    if name not in STRATEGIES:
+        raise ValueError(f"nieznana strategia zakupów: {name}")
+    return name
+
+
+def is_fixed(plan):
+    return strategy_name(plan) == "fixed"
+
+
+def build(plans, prices, days, weights, margin, buyback, sell_prices=None):
+    """Strategie przebiegu: lista (strategia, indeksy jej planów) - plany pogrupowane po kodzie strategii"""
+    groups = {}
+    for k, plan in enumerate(plans):
+        groups.setdefault(strategy_name(plan), []).append(k)
+    return [(STRATEGIES[name]([plans[k] for k in members], prices, days, weights[members], margin[members], buyback[members],
+                              sell_prices), np.array(members)) for name, members in groups.items()]
+
+
+# ====== POMIAR PRZEPUSTOWOŚCI ======
+def benchmark(data, plan, n_plans, repeats=3):
+    """Plany/s simulate_batch (final_only) dla każdej strategii: n_plans wariantów kwoty planu, najlepszy z repeats"""
+    rows = []
+    for name in STRATEGIES:
+        plans = [{**plan, "purchase_strategy": name, "purchase_amount": plan["purchase_amount"] * (1 + k / n_plans)}
+                 for k in range(n_plans)]
+        best = float("inf")
+        for _ in range(repeats):
+            started = time.perf_counter()
+            engine.simulate_batch(data, plans, final_only=True)
+            best = min(best, time.perf_counter() - started)
+        rows.append({"strategy": name, "seconds": best, "plans_per_s": n_plans / best})
+    frame = pd.DataFrame(rows).set_index("strategy")
+    frame["vs_fixed"] = frame["plans_per_s"] / frame.loc["fixed", "plans_per_s"]
+    return frame
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Przepustowość silnika dla strategii zakupów względem stałej kwoty")
+    parser.add_argument("--preset", default="SSW-250609", help="preset planu (nazwa pliku w presets/ bez .json)")
+    parser.add_argument("--plans", type=int, default=64, help="plany w jednym przebiegu simulate_batch")
+    parser.add_argument("--years", type=int, default=20, help="długość okresu zakupów (lata do końca danych)")
+    parser.add_argument("--freq", default="week", choices=["week", "month", "quarter"])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    import bulk
+    market = market_data.shared_market_data()
+    plan = bulk.load_template(args.preset)
+    end = market.index.max().date()
+    plan = {**plan, "initial_date": (market.index.max() - pd.DateOffset(years=args.years)).date(), "end_purchase_date": end,
+            "purchase_freq": args.freq, "purchase_day": 1 if args.freq == "week" else plan["purchase_day"]}
+    frame = benchmark(market.plan_prices(plan), plan, args.plans, args.repeats)
+    print(frame.to_string(float_format=lambda x: f"{x:,.3f}"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+# taxlots.py
+"""Partie zakupowe (FIFO) dla zysków zrealizowanych i zwolnienia po roku posiadania.
+
+engine.simulate(..., lots=TaxLedger()) zgłasza każdy zakup (początkowy, cykliczny, dokupienie przy
+rebalancingu) i każdą sprzedaż (rebalancing, opłata magazynowa). Partie jednego metalu leżą w kolejce
+bloków - ciągłych tablic z narastającą ilością i kosztem - więc sprzedaż części pozycji to wyszukiwanie
+binarne w bloku czołowym, a nie przeglądanie tysięcy tygodniowych partii.
+Ilości są w jednostkach silnika (uncje trojańskie), kwoty w walucie planu.
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import engine
+import market_data
+from market_data import METALS
+
+# Ile partii trafia do jednego bloku (dopisywane są do bufora, blok powstaje po jego zapełnieniu)
+BLOCK_SIZE = 256
+
+# Okres posiadania, po którym sprzedaż jest wolna od podatku (DE: § 23 EStG - ponad rok)
+HOLDING_PERIOD = pd.DateOffset(years=1)
+
+# Względna reszta partii traktowana jako zero (szum zmiennoprzecinkowy przy sprzedaży całości)
+EPSILON = 1e-12
+
+
+def _day(date):
+    return np.datetime64(pd.Timestamp(date).date(), "D")
+
+
+class _Block:
+    """Ciągły fragment kolejki: daty, ceny jednostkowe oraz narastająca ilość i koszt"""
+
+    def __init__(self, dates, amounts, unit_costs):
+        self.dates = np.array(dates, dtype="datetime64[D]")
+        self.unit_costs = np.asarray(unit_costs, dtype=float)
+        self.cum_amount = np.cumsum(amounts, dtype=float)
+        self.cum_cost = np.cumsum(np.asarray(amounts, dtype=float) * self.unit_costs)
+        self.consumed = 0.0  # ilość sprzedana już z początku bloku
+
+    @property
+    def total(self):
+        return self.cum_amount[-1]
+
+    def cost_at(self, position):
+        """Koszt pierwszych position jednostek bloku (narastająco)"""
+        i = int(np.searchsorted(self.cum_amount, position, side="left"))
+        if i >= len(self.cum_amount):
+            return self.cum_cost[-1]
+        before_amount = self.cum_amount[i - 1] if i else 0.0
+        before_cost = self.cum_cost[i - 1] if i else 0.0
+        return before_cost + (position - before_amount) * self.unit_costs[i]
+
+    def aged_position(self, cutoff):
+        """Narastająca ilość partii kupionych przed cutoff"""
+        k = int(np.searchsorted(self.dates, cutoff, side="left"))
+        return self.cum_amount[k - 1] if k else 0.0
+
+
+class LotQueue:
+    """Partie jednego metalu w kolejności zakupu"""
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.blocks = deque()
+        self._dates, self._amounts, self._costs = [], [], []
+
+    def add(self, date, amount, unit_cost):
+        if amount <= 0:
+            return
+        self._dates.append(_day(date))
+        self._amounts.append(amount)
+        self._costs.append(unit_cost)
+        if len(self._dates) >= self.block_size:
+            self._seal()
+
+    def _seal(self):
+        if self._dates:
+            self.blocks.append(_Block(self._dates, self._amounts, self._costs))
+            self._dates, self._amounts, self._costs = [], [], []
+
+    def remove(self, amount, cutoff):
+        """Sprzedaż amount z najstarszych partii: (ilość, koszt, ilość wolna od podatku, jej koszt).
+
+        Wolne od podatku są partie kupione przed cutoff (data sprzedaży minus okres posiadania).
+        """
+        sold = cost = free_amount = free_cost = 0.0
+        while amount > 0:
+            if not self.blocks:
+                self._seal()
+                if not self.blocks:
+                    break
+            block = self.blocks[0]
+            start = block.consumed
+            end = start + amount
+            if end >= block.total * (1 - EPSILON):
+                # Reszta bloku (z szumem zmiennoprzecinkowym) - pozostała ilość z kolejnego bloku
+                end = block.total
+                amount -= end - start
+                self.blocks.popleft()
+            else:
+                amount = 0.0
+            start_cost, end_cost = block.cost_at(start), block.cost_at(end)
+            cost += end_cost - start_cost
+            aged = min(block.aged_position(cutoff), end)
+            if aged > start:
+                free_amount += aged - start
+                free_cost += block.cost_at(aged) - start_cost
+            sold += end - start
+            block.consumed = end
+        return sold, cost, free_amount, free_cost
+
+    def position(self, cutoff):
+        """Otwarte partie: (ilość, koszt, ilość kupiona przed cutoff, jej koszt)"""
+        self._seal()
+        amount = cost = aged_amount = aged_cost = 0.0
+        for block in self.blocks:
+            start, start_cost = block.consumed, block.cost_at(block.consumed)
+            amount += block.total - start
+            cost += block.cum_cost[-1] - start_cost
+            aged = block.aged_position(cutoff)
+            if aged > start:
+                aged_amount += aged - start
+                aged_cost += block.cost_at(aged) - start_cost
+        return amount, cost, aged_amount, aged_cost
+
+
+class TaxLedger:
+    """Rejestr partii i sprzedaży wypełniany przez engine.simulate(..., lots=...)"""
+
+    def __init__(self, metals=METALS, block_size=BLOCK_SIZE):
+        self.queues = {m: LotQueue(block_size) for m in metals}
+        self.sales = []
+        self.year_ends = {}  # rok -> {metal: (ilość, koszt, ilość > 1 rok, jej koszt)} na 31.12
+        self._year = None
+
+    def _advance(self, date):
+        """Stan partii na koniec każdego zamkniętego roku (przed pierwszym zdarzeniem nowego roku)"""
+        if self._year is None:
+            self._year = date.year
+        while date.year > self._year:
+            self.year_ends[self._year] = self.positions(pd.Timestamp(self._year, 12, 31))
+            self._year += 1
+
+    def buy(self, date, metal, amount, unit_cost):
+        self._advance(date)
+        self.queues[metal].add(date, amount, unit_cost)
+
+    def sell(self, date, metal, amount, unit_price, reason):
+        self._advance(date)
+        sold, cost, free_amount, free_cost = self.queues[metal].remove(amount, _day(pd.Timestamp(date) - HOLDING_PERIOD))
+        self.sales.append((pd.Timestamp(date), metal, reason, sold, sold * unit_price, cost,
+                           free_amount, free_amount * unit_price, free_cost))
+
+    def close(self, date):
+        """Domyka lata do date włącznie (stan na 31.12) i zwraca stan partii na ten dzień"""
+        self._advance(date)
+        return self.positions(date)
+
+    def positions(self, date):
+        cutoff = _day(pd.Timestamp(date) - HOLDING_PERIOD)
+        return {m: queue.position(cutoff) for m, queue in self.queues.items()}
+
+    def sales_frame(self):
+        columns = ["Date", "metal", "reason", "amount", "proceeds", "cost", "taxfree_amount", "taxfree_proceeds", "taxfree_cost"]
+        sales = pd.DataFrame(self.sales, columns=columns)
+        # Bez sprzedaży kolumna dat też ma typ datetime64 (filtry po .dt w raportach)
+        sales["Date"] = pd.to_datetime(sales["Date"])
+        sales[columns[3:]] = sales[columns[3:]].astype(float)
+        sales["gain"] = sales["proceeds"] - sales["cost"]
+        sales["taxfree_gain"] = sales["taxfree_proceeds"] - sales["taxfree_cost"]
+        return sales
+
+
+def tax_lots(data, plan, progress=None, inflation=None):
+    """Symulacja z rejestrem partii: (wynik engine.simulate, TaxLedger)"""
+    ledger = TaxLedger(metals=list(plan["allocation"]))
+    result = engine.simulate(data, plan, progress=progress, lots=ledger, inflation=inflation)
+    return result, ledger
+
+
+def yearly_report(data, plan, ledger):
+    """Zyski zrealizowane i niezrealizowane w podziale na lata.
+
+    Kolumny: proceeds, cost, realized (zysk ze sprzedaży), realized_taxfree (z partii trzymanych ponad rok),
+    realized_taxable, unrealized (wycena po cenie odkupu na ostatnią sesję roku minus koszt otwartych partii),
+    unrealized_taxfree (część z partii trzymanych na koniec roku ponad rok), taxfree_share (udział tych partii w wycenie, %).
+    Ostatni rok wyceniany jest na koniec okresu planu.
+    """
+    currency = plan["currency"]
+    sales = ledger.sales_frame()
+    end = min(pd.Timestamp(engine.plan_end(plan)), data.index.max())
+    # close() domyka lata bez zdarzeń przed końcem - najpierw domknięcie, potem kopia stanów
+    closing = ledger.close(end)
+    year_ends = {**ledger.year_ends, end.year: closing}
+
+    rows = []
+    for year in range(min(year_ends), end.year + 1):
+        valuation_day = data.loc[:min(pd.Timestamp(year, 12, 31), end)].index.max()
+        prices = data.loc[valuation_day]
+        in_year = sales[sales["Date"].dt.year == year]
+        value = cost = aged_value = aged_cost = 0.0
+        for metal, (amount, open_cost, aged_amount, open_aged_cost) in year_ends[year].items():
+            sell_price = prices[engine.sell_column(data, metal, currency)] * (1 + plan["buyback"][metal] / 100)
+            value += amount * sell_price
+            cost += open_cost
+            aged_value += aged_amount * sell_price
+            aged_cost += open_aged_cost
+        realized = in_year["gain"].sum()
+        realized_taxfree = in_year["taxfree_gain"].sum()
+        rows.append({
+            "year": year,
+            "proceeds": in_year["proceeds"].sum(),
+            "cost": in_year["cost"].sum(),
+            "realized": realized,
+            "realized_taxfree": realized_taxfree,
+            "realized_taxable": realized - realized_taxfree,
+            "unrealized": value - cost,
+            "unrealized_taxfree": aged_value - aged_cost,
+            "taxfree_share": aged_value / value * 100 if value else 0.0,
+        })
+    return pd.DataFrame(rows).set_index("year")
+
+
+def tax_report(plan, data_version, progress=None):
+    """Raport roczny i zestawienie sprzedaży (zadanie dla jobs.Scheduler - dane wczytywane w procesie)"""
+    market = market_data.shared_market_data(data_version)
+    data = market.plan_prices(plan)
+    _, ledger = tax_lots(data, plan, progress=progress, inflation=market.inflation(plan["currency"]))
+    sales = ledger.sales_frame()
+    return {
+        "years": yearly_report(data, plan, ledger),
+        "sales": sales.groupby("reason")[["proceeds", "gain", "taxfree_gain"]].sum(),
+    }
@@ -0,0 +1,261 @@
+# tracker.py
+"""Bieżąca wycena planów w toku bez ponownej symulacji od initial_date.
+
+    python tracker.py import plany.csv --preset SSW-250609
+    python tracker.py update -o wyceny.csv
+
+Stan planu (ilości, zainwestowano, następny termin zakupu, daty ostatnich rebalancingów) zapisywany
+jest po ostatnim dniu, którego zdarzenia są już ostateczne - przedostatniej sesji w danych. Ostatnia
+sesja jest tymczasowa: simulate() przypisuje jej zakupy z terminów po końcu danych (najbliższa sesja),
+a po dopisaniu notowań te zakupy przesuwają się dalej. Aktualizacja przelicza więc tylko nowe dni:
+ostateczne zapisuje w stanie, ostatnią sesję liczy na kopii - wynik jest ten sam co pełna symulacja.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import bulk
+import engine
+import market_data
+import strategies
+from market_data import TROY_OUNCE_TO_GRAM
+
+STATE_FILE = "tracker_state.json"
+
+# Terminy zakupu generowane są do tylu dni za koniec danych (więcej niż odstęp kwartalny)
+TARGET_HORIZON_DAYS = 100
+
+DATE_KEYS = ("initial_date", "end_purchase_date", "rebalance_1_start", "rebalance_2_start",
+             "withdrawal_start", "withdrawal_end")
+
+MIN_DAYS_BETWEEN_REBALANCES = 30
+
+# Koniec okresu planów importowanych bez kolumny end_purchase_date (plany w toku)
+OPEN_END = pd.Timestamp(2099, 12, 31)
+
+
+# ====== STAN ======
+def new_entry(plan):
+    """Stan planu przed pierwszym zakupem"""
+    return {"plan": plan, "date": None, "anchor": None, "invested": 0.0, "holdings": [0.0] * len(plan["allocation"]),
+            "next_target": None, "last_rebalance": {"rebalance_1": None, "rebalance_2": None}, "storage_cost": 0.0}
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {"plans": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    for entry in state["plans"].values():
+        plan = entry["plan"]
+        for key in DATE_KEYS:
+            if key in plan:
+                plan[key] = pd.Timestamp(plan[key]).date()
+    return state
+
+
+def save_state(state, path=STATE_FILE):
+    """Zapis przez plik tymczasowy - przerwany zapis nie psuje poprzedniego stanu"""
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(state, f, default=str)
+    os.replace(temporary, path)
+
+
+def _day(value):
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+
+# ====== PRZELICZANIE NOWYCH DNI ======
+def advance(entry, days, prices, through, final=True, sell_prices=None):
+    """Przelicza dni po entry["date"] do pozycji through włącznie (days: datetime64[D], prices: sesje x metale planu;
+    sell_prices - ceny sprzedaży i wyceny, domyślnie prices).
+
+    final=True zapisuje w entry następny termin zakupu i kotwicę (ceny ostatniego dnia) - tylko dla dni
+    ostatecznych. Zmienia entry w miejscu.
+    """
+    plan = entry["plan"]
+    sell_prices = prices if sell_prices is None else sell_prices
+    metals = list(plan["allocation"])
+    weights = [plan["allocation"][m] for m in metals]
+    margin = np.array([1 + plan["margins"][m] / 100 for m in metals])
+    buyback = [1 + plan["buyback"][m] / 100 for m in metals]
+    markup = [1 + plan["rebalance_markup"][m] / 100 for m in metals]
+    initial_date, end_date = _day(plan["initial_date"]), _day(plan["end_purchase_date"])
+    start = int(np.searchsorted(days, initial_date, side="left"))
+    stop = int(np.searchsorted(days, end_date, side="right"))
+
+    if entry["date"] is None:
+        # Plan rusza, gdy dzień początkowy jest w przetwarzanym zakresie (zakup na najbliższej sesji)
+        if through < 0 or initial_date > days[through]:
+            return entry
+        initial_pos = int(engine.nearest_positions(days, np.array([initial_date]))[0])
+        entry["holdings"] = ((plan["initial_allocation"] * np.array(weights)) / (prices[initial_pos] * margin)).tolist()
+        entry["invested"] = float(plan["initial_allocation"])
+        entry["next_target"] = str(initial_date)
+        entry["date"] = str(initial_date - 1)
+
+    first = int(np.searchsorted(days, _day(entry["date"]), side="right"))
+    last = min(through, stop - 1)
+
+    # Terminy zakupu od pierwszego niewykorzystanego - najwyżej kilka na aktualizację
+    targets = positions = np.array([], dtype=np.int64)
+    if entry["next_target"] is not None and plan["purchase_freq"]:
+        horizon = min(end_date, days[through] + TARGET_HORIZON_DAYS)
+        targets = engine.purchase_targets(entry["next_target"], plan["purchase_freq"], plan["purchase_day"], horizon)
+        if len(targets):
+            positions = engine.nearest_positions(days, targets)
+
+    if first <= last:
+        holdings = np.array(entry["holdings"])
+        invested = entry["invested"]
+        window_days = days[first:last + 1]
+        masks = engine.calendar_masks(window_days, plan)
+        purchase = np.zeros(len(window_days), dtype=bool)
+        inside = positions[(positions >= max(first, start)) & (positions <= last)] - first
+        purchase[inside] = True
+        event_days = np.flatnonzero(purchase | masks["rebalance_1"] | masks["rebalance_2"] | masks["storage"])
+        amount = float(plan["purchase_amount"])
+        weight_array = np.array(weights)
+
+        for i in event_days.tolist():
+            pos = first + i
+            d = window_days[i]
+            day_prices = prices[pos]
+            price_list = sell_prices[pos].tolist()
+            if purchase[i]:
+                holdings += (amount * weight_array) / (day_prices * margin)
+                invested += amount
+            for label in ("rebalance_1", "rebalance_2"):
+                if not masks[label][i]:
+                    continue
+                last_date = entry["last_rebalance"][label]
+                if last_date is not None and (d - _day(last_date)).astype(np.int64) < MIN_DAYS_BETWEEN_REBALANCES:
+                    continue
+                row = holdings.tolist()
+                if not engine._rebalance_one(row, price_list, weights, buyback, markup,
+                                             plan[f"{label}_condition"], plan[f"{label}_threshold"], day_prices.tolist()):
+                    holdings = np.array(row)
+                    entry["last_rebalance"][label] = str(d)
+            if masks["storage"][i]:
+                window = []
+                if plan["storage_metal"] == "best_of_year":
+                    if plan["storage_fee_mode"] == "monthly":
+                        period_start = d.astype("datetime64[M]").astype("datetime64[D]")
+                    else:
+                        period_start = max(d.astype("datetime64[Y]").astype("datetime64[D]"), days[0])
+                    window = sell_prices[np.searchsorted(days, period_start, side="left"):pos + 1].tolist()
+                storage_cost = invested * (plan["storage_fee"] / 100) * (1 + plan["vat"] / 100)
+                entry["storage_cost"] += storage_cost
+                row = holdings.tolist()
+                engine._charge_storage_one(row, price_list, buyback, storage_cost, plan["storage_metal"], metals, window)
+                holdings = np.array(row)
+        entry["holdings"] = holdings.tolist()
+        entry["invested"] = invested
+
+    entry["date"] = str(days[through])
+    if final:
+        pending = targets[positions > through] if len(targets) else targets
+        entry["next_target"] = str(pending[0]) if len(pending) else None
+        entry["anchor"] = prices[through].tolist()
+    return entry
+
+
+def update_entry(entry, days, prices, sell_prices=None):
+    """Stan ostateczny do przedostatniej sesji i tymczasowy wynik na ostatnią: (entry, kopia na ostatnią sesję)"""
+    if entry["date"] is not None:
+        # Dane zmienione wstecz (brak dnia stanu lub inne ceny) - plan liczony od nowa
+        pos = int(np.searchsorted(days, _day(entry["date"]), side="left"))
+        if pos >= len(days) or days[pos] != _day(entry["date"]) or prices[pos].tolist() != entry["anchor"]:
+            entry.update(new_entry(entry["plan"]))
+    advance(entry, days, prices, len(days) - 2, sell_prices=sell_prices)
+    return entry, advance(copy.deepcopy(entry), days, prices, len(days) - 1, final=False, sell_prices=sell_prices)
+
+
+def update(state, prices_for):
+    """Przelicza wszystkie plany (prices_for(waluta, fix) -> DataFrame cen), zwraca tabelę wycen na ostatnią sesję"""
+    arrays = {}
+    rows = []
+    for plan_id, entry in state["plans"].items():
+        plan = entry["plan"]
+        metals = list(plan["allocation"])
+        fix = plan.get("execution_fix", market_data.DAILY_FIX)
+        key = (plan["currency"], fix, tuple(metals))
+        if key not in arrays:
+            data = prices_for(plan["currency"], fix)
+            arrays[key] = (engine._days(data.index),) + engine.price_matrices(data, metals, plan["currency"])
+        days, prices, sell_prices = arrays[key]
+        entry, current = update_entry(entry, days, prices, sell_prices)
+        holdings = np.array(current["holdings"])
+        values = sell_prices[-1] * np.array([1 + plan["buyback"][m] / 100 for m in metals]) * holdings
+        value = values[0]
+        for j in range(1, len(metals)):
+            value = value + values[j]
+        rows.append({
+            "id": plan_id,
+            "currency": plan["currency"],
+            "valuation_date": str(days[-1]),
+            "final_through": entry["date"],
+            "started": current["date"] is not None,
+            "invested": current["invested"],
+            **{f"{m}_g": holdings[j] * TROY_OUNCE_TO_GRAM for j, m in enumerate(metals)},
+            "portfolio_value": value,
+            "profit": value - current["invested"],
+            "storage_cost": current["storage_cost"],
+        })
+    return pd.DataFrame(rows)
+
+
+# ====== WIERSZ POLECEŃ ======
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bieżąca wycena planów w toku (przyrostowo)")
+    parser.add_argument("--state", default=STATE_FILE, help="plik stanu planów")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("import", help="dodaje plany z pliku CSV/Parquet (kolumny jak w bulk.py)")
+    add.add_argument("plans")
+    add.add_argument("--preset", required=True, help="preset z modelem kosztów")
+    run = commands.add_parser("update", help="przelicza nowe sesje i zapisuje wyceny")
+    run.add_argument("-o", "--output", default="wyceny.csv")
+    args = parser.parse_args(argv)
+
+    state = load_state(args.state)
+    market = market_data.shared_market_data()
+    if args.command == "import":
+        plans, errors = bulk.plans_from_frame(bulk.read_table(args.plans), bulk.load_template(args.preset),
+                                              OPEN_END, market.currencies)
+        # Stan przyrostowy obejmuje tylko fazę zakupów stałą kwotą - pozostałe plany liczy bulk.py
+        added = 0
+        for plan_id, plan in plans:
+            if engine.has_withdrawals(plan):
+                errors[plan_id] = "plany z wypłatami nie są obsługiwane"
+                continue
+            if not strategies.is_fixed(plan):
+                errors[plan_id] = "obsługiwana jest tylko stała kwota zakupu"
+                continue
+            state["plans"][str(plan_id)] = new_entry(plan)
+            added += 1
+        save_state(state, args.state)
+        print(f"Dodano planów: {added}, błędnych: {len(errors)}")
+        for plan_id, error in list(errors.items())[:10]:
+            print(f"  {plan_id}: {error}")
+        return 0
+
+    started = time.perf_counter()
+    results = update(state, market.prices)
+    elapsed = time.perf_counter() - started
+    save_state(state, args.state)
+    bulk.write_table(results, args.output)
+    print(f"Planów: {len(results)}, wycena na {market.index.max().date()}, {elapsed:.2f} s "
+          f"({elapsed / max(len(results), 1) * 1000:.2f} ms/plan) -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# warmer.py
+
+import os
+import json
+import time
+import threading
+
+import engine
+import market_data
+import profiling
+
+# Co ile sekund sprawdzana jest wersja danych (zmiana pliku cen -> ponowne rozgrzanie)
+CHECK_INTERVAL = 30.0
+# Pauza przy każdym raporcie postępu (co engine.PROGRESS_EVERY_DAYS dni) - oddaje GIL sesjom interaktywnym
+YIELD_PAUSE = 0.002
+# Niższy priorytet wątku rozgrzewającego (Linux: nice dla pojedynczego wątku)
+THREAD_NICE = 10
+# REB_CACHE_WARMER=0 wyłącza rozgrzewanie
+WARMER_ENV = "REB_CACHE_WARMER"
+
+
+class WarmAborted(Exception):
+    """Rozgrzewanie przerwane (nowa wersja danych lub zatrzymanie)"""
+
+
+def warmer_enabled():
+    return os.environ.get(WARMER_ENV, "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def load_preset_plans(folder):
+    """Plany wszystkich presetów z folderu (uszkodzone pliki są pomijane z komunikatem)"""
+    plans, errors = {}, {}
+    if not os.path.isdir(folder):
+        return plans, errors
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith(".json"):
+            continue
+        name = filename[:-5]
+        try:
+            with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
+                plans[name] = engine.plan_from_preset(json.load(f))
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            errors[name] = str(e)
+    return plans, errors
+
+
+class CacheWarmer:
+    """Wątek w tle, który przelicza presety (warm(plan, wersja, progress)) przy starcie i po zmianie danych"""
+
+    def __init__(self, warm, folder="presets", interval=CHECK_INTERVAL):
+        self._warm = warm
+        self.folder = folder
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target_version = None
+        self.status = {"state": "idle", "version": None, "done": 0, "total": 0, "current": None,
+                       "started": None, "finished": None, "presets": {}, "errors": {}}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="cache-warmer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self, version):
+        """Wersja danych widziana przez aplikację - nowa wersja budzi wątek od razu"""
+        with self._lock:
+            if version != self.status["version"] and version != self._target_version:
+                self._target_version = version
+                self._wake.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.status, "presets": dict(self.status["presets"]), "errors": dict(self.status["errors"])}
+
+    def _set(self, **changes):
+        with self._lock:
+            self.status.update(changes)
+
+    def _loop(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), THREAD_NICE)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.is_set():
+            version = market_data.data_version()
+            if version != self.status["version"]:
+                try:
+                    self._warm_all(version)
+                except WarmAborted:
+                    continue
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _progress(self, version):
+        def progress(fraction):
+            if self._stop.is_set() or (self._target_version not in (None, version)):
+                raise WarmAborted(version)
+            time.sleep(YIELD_PAUSE)
+        return progress
+
+    def _warm_all(self, version):
+        plans, errors = load_preset_plans(self.folder)
+        with self._lock:
+            self._target_version = version
+            self.status.update(state="warming", version=None, done=0, total=len(plans), current=None,
+                               started=time.time(), finished=None, presets={}, errors=errors)
+
+        with profiling.recording("cache_warmer", data_version=version, presets=len(plans)):
+            for name, plan in plans.items():
+                self._set(current=name)
+                started = time.perf_counter()
+                try:
+                    self._warm(plan, version, self._progress(version))
+                except WarmAborted:
+                    self._set(state="aborted", current=None)
+                    raise
+                except Exception as e:
+                    with self._lock:
+                        self.status["errors"][name] = f"{type(e).__name__}: {e}"
+                else:
+                    with self._lock:
+                        self.status["presets"][name] = round(time.perf_counter() - started, 3)
+                with self._lock:
+                    self.status["done"] += 1
+
+        self._set(state="warm", version=version, current=None, finished=time.time())